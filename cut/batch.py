@@ -0,0 +1,334 @@
+import vtk
+
+import numpy as np
+
+import bed
+import utils
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:
+    # Windows, the memory limit is not available
+    resource = None
+
+'''
+Description: Headless batch runner, runs a pipeline of steps on a list of series overnight.
+    python batch.py SERIES... --pipeline "load -> bed -> crop -> write" --output OUT [--processes 4] [--memory-limit 4096]
+    SERIES: DICOM series directories, SeriesInstanceUIDs (resolved with --dicom-root) or @file with one series per line
+    Steps:
+        load: read the DICOM series (vtkDICOMImageReader)
+        bed: remove the bed in place (bed.removeBedCached), the mask is cached per series in --cache
+        crop: crop to --crop-extent, or to the patient bounding box (+ --crop-margin voxels) after bed
+        write: write the volume to OUT/<series>.vti
+    The state file (OUT/batch_state.json) records the finished series, running again resumes after them. Every
+    series appends a line with its step times to the report (OUT/batch_report.csv).
+'''
+
+STEPS = ["load", "bed", "crop", "write"]
+
+'''
+Description: Parse a pipeline spec, steps separated by "->", "→" or ",".
+'''
+def parsePipeline(spec: str) -> List[str]:
+    for separator in ["->", "→"]:
+        spec = spec.replace(separator, ",")
+    steps = [step.strip().lower() for step in spec.split(",") if step.strip()]
+    unknownSteps = [step for step in steps if step not in STEPS]
+    if unknownSteps:
+        raise ValueError("Unknown steps: %s (available: %s)" % (", ".join(unknownSteps), ", ".join(STEPS)))
+    if not steps or steps[0] != "load":
+        raise ValueError("The pipeline must start with load")
+    return steps
+
+'''
+Description: Directories of the series, SeriesInstanceUIDs are looked up in the directories under dicomRoot.
+Return: list of (series key, directory)
+'''
+def resolveSeries(series: List[str], dicomRoot: Optional[str]) -> List[tuple]:
+    names = []
+    for name in series:
+        if name.startswith("@"):
+            with open(name[1:], encoding="utf-8") as file:
+                names.extend(line.strip() for line in file if line.strip() and not line.startswith("#"))
+        else:
+            names.append(name)
+
+    index = None
+    resolved = []
+    for name in names:
+        if os.path.isdir(name):
+            resolved.append((os.path.abspath(name), os.path.abspath(name)))
+            continue
+        if index is None:
+            index = indexSeries(dicomRoot) if dicomRoot else {}
+        if name not in index:
+            raise ValueError("Series not found: %s" % name)
+        resolved.append((name, index[name]))
+    return resolved
+
+'''
+Description: SeriesInstanceUID -> directory of every series directory under root.
+'''
+def indexSeries(root: str) -> Dict[str, str]:
+    index = {}
+    for directoryName, _, fileNames in os.walk(root):
+        if not fileNames:
+            continue
+        seriesUID = bed.readSeriesUID(directoryName)
+        if seriesUID:
+            index.setdefault(seriesUID, os.path.abspath(directoryName))
+    return index
+
+'''
+Description: Worker initializer, limit the address space of the worker process (megabytes). A series which needs
+    more fails with MemoryError instead of swapping the machine.
+'''
+def limitMemory(memoryLimitMb: Optional[int]) -> None:
+    if memoryLimitMb and resource is not None:
+        limit = memoryLimitMb * 2 ** 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def loadStep(context: dict, options: dict) -> None:
+    reader = vtk.vtkDICOMImageReader()
+    reader.SetDirectoryName(context["directory"])
+    reader.Update()
+    if reader.GetErrorCode() != 0 or reader.GetOutput().GetNumberOfPoints() == 0:
+        raise IOError("Can not read the DICOM series in %s" % context["directory"])
+    context["imageData"] = vtk.vtkImageData()
+    context["imageData"].ShallowCopy(reader.GetOutput())
+    context["seriesUID"] = bed.readSeriesUID(context["directory"])
+
+def bedStep(context: dict, options: dict) -> None:
+    context["packedMask"] = bed.removeBedCached(context["imageData"], context["seriesUID"], options["cache"], options["minimumSize"], options["downsampleFactor"], options["threshold"], options["fillValue"])
+
+def cropStep(context: dict, options: dict) -> None:
+    imageData = context["imageData"]
+    wholeExtent = list(imageData.GetExtent())
+    if options["cropExtent"] is not None:
+        extent = utils.intersectExtents(options["cropExtent"], wholeExtent)
+    else:
+        if "packedMask" in context:
+            # Bounding box of the patient from the packed mask, without unpacking the volume
+            packedMask = context["packedMask"]
+            rows = np.any(packedMask, axis=2)
+            columns = np.unpackbits(np.bitwise_or.reduce(packedMask, axis=(0, 1)), count=wholeExtent[1] - wholeExtent[0] + 1)
+            extent = [0, -1, 0, -1, 0, -1]
+            for index, profile in enumerate([columns, rows.any(axis=0), rows.any(axis=1)]):
+                indices = np.flatnonzero(profile)
+                if len(indices) == 0:
+                    raise ValueError("Empty patient mask")
+                extent[2 * index] = wholeExtent[2 * index] + int(indices[0])
+                extent[2 * index + 1] = wholeExtent[2 * index] + int(indices[-1])
+        else:
+            extent = utils.getNonZeroExtent(utils.getArrayView(imageData) != options["fillValue"], wholeExtent)
+        margin = options["cropMargin"]
+        extent = utils.intersectExtents([value + (margin if index % 2 else -margin) for index, value in enumerate(extent)], wholeExtent)
+    if utils.isEmptyExtent(extent):
+        raise ValueError("Empty crop extent %s" % extent)
+    utils.cropImageData(imageData, extent)
+    context.pop("packedMask", None)
+
+def writeStep(context: dict, options: dict) -> None:
+    name = context["seriesUID"] or os.path.basename(os.path.normpath(context["directory"]))
+    path = os.path.join(options["output"], name + ".vti")
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetFileName(path + ".tmp")
+    writer.SetInputData(context["imageData"])
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    if writer.Write() != 1:
+        raise IOError("Can not write %s" % path)
+    os.replace(path + ".tmp", path)
+    context["outputPath"] = path
+
+STEP_FUNCTIONS = {"load": loadStep, "bed": bedStep, "crop": cropStep, "write": writeStep}
+
+'''
+Description: Run the pipeline on one series (in a worker process).
+Return: report of the series: status, time of each step (s), peak memory of the worker and its growth during the
+    series (MB, only when the worker process runs a single series, see getPoolOptions), output, error
+'''
+def runSeries(key: str, directory: str, steps: List[str], options: dict) -> dict:
+    report = {"series": key, "status": "done", "error": "", "output": ""}
+    context = {"directory": directory}
+    if resource is not None:
+        # Peak of the new worker before the series (interpreter, VTK and numpy)
+        baselineMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for step in steps:
+        stepStart = time.perf_counter()
+        try:
+            STEP_FUNCTIONS[step](context, options)
+        except Exception as exception:
+            report["status"] = "failed"
+            report["error"] = "%s: %s" % (step, "".join(traceback.format_exception_only(type(exception), exception)).strip())
+            break
+        finally:
+            report[step] = round(time.perf_counter() - stepStart, 3)
+    report["total"] = round(time.perf_counter() - start, 3)
+    report["output"] = context.get("outputPath", "")
+    if resource is not None and options.get("workerPerSeries"):
+        # kB on Linux, ru_maxrss is the peak of the whole process: only meaningful in a new worker
+        peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report["peakMemoryMb"] = round(peakMemory / 1024, 1)
+        report["seriesMemoryMb"] = round((peakMemory - baselineMemory) / 1024, 1)
+    return report
+
+'''
+Description: Finished series of a previous run, {series key: report}.
+'''
+def loadState(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def saveState(path: str, state: dict) -> None:
+    # Write then rename, a crash while saving keeps the previous state
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+def appendReport(path: str, steps: List[str], report: dict) -> None:
+    fields = ["series", "status"] + steps + ["total", "peakMemoryMb", "seriesMemoryMb", "output", "error"]
+    newFile = not os.path.isfile(path)
+    with open(path, "a", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fields, extrasaction="ignore")
+        if newFile:
+            writer.writeheader()
+        writer.writerow(report)
+
+'''
+Description: Options of the process pool: a new worker process for each series (Python 3.11+). The peak memory
+    of the worker is then the peak of its series, and the memory of a series goes back to the system when it
+    finishes. Older versions reuse the workers, the peak memory is not reported.
+'''
+def getPoolOptions() -> dict:
+    if sys.version_info >= (3, 11):
+        return {"max_tasks_per_child": 1}
+    return {}
+
+'''
+Description: Run the series in a process pool, at most numberOfProcesses series at a time. When a worker dies
+    (killed by the system, crash in VTK) the pool is restarted, the series which were running are retried up to
+    maxAttempts times and then recorded as failed.
+'''
+def runBatch(series: List[tuple], steps: List[str], options: dict, numberOfProcesses: int, memoryLimitMb: Optional[int], maxAttempts=2) -> List[dict]:
+    statePath = os.path.join(options["output"], "batch_state.json")
+    reportPath = os.path.join(options["output"], "batch_report.csv")
+    state = loadState(statePath)
+    pending = [(key, directory) for key, directory in series if state.get(key, {}).get("status") != "done" and not (options["skipFailed"] and key in state)]
+    print("%d series, %d skipped (previous run), %d to run" % (len(series), len(series) - len(pending), len(pending)))
+
+    def finish(report: dict) -> None:
+        state[report["series"]] = report
+        saveState(statePath, state)
+        appendReport(reportPath, steps, report)
+        print("%-60s %-6s %7.2f s %s" % (report["series"][-60:], report["status"], report.get("total", 0.0), report["error"]))
+
+    poolOptions = getPoolOptions()
+    options = dict(options, workerPerSeries="max_tasks_per_child" in poolOptions)
+    reports = []
+    attempts = {}
+    while pending:
+        inFlight = []
+        with ProcessPoolExecutor(numberOfProcesses, initializer=limitMemory, initargs=(memoryLimitMb,), **poolOptions) as executor:
+            running = {}
+            broken = False
+            while (pending or running) and not broken:
+                while pending and len(running) < numberOfProcesses:
+                    key, directory = pending.pop(0)
+                    try:
+                        running[executor.submit(runSeries, key, directory, steps, options)] = (key, directory)
+                    except BrokenProcessPool:
+                        pending.insert(0, (key, directory))
+                        broken = True
+                        break
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, directory = running.pop(future)
+                    try:
+                        report = future.result()
+                    except BrokenProcessPool:
+                        inFlight.append((key, directory))
+                        broken = True
+                        continue
+                    reports.append(report)
+                    finish(report)
+            inFlight.extend(running.values())
+
+        for key, directory in inFlight:
+            attempts[key] = attempts.get(key, 0) + 1
+            if attempts[key] < maxAttempts:
+                pending.append((key, directory))
+            else:
+                report = {"series": key, "status": "failed", "error": "worker process died (memory limit or crash)"}
+                reports.append(report)
+                finish(report)
+    return reports
+
+def parseExtent(text: str) -> List[int]:
+    extent = [int(value) for value in text.split(",")]
+    if len(extent) != 6:
+        raise argparse.ArgumentTypeError("expected i0,i1,j0,j1,k0,k1")
+    return extent
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch bed removal, cropping and masking of DICOM series")
+    parser.add_argument("series", nargs="+", help="series directories, SeriesInstanceUIDs or @file with one series per line")
+    parser.add_argument("--pipeline", default="load -> bed -> crop -> write", help="steps: %s" % ", ".join(STEPS))
+    parser.add_argument("--output", required=True, help="output directory (volumes, state and report)")
+    parser.add_argument("--dicom-root", help="directory searched for the series given by SeriesInstanceUID")
+    parser.add_argument("--cache", help="bed mask cache directory (default: OUTPUT/cache)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-limit", type=int, help="address space limit of each worker process (MB)")
+    parser.add_argument("--threshold", type=float, default=-50, help="bed removal threshold (HU)")
+    parser.add_argument("--minimum-size", type=int, default=1000, help="bed removal minimum island size (voxels)")
+    parser.add_argument("--downsample-factor", type=int, default=4, help="bed removal coarse-to-fine factor")
+    parser.add_argument("--fill-value", type=float, default=-1000, help="value of the removed voxels")
+    parser.add_argument("--crop-extent", type=parseExtent, help="crop box i0,i1,j0,j1,k0,k1 (default: patient bounding box)")
+    parser.add_argument("--crop-margin", type=int, default=2, help="margin of the patient bounding box (voxels)")
+    parser.add_argument("--skip-failed", action="store_true", help="do not retry the series which failed in a previous run")
+    arguments = parser.parse_args()
+
+    try:
+        steps = parsePipeline(arguments.pipeline)
+        series = resolveSeries(arguments.series, arguments.dicom_root)
+    except (ValueError, OSError) as exception:
+        parser.error(str(exception))
+    if arguments.memory_limit and resource is None:
+        print("--memory-limit is not supported on this platform, ignored", file=sys.stderr)
+
+    os.makedirs(arguments.output, exist_ok=True)
+    options = {
+        "output": arguments.output,
+        "cache": arguments.cache or os.path.join(arguments.output, "cache"),
+        "threshold": arguments.threshold,
+        "minimumSize": arguments.minimum_size,
+        "downsampleFactor": arguments.downsample_factor,
+        "fillValue": arguments.fill_value,
+        "cropExtent": arguments.crop_extent,
+        "cropMargin": arguments.crop_margin,
+        "skipFailed": arguments.skip_failed,
+    }
+    start = time.perf_counter()
+    reports = runBatch(series, steps, options, arguments.processes, arguments.memory_limit)
+    failed = sum(report["status"] != "done" for report in reports)
+    print("%d series in %.1f s, %d failed" % (len(reports), time.perf_counter() - start, failed))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,166 @@
 import vtk
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
-import vtkITK
+try:
+    import vtkITK
+except ImportError:
+    # vtkITK only ships with 3D Slicer
+    vtkITK = None
+
+import numpy as np
 
 # import utils
+import labeling
 
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 import math
+import os
+import hashlib
+import io
+import struct
+import zlib
+
+# Bump when the output of splitSegments changes, invalidates the cached masks
+BED_MASK_VERSION = 4
+
+'''
+Description: Voxel count and bounding extent of every label of a (z, y, x) label array (0 is the background),
+    computed in one pass over z-slabs with memory in the number of labels, not labels x planes: the labels of each
+    slab are run-length encoded along x (like labeling.encodeRuns), the runs give the voxel counts with bincount
+    and the extents with np.minimum.at / np.maximum.at. The masks of the labels are only computed on request,
+    restricted to their extents.
+Params:
+    labelArray: unsigned int labels, e.g. the output of vtkITKIslandMath
+    spacing: (x, y, z) spacing of the image in mm
+'''
+class LabelStatistics():
+    def __init__(self, labelArray: np.ndarray, spacing=(1.0, 1.0, 1.0), slabSize=16) -> None:
+        self.labelArray = labelArray
+        self.voxelVolume = float(np.prod(spacing))
+        nz, ny, nx = labelArray.shape
+        numberOfLabels = int(labelArray.max()) + 1 if labelArray.size > 0 else 1
+
+        counts = np.zeros(numberOfLabels, dtype=np.int64)
+        # (i, j, k) minimum and maximum of each label
+        minimums = np.full((3, numberOfLabels), np.iinfo(np.int64).max, dtype=np.int64)
+        maximums = np.full((3, numberOfLabels), -1, dtype=np.int64)
+        for z0 in range(0, nz, slabSize):
+            rows = labelArray[z0:z0 + slabSize].reshape(-1, nx)
+            # A run starts (ends) where the previous (next) voxel of the row has another label
+            changed = rows[:, 1:] != rows[:, :-1]
+            isStart = rows > 0
+            isEnd = isStart.copy()
+            isStart[:, 1:] &= changed
+            isEnd[:, :-1] &= changed
+            del changed
+            runRows, runStarts = np.divmod(np.flatnonzero(isStart), nx)
+            del isStart
+            runEnds = np.flatnonzero(isEnd) % nx
+            del isEnd
+            runLabels = rows[runRows, runStarts]
+
+            counts += np.bincount(runLabels, weights=runEnds - runStarts + 1, minlength=numberOfLabels).astype(np.int64)
+            planes, runRows = np.divmod(runRows, ny)
+            for axis, first, last in ((0, runStarts, runEnds), (1, runRows, runRows), (2, planes + z0, planes + z0)):
+                np.minimum.at(minimums[axis], runLabels, first)
+                np.maximum.at(maximums[axis], runLabels, last)
+
+        # Labels present in the volume, largest first (ties by label value)
+        self.labelValues = np.flatnonzero(counts[1:]) + 1
+        self.labelValues = self.labelValues[np.argsort(-counts[self.labelValues], kind="stable")]
+        self.voxelCounts = counts[self.labelValues]
+        self.volumes = self.voxelCounts * self.voxelVolume
+
+        # [i0, i1, j0, j1, k0, k1] per label, inclusive like vtkImageData extents
+        self.extents = np.zeros((len(self.labelValues), 6), dtype=np.int64)
+        self.extents[:, 0::2] = minimums[:, self.labelValues].T
+        self.extents[:, 1::2] = maximums[:, self.labelValues].T
+
+    def getNumberOfLabels(self) -> int:
+        return len(self.labelValues)
+
+    '''
+    Description: The numberOfLabels largest labels, all labels if numberOfLabels <= 0.
+    '''
+    def selectLargest(self, numberOfLabels: int) -> np.ndarray:
+        if numberOfLabels <= 0:
+            return self.labelValues
+        return self.labelValues[:numberOfLabels]
+
+    '''
+    Description: Labels with a volume of at least minimumVolume mm3, largest first.
+    '''
+    def selectByVolume(self, minimumVolume: float) -> np.ndarray:
+        return self.labelValues[self.volumes >= minimumVolume]
 
-def GetAllLabelValues(labels: vtk.vtkIntArray, labelmap: vtk.vtkImageData) -> None:
-    dimensions = labelmap.GetDimensions()
-    if dimensions[0] <= 0 or dimensions[1] <= 0 or dimensions[2] <= 0:
-        # labelmap is empty, there are no label values
-        # Running vtkImageAccumulate would cause a crash
-        return
-
-    scalarRange = labelmap.GetScalarRange()
-    lowLabel = math.floor(scalarRange[0])
-    highLabel = math.ceil(scalarRange[1])
-
-    imageAccumulate = vtk.vtkImageAccumulate()
-    imageAccumulate.SetInputData(labelmap)
-    imageAccumulate.IgnoreZeroOn()
-    imageAccumulate.SetComponentExtent(lowLabel, highLabel, 0, 0, 0, 0)
-    imageAccumulate.SetComponentOrigin(0, 0, 0)
-    imageAccumulate.SetComponentSpacing(1, 1, 1)
-    imageAccumulate.Update()
-
-    # print(imageAccumulate.GetOutput().GetPointData().GetScalars().GetTuple1(0))
-    # print(vtk_to_numpy(imageAccumulate.GetOutput().GetPointData().GetScalars()))
-    # print(imageAccumulate.GetVoxelCount()) # số voxel khác 0 
-
-    for label in range(lowLabel, highLabel + 1):
-        if label == 0:
-            continue
-        frequency = imageAccumulate.GetOutput().GetPointData().GetScalars().GetTuple1(label - lowLabel)
-        if frequency == 0:
-            continue
-        labels.InsertNextValue(label)
+    '''
+    Description: Bounding extent of a set of labels.
+    '''
+    def getExtent(self, labelValues: np.ndarray) -> List[int]:
+        extents = self.extents[np.isin(self.labelValues, labelValues)]
+        if len(extents) == 0:
+            return [0, -1, 0, -1, 0, -1]
+        return [int(extents[:, 0].min()), int(extents[:, 1].max()), int(extents[:, 2].min()), int(extents[:, 3].max()), int(extents[:, 4].min()), int(extents[:, 5].max())]
+
+    '''
+    Description: Binary (z, y, x) mask of a set of labels, only the bounding extent of the labels is compared.
+    '''
+    def getMask(self, labelValues: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.labelArray.shape, dtype=bool)
+        labelValues = np.atleast_1d(labelValues)
+        if len(labelValues) == 0:
+            return mask
+        i0, i1, j0, j1, k0, k1 = self.getExtent(labelValues)
+        region = (slice(k0, k1 + 1), slice(j0, j1 + 1), slice(i0, i1 + 1))
+        if len(labelValues) == 1:
+            np.equal(self.labelArray[region], labelValues[0], out=mask[region])
+        elif np.array_equal(np.sort(labelValues), np.arange(1, len(labelValues) + 1)):
+            # The N largest islands of vtkITKIslandMath are the labels 1..N
+            labels = self.labelArray[region]
+            mask[region] = (labels > 0) & (labels <= len(labelValues))
+        else:
+            mask[region] = np.isin(self.labelArray[region], labelValues)
+        return mask
+
+    '''
+    Description: One mask per label, computed when the iteration reaches it.
+    '''
+    def iterateMasks(self, labelValues: np.ndarray):
+        for labelValue in labelValues:
+            yield int(labelValue), self.getMask(labelValue)
+
+'''
+Description: Labels kept by splitSegments, the maxNumberOfSegments largest islands and, with minimumVolume,
+    only the islands of at least minimumVolume mm3.
+'''
+def selectLabels(statistics: LabelStatistics, maxNumberOfSegments=1, split=True, minimumVolume=None) -> np.ndarray:
+    if not split and maxNumberOfSegments <= 0:
+        labelValues = statistics.selectLargest(0)
+    else:
+        labelValues = statistics.selectLargest(max(1, maxNumberOfSegments))
+    if minimumVolume is not None:
+        labelValues = labelValues[np.isin(labelValues, statistics.selectByVolume(minimumVolume))]
+    return labelValues
+
+'''
+Description: Unsigned char vtkImageData with the geometry of imageData from a (z, y, x) mask.
+'''
+def createMaskImage(imageData: vtk.vtkImageData, maskArray: np.ndarray) -> vtk.vtkImageData:
+    maskImage = vtk.vtkImageData()
+    maskImage.SetExtent(imageData.GetExtent())
+    maskImage.SetOrigin(imageData.GetOrigin())
+    maskImage.SetSpacing(imageData.GetSpacing())
+    maskImage.SetDirectionMatrix(imageData.GetDirectionMatrix())
+    maskImage.GetPointData().SetScalars(numpy_to_vtk(np.ascontiguousarray(maskArray).view(np.uint8).ravel(), array_type=vtk.VTK_UNSIGNED_CHAR))
+    return maskImage
+
+'''
+Description: vtkITKIslandMath when running inside 3D Slicer, the native run-length labeling otherwise.
+'''
+def createIslandMath():
+    if vtkITK is None:
+        return labeling.IslandMath()
+    return vtkITK.vtkITKIslandMath()
 
 """
 Description: Thresholding for origin image
@@ -54,9 +178,35 @@ def imageThreshold(imageData: vtk.vtkImageData, imageThresh=-50) -> vtk.vtkImage
 
     return thresh.GetOutput() # vtkImageData
 
-def splitSegments(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegments=1, split=True):
+'''
+Description: Keep the patient and remove the bed (and other small islands).
+Params:
+    minimumSize: islands smaller than minimumSize voxels are removed
+    maxNumberOfSegments: number of islands to keep, largest first
+    downsampleFactor: 1 labels the islands at full resolution, 2 or 4 use the coarse-to-fine mode
+        (see splitSegmentsCoarseToFine)
+    imageThresh: voxels >= imageThresh (HU) are candidates for the islands
+    minimumVolume: only keep the islands of at least minimumVolume mm3 (among the maxNumberOfSegments largest)
+    useProjection: find the patient and the table with 2D projections and only label the islands near the
+        table (see splitSegmentsProjection), when only the patient is kept
+    engine: "islands" labels 3D islands, "slices" labels each axial slice in a process pool and keeps the
+        patient (see splitSegmentsSlices), only maxNumberOfSegments = 1
+Return: vtkImageData (unsigned char), 1 inside the kept islands
+'''
+def splitSegments(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegments=1, split=True, downsampleFactor=1, imageThresh=-50, minimumVolume=None, useProjection=False, engine="islands"):
+    if engine == "slices":
+        if not split or maxNumberOfSegments != 1 or minimumVolume is not None:
+            raise ValueError("The slices engine only keeps the patient")
+        return splitSegmentsSlices(imageData, imageThresh)
+    if engine != "islands":
+        raise ValueError("Unknown bed removal engine: %s" % engine)
+    if useProjection and split and maxNumberOfSegments == 1 and minimumVolume is None:
+        return splitSegmentsProjection(imageData, minimumSize, imageThresh)
+    if downsampleFactor > 1:
+        return splitSegmentsCoarseToFine(imageData, minimumSize, maxNumberOfSegments, split, downsampleFactor, imageThresh, minimumVolume)
+
     # modifierlabelmap
-    selectedSegmentLabelmap = imageThreshold(imageData)
+    selectedSegmentLabelmap = imageThreshold(imageData, imageThresh)
     
     # Change scalar type of image data
     castIn = vtk.vtkImageCast()
@@ -65,7 +215,7 @@ def splitSegments(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegm
     castIn.Update()
 
     # Xác định các island trong inverted volume và tìm pixel tương ứng với background
-    islandMath = vtkITK.vtkITKIslandMath()
+    islandMath = createIslandMath()
     islandMath.SetInputConnection(castIn.GetOutputPort())
     islandMath.SetFullyConnected(False)
     islandMath.SetMinimumSize(minimumSize)
@@ -74,61 +224,670 @@ def splitSegments(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegm
     # print(islandMath.GetOutput().GetScalarRange()) # (0, 2)
     # print(islandMath.GetOutput()) # vtkImageData
     
-    islandImage = vtk.vtkImageData()
-    islandImage.DeepCopy(islandMath.GetOutput())
-    # print(islandImage)
-
     # islandCount = islandMath.GetNumberOfIslands()
     # islandOrigCount = islandMath.GetOriginalNumberOfIslands()
     # ignoredIslands = islandOrigCount - islandCount
     # print(islandOrigCount)
 
-    labelValues = vtk.vtkIntArray()
-    GetAllLabelValues(labelValues, islandImage)
-    # print(labelValues.GetTuple1(1))
-    # print(vtk_to_numpy(labelValues))
-    # print(labelValues.GetNumberOfTuples()) # size of array
-
-    for i in range(labelValues.GetNumberOfTuples()):
-        if maxNumberOfSegments > 0 and i >= maxNumberOfSegments:
-            break
-
-        labelValue = int(labelValues.GetTuple1(i))
-        
-        threshold = vtk.vtkImageThreshold()
-        threshold.SetInputData(islandMath.GetOutput())
-        if not split and maxNumberOfSegments <= 0:
-            threshold.ThresholdByLower(0)
-            threshold.SetInValue(0)
-            threshold.SetOutValue(1)
+    dimensions = imageData.GetDimensions()
+    labelArray = vtk_to_numpy(islandMath.GetOutput().GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+    statistics = LabelStatistics(labelArray, imageData.GetSpacing())
+    labelValues = selectLabels(statistics, maxNumberOfSegments, split, minimumVolume)
+
+    return createMaskImage(imageData, statistics.getMask(labelValues))
+
+'''
+Description: Label the islands of a binary (z, y, x) array with vtkITKIslandMath or its native replacement (face connected).
+Return: uint32 labels, 1 is the largest island, islands smaller than minimumSize are 0
+'''
+def labelIslands(binaryArray: np.ndarray, minimumSize: int) -> np.ndarray:
+    if vtkITK is None:
+        # Same as labeling.IslandMath without the copies into vtkImageData
+        return labeling.labelIslands(binaryArray, False, minimumSize)[0]
+    binaryImage = vtk.vtkImageData()
+    binaryImage.SetDimensions(binaryArray.shape[2], binaryArray.shape[1], binaryArray.shape[0])
+    binaryImage.GetPointData().SetScalars(numpy_to_vtk(binaryArray.astype(np.uint32).ravel(), deep=True))
+
+    islandMath = createIslandMath()
+    islandMath.SetInputData(binaryImage)
+    islandMath.SetFullyConnected(False)
+    islandMath.SetMinimumSize(minimumSize)
+    islandMath.Update()
+    return vtk_to_numpy(islandMath.GetOutput().GetPointData().GetScalars()).reshape(binaryArray.shape)
+
+'''
+Description: Flat indices of the voxels [start, end) of runs in an array of rows of rowLength voxels.
+'''
+def getRunIndices(rows: np.ndarray, starts: np.ndarray, ends: np.ndarray, rowLength: int) -> np.ndarray:
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(rows * rowLength + starts - offsets, lengths) + np.arange(int(lengths.sum()))
+
+'''
+Description: Islands of the threshold of a volume at full resolution (6-connectivity), coarse-to-fine. The threshold
+    is run-length encoded along x one slab of factor planes at a time, the full resolution threshold and labels are
+    never stored.
+    Pass 1: Solid blocks: blocks of factor³ voxels which are all above the threshold, i.e. covered by a run in each of
+            their factor² rows. Face neighbor solid blocks are connected at full resolution, their islands are labeled
+            on the coarse grid. A block with a single voxel under the threshold is not solid, so thin gaps (e.g.
+            between the patient and the table) never join two coarse islands.
+    Pass 2: Band: the runs are cut at the solid blocks, the remaining pieces (surface of the patient, table, thin
+            structures) of all slabs are labeled in one labeling.labelRuns call. The pieces which touch a solid block
+            across a face are joined with its coarse island (union-find), which gives the full resolution islands
+            with their voxel counts.
+    getMask thresholds a slab again and clears the pieces and the solid blocks of the islands which are not selected.
+Params:
+    inputArray: (z, y, x) volume
+'''
+class BlockIslands():
+    def __init__(self, inputArray: np.ndarray, imageThresh=-50, factor=4) -> None:
+        self.inputArray = inputArray
+        self.imageThresh = imageThresh
+        self.factor = factor
+        nz, ny, nx = inputArray.shape
+        self.coarseShape = cz, cy, cx = tuple(math.ceil(size / factor) for size in inputArray.shape)
+        self.slabThreshold = np.zeros((factor, cy * factor, cx * factor), dtype=bool)
+
+        # Pass 1, blocks of the last plane, row or column which are cut by the image are never solid
+        solidArray = np.zeros(self.coarseShape, dtype=bool)
+        pieceRows, pieceStarts, pieceEnds = [], [], []
+        self.pieceOffsets = np.zeros(cz + 1, dtype=np.int64)
+        for k in range(cz):
+            z0 = k * factor
+            planes = min(factor, nz - z0)
+            runRows, runStarts, runEnds = labeling.encodeRuns(self.getThreshold(k)[:planes, :ny, :nx])
+            blockRows = runRows % ny // factor
+            if planes == factor:
+                # Count the runs which cover each block with a difference array along the block columns
+                firstColumns = -(-runStarts // factor)
+                lastColumns = runEnds // factor
+                covering = lastColumns > firstColumns
+                keys = blockRows[covering] * (cx + 1)
+                differences = np.bincount(keys + firstColumns[covering], minlength=cy * (cx + 1)) - np.bincount(keys + lastColumns[covering], minlength=cy * (cx + 1))
+                solidArray[k] = np.cumsum(differences.reshape(cy, cx + 1), axis=1)[:, :cx] == factor * factor
+            rows, starts, ends = self.cutRuns(runRows, runStarts, runEnds, blockRows, solidArray[k])
+            pieceRows.append(rows + z0 * ny)
+            pieceStarts.append(starts)
+            pieceEnds.append(ends)
+            self.pieceOffsets[k + 1] = self.pieceOffsets[k] + len(rows)
+        self.coarseLabels = labelIslands(solidArray, 0)
+        del solidArray
+        self.numberOfCoarseIslands = int(self.coarseLabels.max()) if self.coarseLabels.size > 0 else 0
+        self.pieceRows = np.concatenate(pieceRows)
+        self.pieceStarts = np.concatenate(pieceStarts)
+        self.pieceEnds = np.concatenate(pieceEnds)
+
+        # Pass 2: nodes 0 .. numberOfCoarseIslands - 1 are the coarse islands, the pieces follow
+        numberOfCoarseIslands = self.numberOfCoarseIslands
+        pieceParent = labeling.labelRuns(self.pieceRows, self.pieceStarts, self.pieceEnds, inputArray.shape)
+        coarseIslands, pieces = self.linkPieces()
+        parent = np.concatenate([np.arange(numberOfCoarseIslands), pieceParent + numberOfCoarseIslands])
+        self.parent = labeling.unionFind(parent, coarseIslands, pieces + numberOfCoarseIslands)
+        nodeSizes = np.concatenate([
+            np.bincount(self.coarseLabels.ravel(), minlength=numberOfCoarseIslands + 1)[1:] * factor ** 3,
+            self.pieceEnds - self.pieceStarts
+        ])
+        self.sizes = np.bincount(self.parent, weights=nodeSizes, minlength=len(parent)).astype(np.int64)
+        self.keepNode = np.zeros(len(parent), dtype=bool)
+
+    '''
+    Description: Threshold of the slab k (planes k * factor ...), padded with False to a multiple of factor.
+        The returned array is reused by the next call.
+    '''
+    def getThreshold(self, k: int) -> np.ndarray:
+        nz, ny, nx = self.inputArray.shape
+        z0 = k * self.factor
+        planes = min(self.factor, nz - z0)
+        self.slabThreshold[planes:] = False
+        np.greater_equal(self.inputArray[z0:z0 + planes], self.imageThresh, out=self.slabThreshold[:planes, :ny, :nx])
+        return self.slabThreshold
+
+    '''
+    Description: Cut the runs of a slab at the solid blocks of the slab, only the pieces which are not empty are kept.
+        An interval of solid blocks is all above the threshold in each of its rows, so it lies inside a single run:
+        the intervals of a run are the ones which start in it.
+    '''
+    def cutRuns(self, runRows: np.ndarray, runStarts: np.ndarray, runEnds: np.ndarray, blockRows: np.ndarray, solid: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        factor = self.factor
+        intervalRows, intervalStarts, intervalEnds = labeling.encodeRuns(solid[np.newaxis])
+        if len(intervalRows) == 0:
+            return runRows, runStarts, runEnds
+        rowStride = solid.shape[1] + 1
+        keys = intervalRows * rowStride + intervalStarts
+        first = np.searchsorted(keys, blockRows * rowStride - (-runStarts // factor))
+        last = np.searchsorted(keys, blockRows * rowStride - (-runEnds // factor))
+
+        # A run with n intervals has n + 1 pieces: before the first interval, between the intervals, after the last one
+        counts = last - first + 1
+        runs = np.repeat(np.arange(len(runRows)), counts)
+        index = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        interval = first[runs] + index
+        previousInterval = np.clip(interval - 1, 0, len(keys) - 1)
+        nextInterval = np.minimum(interval, len(keys) - 1)
+        starts = np.where(index == 0, runStarts[runs], intervalEnds[previousInterval] * factor)
+        ends = np.where(index == counts[runs] - 1, runEnds[runs], intervalStarts[nextInterval] * factor)
+        nonEmpty = starts < ends
+        return runRows[runs[nonEmpty]], starts[nonEmpty], ends[nonEmpty]
+
+    '''
+    Description: Links (coarse island - 1, piece) of the pieces which touch a solid block across a face. Along x a piece
+        can only touch the block of the voxel before its start or at its end. Along y (z) it only touches blocks of
+        the neighbor block row (plane) when it lies on the first or last voxel row (plane) of its block, the blocks
+        of the block columns of the piece.
+    '''
+    def linkPieces(self) -> Tuple[np.ndarray, np.ndarray]:
+        factor = self.factor
+        nz, ny, nx = self.inputArray.shape
+        _, cy, cx = self.coarseShape
+        z, y = np.divmod(self.pieceRows, ny)
+        starts, ends = self.pieceStarts, self.pieceEnds
+        pieces = np.arange(len(starts))
+        blockRows = z // factor * cy + y // factor
+
+        neighborPieces, neighborBlocks = [], []
+        before = starts > 0
+        neighborPieces.append(pieces[before])
+        neighborBlocks.append(blockRows[before] * cx + (starts[before] - 1) // factor)
+        after = ends < nx
+        neighborPieces.append(pieces[after])
+        neighborBlocks.append(blockRows[after] * cx + ends[after] // factor)
+
+        firstColumns, lastColumns = starts // factor, (ends - 1) // factor + 1
+        for selected, neighborRows in (
+                ((y % factor == factor - 1) & (y + 1 < ny), blockRows + 1),
+                ((y % factor == 0) & (y > 0), blockRows - 1),
+                ((z % factor == factor - 1) & (z + 1 < nz), blockRows + cy),
+                ((z % factor == 0) & (z > 0), blockRows - cy)):
+            neighborPieces.append(np.repeat(pieces[selected], lastColumns[selected] - firstColumns[selected]))
+            neighborBlocks.append(getRunIndices(neighborRows[selected], firstColumns[selected], lastColumns[selected], cx))
+
+        coarseIslands = self.coarseLabels.ravel()[np.concatenate(neighborBlocks)].astype(np.int64)
+        neighborPieces = np.concatenate(neighborPieces)
+        touching = coarseIslands > 0
+        return coarseIslands[touching] - 1, neighborPieces[touching]
+
+    '''
+    Description: Keep the maxNumberOfSegments largest islands, of at least minimumSize voxels and minimumVolume mm3
+        (same selection as selectLabels).
+    '''
+    def select(self, minimumSize=1000, maxNumberOfSegments=1, split=True, minimumVolume=None, spacing=(1.0, 1.0, 1.0)) -> None:
+        # Islands largest first (ties by root)
+        islands = np.flatnonzero(self.sizes >= max(1, minimumSize))
+        islands = islands[np.argsort(-self.sizes[islands], kind="stable")]
+        if split or maxNumberOfSegments > 0:
+            islands = islands[:max(1, maxNumberOfSegments)]
+        if minimumVolume is not None:
+            islands = islands[self.sizes[islands] * float(np.prod(spacing)) >= minimumVolume]
+        self.keepNode = np.isin(self.parent, islands)
+
+    '''
+    Description: Mask of the selected islands in the slab k, padded like getThreshold and reused by the next call.
+    '''
+    def getMask(self, k: int) -> np.ndarray:
+        factor = self.factor
+        ny = self.inputArray.shape[1]
+        _, cy, cx = self.coarseShape
+        numberOfCoarseIslands = self.numberOfCoarseIslands
+        mask = self.getThreshold(k)
+
+        first, last = self.pieceOffsets[k], self.pieceOffsets[k + 1]
+        removed = np.flatnonzero(~self.keepNode[numberOfCoarseIslands + first:numberOfCoarseIslands + last]) + first
+        if len(removed) > 0:
+            z, y = np.divmod(self.pieceRows[removed], ny)
+            rows = (z - k * factor) * (cy * factor) + y
+            mask.ravel()[getRunIndices(rows, self.pieceStarts[removed], self.pieceEnds[removed], cx * factor)] = False
+
+        removedBlocks = np.concatenate([[False], ~self.keepNode[:numberOfCoarseIslands]])[self.coarseLabels[k]]
+        if removedBlocks.any():
+            blocks = mask.reshape(factor, cy, factor, cx, factor)
+            blocks &= ~removedBlocks[np.newaxis, :, np.newaxis, :, np.newaxis]
+        return mask
+
+'''
+Description: Coarse-to-fine bed removal, same islands as splitSegments (see BlockIslands). Only the band around the
+    solid blocks is labeled at full resolution, the inside of the patient is labeled downsampleFactor³ times coarser.
+    Memory: the mask (1 byte per voxel), the coarse labels, the runs of the band and one slab.
+'''
+def splitSegmentsCoarseToFine(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegments=1, split=True, downsampleFactor=4, imageThresh=-50, minimumVolume=None):
+    factor = downsampleFactor
+    dimensions = imageData.GetDimensions()
+    nz, ny, nx = shape = (dimensions[2], dimensions[1], dimensions[0])
+    inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+    islands = BlockIslands(inputArray, imageThresh, factor)
+    islands.select(minimumSize, maxNumberOfSegments, split, minimumVolume, imageData.GetSpacing())
+    maskArray = np.zeros(shape, dtype=bool)
+    for k in range(islands.coarseShape[0]):
+        z0 = k * factor
+        maskArray[z0:z0 + factor] = islands.getMask(k)[:min(factor, nz - z0), :ny, :nx]
+    return createMaskImage(imageData, maskArray)
+
+'''
+Description: Bed removal guided by projection profiles, for a single patient lying on the table.
+    Step 1: Threshold the volume slab by slab and accumulate the sagittal (z, y) and axial (y, x) occupancy
+            profiles of the threshold
+    Step 2: Rows (y) without any voxel split the volume into bands which can not be connected, the band with
+            the most voxels is the patient, the other bands (table plates under the patient, headrest...) are removed
+    Step 3: The table side of the patient band is the end which is the widest along x. Only the slab of
+            maxTableThickness mm at that end is labeled in 3D, restricted to its bounding box: the islands
+            touching the inner face of the slab are connected to the patient, the others (table rails,
+            cushions) are removed
+    If the patient band is too thin to split, the islands of the whole band are labeled (in its bounding box)
+    and the largest one is kept. Islands inside the patient band but outside the table slab are kept
+    (minimumSize only applies in that fallback).
+Return: vtkImageData (unsigned char), 1 inside the kept islands
+'''
+def splitSegmentsProjection(imageData: vtk.vtkImageData, minimumSize=1000, imageThresh=-50, maxTableThickness=60.0, slabSize=16) -> vtk.vtkImageData:
+    dimensions = imageData.GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    nz, ny, nx = shape
+    inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+    # Step 1
+    maskArray = np.empty(shape, dtype=bool)
+    sagittalProfile = np.zeros((nz, ny), dtype=np.int64)
+    axialProfile = np.zeros((ny, nx), dtype=np.int64)
+    for z0 in range(0, nz, slabSize):
+        slab = maskArray[z0:z0 + slabSize]
+        np.greater_equal(inputArray[z0:z0 + slabSize], imageThresh, out=slab)
+        sagittalProfile[z0:z0 + slabSize] = slab.sum(axis=2)
+        axialProfile += slab.sum(axis=0)
+
+    # Step 2
+    rowProfile = sagittalProfile.sum(axis=0)
+    if not np.any(rowProfile):
+        return createMaskImage(imageData, maskArray)
+    edges = np.diff(np.concatenate([[0], (rowProfile > 0).astype(np.int8), [0]]))
+    bandStarts = np.flatnonzero(edges == 1)
+    bandEnds = np.flatnonzero(edges == -1)
+    patientBand = int(np.argmax(np.add.reduceat(rowProfile, bandStarts)))
+    y0, y1 = int(bandStarts[patientBand]), int(bandEnds[patientBand])
+    maskArray[:, :y0] = False
+    maskArray[:, y1:] = False
+
+    # Step 3
+    thickness = math.ceil(maxTableThickness / imageData.GetSpacing()[1])
+    if y1 - y0 <= 2 * thickness:
+        slabStart, slabEnd, innerRow = y0, y1, None
+    elif np.count_nonzero(axialProfile[y1 - thickness:y1].any(axis=0)) >= np.count_nonzero(axialProfile[y0:y0 + thickness].any(axis=0)):
+        slabStart, slabEnd, innerRow = y1 - thickness, y1, 0
+    else:
+        slabStart, slabEnd, innerRow = y0, y0 + thickness, -1
+
+    zRange = np.flatnonzero(sagittalProfile[:, slabStart:slabEnd].any(axis=1))
+    xRange = np.flatnonzero(axialProfile[slabStart:slabEnd].any(axis=0))
+    region = (slice(zRange[0], zRange[-1] + 1), slice(slabStart, slabEnd), slice(xRange[0], xRange[-1] + 1))
+    if innerRow is None:
+        labels = labelIslands(maskArray[region], minimumSize)
+        maskArray[region] = labels == 1
+    else:
+        labels = labelIslands(maskArray[region], 0)
+        keep = np.zeros(int(labels.max()) + 1, dtype=bool)
+        keep[np.unique(labels[:, innerRow, :])] = True
+        keep[0] = False
+        maskArray[region] = keep[labels]
+
+    return createMaskImage(imageData, maskArray)
+
+'''
+Description: 2D islands (4-connected) of a chunk of axial slices, runs in a worker process of splitSegmentsSlices.
+Return: labels of the slices (sorted by area in each slice, 1 is the largest), per slice the area, centroid y and
+    centroid x of its islands (index = label - 1)
+'''
+def labelSlices(thresholdSlices: np.ndarray) -> Tuple[np.ndarray, List[Tuple[np.ndarray, np.ndarray, np.ndarray]]]:
+    numberOfSlices, ny, nx = thresholdSlices.shape
+    labels = np.zeros(thresholdSlices.shape, dtype=np.uint32)
+    rows = np.repeat(np.arange(ny, dtype=np.float64), nx)
+    columns = np.tile(np.arange(nx, dtype=np.float64), ny)
+    statistics = []
+    for k in range(numberOfSlices):
+        sliceLabels, numberOfIslands, _ = labeling.labelIslands(thresholdSlices[k][np.newaxis], numberOfThreads=1)
+        labels[k] = sliceLabels[0]
+        flatLabels = sliceLabels.ravel()
+        areas = np.bincount(flatLabels, minlength=numberOfIslands + 1)[1:]
+        centroidY = np.bincount(flatLabels, weights=rows, minlength=numberOfIslands + 1)[1:] / np.maximum(areas, 1)
+        centroidX = np.bincount(flatLabels, weights=columns, minlength=numberOfIslands + 1)[1:] / np.maximum(areas, 1)
+        statistics.append((areas, centroidY, centroidX))
+    return labels.astype(np.min_scalar_type(int(labels.max()))), statistics
+
+'''
+Description: Slice-parallel bed removal with 2D islands, for a single patient lying on the table.
+    Step 1: Threshold the volume and label the islands of each axial slice in a process pool (slabs of slabSize
+            slices), with their area and centroid
+    Step 2: The seed is the slice with the largest island of the scan, that island is the patient (the table
+            has about the same area in every slice, the patient is larger than it where it is the widest)
+    Step 3: Walk from the seed towards both ends, the islands of a slice which overlap the patient of the
+            previous slice are the patient. The table never overlaps the patient unless it touches it.
+            When nothing overlaps (gap in the patient), z-consistency vote: the island of at least candidateFraction
+            of the largest island area closest to the median patient centroid of the last voteRadius slices, if it
+            is within maxVoteDistance times the equivalent radius of the previous patient (else no patient)
+    Slices are labeled independently, the labeling scales with the number of processes. Steps 2, 3 only work on
+    the labels and the statistics of the slices.
+Return: vtkImageData (unsigned char), 1 inside the patient
+'''
+def splitSegmentsSlices(imageData: vtk.vtkImageData, imageThresh=-50, numberOfProcesses=None, slabSize=16, candidateFraction=0.5, voteRadius=5, maxVoteDistance=0.5) -> vtk.vtkImageData:
+    dimensions = imageData.GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    nz = shape[0]
+    inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+    # Step 1
+    maskArray = inputArray >= imageThresh
+    slabs = [maskArray[z0:z0 + slabSize] for z0 in range(0, nz, slabSize)]
+    if numberOfProcesses == 1:
+        results = [labelSlices(slab) for slab in slabs]
+    else:
+        with ProcessPoolExecutor(numberOfProcesses) as executor:
+            results = list(executor.map(labelSlices, slabs))
+    del slabs
+    labels = [sliceLabels for slabLabels, _ in results for sliceLabels in slabLabels]
+    statistics = [sliceStatistics for _, slabStatistics in results for sliceStatistics in slabStatistics]
+    del results
+
+    # Step 2
+    largestAreas = np.array([areas[0] if len(areas) > 0 else 0 for areas, _, _ in statistics])
+    maskArray[:] = False
+    if not np.any(largestAreas):
+        return createMaskImage(imageData, maskArray)
+    seed = int(np.argmax(largestAreas))
+    maskArray[seed] = labels[seed] == 1
+
+    # Step 3
+    centroids = np.full((nz, 2), np.nan)
+    centroids[seed] = statistics[seed][1][0], statistics[seed][2][0]
+    patientAreas = np.zeros(nz)
+    patientAreas[seed] = largestAreas[seed]
+    for direction in (1, -1):
+        previous = seed
+        for z in range(seed + direction, nz if direction > 0 else -1, direction):
+            areas, centroidY, centroidX = statistics[z]
+            if len(areas) == 0:
+                continue
+            keep = np.zeros(len(areas) + 1, dtype=bool)
+            keep[1:] = np.bincount(labels[z][maskArray[previous]], minlength=len(areas) + 1)[1:] > 0
+            if not np.any(keep):
+                recentSlices = previous - direction * np.arange(voteRadius)
+                recent = centroids[recentSlices[(recentSlices >= 0) & (recentSlices < nz)]]
+                target = np.median(recent[~np.isnan(recent[:, 0])], axis=0)
+                candidates = np.flatnonzero(areas >= candidateFraction * areas[0])
+                distances = np.hypot(centroidY[candidates] - target[0], centroidX[candidates] - target[1])
+                if distances.min() > maxVoteDistance * math.sqrt(patientAreas[previous] / math.pi):
+                    continue
+                keep[candidates[np.argmin(distances)] + 1] = True
+            maskArray[z] = keep[labels[z]]
+            keptAreas = areas * keep[1:]
+            patientAreas[z] = keptAreas.sum()
+            centroids[z] = np.dot(keptAreas, centroidY) / patientAreas[z], np.dot(keptAreas, centroidX) / patientAreas[z]
+            previous = z
+
+    return createMaskImage(imageData, maskArray)
+
+# Transfer syntaxes of the data set (the file meta information is always explicit VR little endian)
+IMPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2"
+EXPLICIT_VR_BIG_ENDIAN = "1.2.840.10008.1.2.2"
+DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2.1.99"
+# Explicit VRs with a 2 bytes reserved field and a 4 bytes length
+LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+UNDEFINED_LENGTH = 0xFFFFFFFF
+ITEM = (0xFFFE, 0xE000)
+ITEM_DELIMITATION = (0xFFFE, 0xE00D)
+SEQUENCE_DELIMITATION = (0xFFFE, 0xE0DD)
+
+'''
+Description: Minimal reader of the top level elements of a DICOM file (vtkDICOMImageReader does not expose the
+    UIDs and the repo has no DICOM library). Walks the elements in order with the transfer syntax of the file:
+    implicit or explicit VR, little or big endian, deflated. The values of sequences and of undefined length
+    elements (encapsulated pixel data) are skipped, so nested items never match a top level tag.
+'''
+class DicomElementReader():
+    def __init__(self, file) -> None:
+        self.file = file
+        self.endian = "<"
+        self.explicitVR = True
+
+    def read(self, size: int) -> bytes:
+        data = self.file.read(size)
+        if len(data) < size:
+            raise EOFError("Truncated DICOM file")
+        return data
+
+    def skip(self, size: int) -> None:
+        self.file.seek(size, os.SEEK_CUR)
+
+    def readTag(self) -> Tuple[int, int]:
+        return struct.unpack(self.endian + "HH", self.read(4))
+
+    '''
+    Description: Header of the next element, None at the end of the file. Item and delimitation tags have no VR.
+    Return: (tag, VR or None, length)
+    '''
+    def readHeader(self) -> Optional[Tuple[Tuple[int, int], Optional[bytes], int]]:
+        data = self.file.read(4)
+        if len(data) == 0:
+            return None
+        if len(data) < 4:
+            raise EOFError("Truncated DICOM file")
+        tag = struct.unpack(self.endian + "HH", data)
+        if not self.explicitVR or tag[0] == 0xFFFE:
+            return tag, None, struct.unpack(self.endian + "I", self.read(4))[0]
+        vr = self.read(2)
+        if vr in LONG_VRS:
+            self.skip(2)
+            return tag, vr, struct.unpack(self.endian + "I", self.read(4))[0]
+        return tag, vr, struct.unpack(self.endian + "H", self.read(2))[0]
+
+    '''
+    Description: Skip the value of an element of undefined length: the items of a sequence (or the fragments of
+        encapsulated pixel data) up to the sequence delimitation. An item of undefined length is a data set which
+        ends with an item delimitation. A UN value of undefined length is encoded in implicit VR little endian.
+    '''
+    def skipUndefinedLength(self, vr: Optional[bytes]) -> None:
+        endian, explicitVR = self.endian, self.explicitVR
+        if vr == b"UN":
+            self.endian, self.explicitVR = "<", False
+        while True:
+            tag, length = self.readTag(), struct.unpack(self.endian + "I", self.read(4))[0]
+            if tag == SEQUENCE_DELIMITATION:
+                break
+            if tag != ITEM:
+                raise ValueError("Unexpected tag (%04X,%04X) in a sequence" % tag)
+            if length != UNDEFINED_LENGTH:
+                self.skip(length)
+                continue
+            while True:
+                header = self.readHeader()
+                if header is None:
+                    raise EOFError("Truncated DICOM file")
+                elementTag, elementVR, elementLength = header
+                if elementTag == ITEM_DELIMITATION:
+                    break
+                self.skipValue(elementVR, elementLength)
+        self.endian, self.explicitVR = endian, explicitVR
+
+    def skipValue(self, vr: Optional[bytes], length: int) -> None:
+        if length == UNDEFINED_LENGTH:
+            self.skipUndefinedLength(vr)
         else:
-            threshold.ThresholdBetween(labelValue, labelValue)
-            threshold.SetInValue(1)
-            threshold.SetOutValue(0)
-        threshold.Update()
+            self.skip(length)
+
+    '''
+    Description: Read the file meta information (group 0002) and select the transfer syntax of the data set.
+        Files without the preamble and "DICM" are read as implicit VR little endian from the start.
+    '''
+    def readMetaInformation(self) -> None:
+        preamble = self.file.read(132)
+        if len(preamble) < 132 or preamble[128:] != b"DICM":
+            self.file.seek(0)
+            self.endian, self.explicitVR = "<", False
+            return
+        transferSyntax = IMPLICIT_VR_LITTLE_ENDIAN
+        while True:
+            position = self.file.tell()
+            header = self.readHeader()
+            if header is None:
+                return
+            tag, vr, length = header
+            if tag[0] != 0x0002:
+                self.file.seek(position)
+                break
+            if tag == (0x0002, 0x0010):
+                transferSyntax = self.read(length).rstrip(b"\x00 ").decode("ascii", errors="ignore")
+            else:
+                self.skipValue(vr, length)
+
+        self.explicitVR = transferSyntax != IMPLICIT_VR_LITTLE_ENDIAN
+        self.endian = ">" if transferSyntax == EXPLICIT_VR_BIG_ENDIAN else "<"
+        if transferSyntax == DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN:
+            self.file = io.BytesIO(zlib.decompress(self.file.read(), -zlib.MAX_WBITS))
+
+    '''
+    Description: Value of a top level element, the elements are in increasing tag order so the walk stops after it.
+    Return: the value bytes, or None if the element is not in the data set
+    '''
+    def findElement(self, group: int, element: int) -> Optional[bytes]:
+        self.readMetaInformation()
+        while True:
+            header = self.readHeader()
+            if header is None:
+                return None
+            tag, vr, length = header
+            if tag == (group, element) and length != UNDEFINED_LENGTH:
+                return self.read(length)
+            if tag > (group, element):
+                return None
+            self.skipValue(vr, length)
+
+'''
+Description: Read the SeriesInstanceUID (0020,000E) of the first DICOM file of a series directory which has it.
+Return: the UID, or None if the tag is not found
+'''
+def readSeriesUID(directoryName: str) -> Optional[str]:
+    fileNames = sorted(name for name in os.listdir(directoryName) if os.path.isfile(os.path.join(directoryName, name)))
+    for fileName in fileNames:
+        with open(os.path.join(directoryName, fileName), "rb") as file:
+            try:
+                value = DicomElementReader(file).findElement(0x0020, 0x000E)
+            except (EOFError, ValueError, struct.error, zlib.error):
+                # Not a DICOM file (e.g. DICOMDIR or a text file in the directory)
+                continue
+        if value is not None:
+            return value.rstrip(b"\x00 ").decode("ascii", errors="ignore")
+    return None
+
+'''
+Description: Path of a cached bed removal mask. The key holds everything the mask depends on: the series, the
+    threshold, the minimum island size and the algorithm version (with the downsample factor of the
+    coarse-to-fine mode).
+'''
+def getMaskCachePath(cacheDirectory: str, seriesUID: str, imageThresh: float, minimumSize: int, downsampleFactor: int) -> str:
+    # %g: the thresholds -50 and -50.0 (command line float) share the entry
+    key = "%s|%g|%d|v%d-f%d" % (seriesUID, imageThresh, minimumSize, BED_MASK_VERSION, downsampleFactor)
+    return os.path.join(cacheDirectory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz")
+
+'''
+Description: Store a mask bit packed along x, (z, y, ceil(x / 8)) bytes, with the dimensions of the image to
+    validate it on load.
+'''
+def savePackedMask(path: str, packedMask: np.ndarray, dimensions: Tuple[int]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so that a crash never leaves a truncated cache entry
+    temporaryPath = path + ".tmp.npz"
+    np.savez_compressed(temporaryPath, dimensions=np.array(dimensions), bits=packedMask)
+    os.replace(temporaryPath, path)
+
+'''
+Description: Load a cached mask packed along x.
+Return: (z, y, ceil(x / 8)) uint8 array, None if there is no valid cache entry for these dimensions
+'''
+def loadPackedMask(path: str, dimensions: Tuple[int]) -> Optional[np.ndarray]:
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path) as cache:
+            cachedDimensions = tuple(int(size) for size in cache["dimensions"])
+            packedMask = cache["bits"]
+    except (OSError, ValueError, KeyError):
+        return None
+    if cachedDimensions != tuple(dimensions) or packedMask.shape != (dimensions[2], dimensions[1], (dimensions[0] + 7) // 8):
+        return None
+    return packedMask
+
+'''
+Description: Fused, in place bed removal (coarse-to-fine, same islands as splitSegmentsCoarseToFine). The volume
+    is read one slab of downsampleFactor planes at a time, the full resolution threshold and mask are never stored:
+    Step 1: Label the islands coarse-to-fine (see BlockIslands) and select them
+    Step 2: Build the mask of each slab, write fillValue into the other voxels of imageData and pack the mask bits
+    Extra memory: the coarse labels (~4 / downsampleFactor³ bytes per voxel), the runs of the band, the packed mask
+    (1/8 byte per voxel) and one slab.
+Return: the mask bit packed along x, (z, y, ceil(x / 8)) uint8
+'''
+def removeBed(imageData: vtk.vtkImageData, minimumSize=1000, maxNumberOfSegments=1, split=True, downsampleFactor=4, imageThresh=-50, minimumVolume=None, fillValue=-1000) -> np.ndarray:
+    factor = downsampleFactor
+    dimensions = imageData.GetDimensions()
+    nz, ny, nx = shape = (dimensions[2], dimensions[1], dimensions[0])
+    inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+    fill = np.array(fillValue, dtype=inputArray.dtype)
+
+    # Step 1
+    islands = BlockIslands(inputArray, imageThresh, factor)
+    islands.select(minimumSize, maxNumberOfSegments, split, minimumVolume, imageData.GetSpacing())
+
+    # Step 2
+    packedMask = np.zeros((nz, ny, (nx + 7) // 8), dtype=np.uint8)
+    for k in range(islands.coarseShape[0]):
+        z0 = k * factor
+        planes = min(factor, nz - z0)
+        keep = islands.getMask(k)[:planes, :ny, :nx]
+        np.copyto(inputArray[z0:z0 + planes], fill, where=~keep)
+        packedMask[z0:z0 + planes] = np.packbits(keep, axis=-1)
+
+    imageData.GetPointData().GetScalars().Modified()
+    imageData.Modified()
+    return packedMask
+
+'''
+Description: Write fillValue in place into the voxels outside of a mask packed along x, slabSize planes at a time.
+'''
+def applyPackedMask(imageData: vtk.vtkImageData, packedMask: np.ndarray, fillValue=-1000, slabSize=16) -> None:
+    dimensions = imageData.GetDimensions()
+    inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+    fill = np.array(fillValue, dtype=inputArray.dtype)
+    for z0 in range(0, dimensions[2], slabSize):
+        keep = np.unpackbits(packedMask[z0:z0 + slabSize], axis=-1, count=dimensions[0]).view(bool)
+        np.copyto(inputArray[z0:z0 + slabSize], fill, where=~keep)
 
-        modifierImage = vtk.vtkImageData()
-        modifierImage.DeepCopy(threshold.GetOutput())
-        # selectedSegmentLabelmapImageToWorldMatrix = vtk.vtkMatrix4x4()
-        # utils.GetImageToWorldMatrix(selectedSegmentLabelmap, selectedSegmentLabelmapImageToWorldMatrix)
-        # utils.SetImageToWorldMatrix(modifierImage, selectedSegmentLabelmapImageToWorldMatrix)
-        # print(modifierImage.GetScalarType())
+    imageData.GetPointData().GetScalars().Modified()
+    imageData.Modified()
 
-        castIn = vtk.vtkImageCast()
-        castIn.SetInputData(modifierImage)
-        castIn.SetOutputScalarTypeToUnsignedChar()
-        castIn.Update()
+'''
+Description: removeBed with the persistent mask cache of the series, reopening a series only applies the stored mask.
+Params:
+    seriesUID: cache key of the series, None disables the cache
+    cacheDirectory: directory of the cached masks
+Return: the mask bit packed along x
+'''
+def removeBedCached(imageData: vtk.vtkImageData, seriesUID: Optional[str], cacheDirectory: str, minimumSize=1000, downsampleFactor=4, imageThresh=-50, fillValue=-1000) -> np.ndarray:
+    if seriesUID is None:
+        return removeBed(imageData, minimumSize, downsampleFactor=downsampleFactor, imageThresh=imageThresh, fillValue=fillValue)
 
-        return castIn.GetOutput()
+    path = getMaskCachePath(cacheDirectory, seriesUID, imageThresh, minimumSize, downsampleFactor)
+    packedMask = loadPackedMask(path, imageData.GetDimensions())
+    if packedMask is None:
+        packedMask = removeBed(imageData, minimumSize, downsampleFactor=downsampleFactor, imageThresh=imageThresh, fillValue=fillValue)
+        savePackedMask(path, packedMask, imageData.GetDimensions())
+    else:
+        applyPackedMask(imageData, packedMask, fillValue)
+    return packedMask
 
 def maskVolume(imageData: vtk.vtkImageData, maskImage: vtk.vtkImageData, fillValue=-1000) -> vtk.vtkImageData:
     nshape = tuple(reversed(maskImage.GetDimensions()))
     inputArray = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(nshape)
-    maskArray = vtk_to_numpy(maskImage.GetPointData().GetScalars()).reshape(nshape).astype(float)
+    maskArray = vtk_to_numpy(maskImage.GetPointData().GetScalars()).reshape(nshape)
 
-    resultArray = inputArray[:] * maskArray[:] + float(fillValue) * (1 - maskArray[:])
+    # One pass, no float temporaries
+    resultArray = np.where(maskArray != 0, inputArray, np.array(fillValue, dtype=inputArray.dtype))
 
-    resultImage = numpy_to_vtk(resultArray.astype(inputArray.dtype).reshape(1, -1)[0])
+    resultImage = numpy_to_vtk(resultArray.ravel())
 
     maskedImageData = vtk.vtkImageData()
     maskedImageData.SetExtent(imageData.GetExtent())
@@ -190,6 +949,7 @@ def main() -> None:
     path3 = "C:/Users/DELL E5540/Desktop/Python/dicom-data/64733 NGUYEN TAN THANH/DONG MACH CHI DUOI CTA/CT CTA iDose 5"
     path4 = "C:/Users/DELL E5540/Desktop/Python/dicom-data/digest_article"
     path5 = "C:/Users/DELL E5540/Desktop/Python/dicom-data/1.2.840.113619.2.428.3.678656.285.1684973027.401"
+    MASK_CACHE_DIRECTORY = "../cache/bed"
 
     rgb_points = to_rgb_points(STANDARD)
     colors = vtk.vtkNamedColors()
@@ -218,17 +978,16 @@ def main() -> None:
     reader.Update()
 
     imageData = reader.GetOutput() # vtkImageData
-    modifierLabelmap = vtk.vtkImageData()
-    modifierLabelmap.DeepCopy(imageData)
-    # print(modifierLabelmap.GetPointData().GetScalars().GetNumberOfTuples())
 
-    maskImage = splitSegments(modifierLabelmap)
-    maskedImageData = maskVolume(imageData, maskImage)
+    # Label the islands on a 4x downsampled threshold, refine the patient boundary at full resolution.
+    # The bed is removed in place, slab by slab (no copy of the volume). The mask is cached per series,
+    # reopening the series only applies the stored mask
+    removeBedCached(imageData, readSeriesUID(path2), MASK_CACHE_DIRECTORY, downsampleFactor=4)
     
     # This option will use hardware accelerated rendering exclusively
     # This is a good option if you know there is hardware acceleration
     mapper.SetRequestedRenderModeToGPU()
-    mapper.SetInputData(maskedImageData)
+    mapper.SetInputData(imageData)
 
     volumeProperty.SetInterpolationTypeToLinear()
     volumeProperty.ShadeOn()
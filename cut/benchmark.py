@@ -0,0 +1,70 @@
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+import numpy as np
+
+import bed
+
+import time
+import tracemalloc
+
+'''
+Description: Synthetic CT (int16, HU): an elliptic patient with a few holes lying above two bed plates.
+'''
+def createPhantom(nz=300, ny=512, nx=512) -> vtk.vtkImageData:
+    phantomArray = np.full((nz, ny, nx), -1000, dtype=np.int16)
+    y, x = np.ogrid[:ny, :nx]
+    body = ((x - nx / 2) ** 2 / (0.35 * nx) ** 2 + (y - 0.45 * ny) ** 2 / (0.23 * ny) ** 2) <= 1
+    phantomArray[:, body] = 40
+    phantomArray[:, int(0.70 * ny):int(0.73 * ny), int(0.12 * nx):int(0.88 * nx)] = 200
+    phantomArray[:, int(0.74 * ny):int(0.75 * ny), int(0.20 * nx):int(0.80 * nx)] = 100
+    phantomArray[::7, int(0.39 * ny):int(0.40 * ny), int(0.49 * nx):int(0.50 * nx)] = -1000
+
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(nx, ny, nz)
+    imageData.SetSpacing(0.7, 0.7, 1.25)
+    imageData.GetPointData().SetScalars(numpy_to_vtk(phantomArray.ravel(), deep=True))
+    return imageData
+
+'''
+Description: Run function and report its time and its peak extra memory in bytes per voxel.
+    tracemalloc sees the numpy allocations only, memory allocated by VTK filters is not counted.
+'''
+def measure(name: str, numberOfVoxels: int, function, *args, **kwargs):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-40s %7.2f s %7.3f B/voxel (%.0f MB)" % (name, elapsed, peak / numberOfVoxels, peak / 2 ** 20))
+    return result
+
+def main() -> None:
+    imageData = createPhantom()
+    numberOfVoxels = imageData.GetNumberOfPoints()
+    print("Phantom %s, %d voxels" % (imageData.GetDimensions(), numberOfVoxels))
+
+    def splitAndMask():
+        return bed.maskVolume(imageData, bed.splitSegments(imageData, downsampleFactor=4))
+    maskedImageData = measure("splitSegments + maskVolume", numberOfVoxels, splitAndMask)
+
+    fullMask = measure("splitSegments (full resolution)", numberOfVoxels, bed.splitSegments, imageData)
+    projectionMask = measure("splitSegments (projection profiles)", numberOfVoxels, bed.splitSegments, imageData, useProjection=True)
+    slicesMask = measure("splitSegments (slices engine)", numberOfVoxels, bed.splitSegments, imageData, engine="slices")
+    print("Same mask:", all(np.array_equal(vtk_to_numpy(fullMask.GetPointData().GetScalars()), vtk_to_numpy(mask.GetPointData().GetScalars())) for mask in [projectionMask, slicesMask]))
+
+    fusedImageData = vtk.vtkImageData()
+    fusedImageData.DeepCopy(imageData)
+    packedMask = measure("removeBed (fused, in place)", numberOfVoxels, bed.removeBed, fusedImageData)
+
+    cachedImageData = vtk.vtkImageData()
+    cachedImageData.DeepCopy(imageData)
+    measure("applyPackedMask (cached mask)", numberOfVoxels, bed.applyPackedMask, cachedImageData, packedMask)
+
+    expected = vtk_to_numpy(maskedImageData.GetPointData().GetScalars())
+    print("Same result:", np.array_equal(expected, vtk_to_numpy(fusedImageData.GetPointData().GetScalars())) and np.array_equal(expected, vtk_to_numpy(cachedImageData.GetPointData().GetScalars())))
+
+if __name__ == "__main__":
+    main()
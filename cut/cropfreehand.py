@@ -2,6 +2,8 @@ import vtk
 from typing import List, Tuple
 import math
 
+import utils
+
 class ScissorsPipeline:
     def __init__(self) -> None:
         # 2D Contour Pipeline
@@ -40,6 +42,9 @@ class ScissorsPipeline:
         self.polyDataActor.SetProperty(property)
         self.polyDataActor.VisibilityOff()
 
+        # Cut region of all cuts as run-length extents (vtkImageStencilData), created on the first cut
+        self.modifierStencil = None
+
 class BeforeCropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __init__(self, pipeline, imageData, map) -> None:
         self.pipeline = pipeline
@@ -352,6 +357,13 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.brushPolyDataNormals.Update()
 
     def updateBrushStencil(self):
+        # Convert the brush model from world coordinates to IJK coordinates of the volume
+        worldToImageMatrix = vtk.vtkMatrix4x4()
+        utils.GetImageToWorldMatrix(self.imageData, worldToImageMatrix)
+        worldToImageMatrix.Invert()
+        self.worldToModifierLabelmapIjkTransform.Identity()
+        self.worldToModifierLabelmapIjkTransform.Concatenate(worldToImageMatrix)
+
         self.worldToModifierLabelmapIjkTransformer.Update()
         closedSurfacePolyData = self.worldToModifierLabelmapIjkTransformer.GetOutput()
         bounds = closedSurfacePolyData.GetBounds()
@@ -366,69 +378,21 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.updateBrushModel()
         self.updateBrushStencil()
 
-        # Step 5: Convert from Image Stencil Data to Image Data
-        # vtkImageStencilToImage will convert an image stencil into a binary image
-        # The default output will be an 8-bit image with a value of 1 inside the stencil and 0 outside
-        stencilToImage = vtk.vtkImageStencilToImage()
-        stencilToImage.SetInputData(self.brushPolyDataToStencil.GetOutput())
-        # print(self.brushPolyDataToStencil.GetOutput())
-        stencilToImage.SetInsideValue(1)
-        stencilToImage.SetOutsideValue(0)
-        stencilToImage.SetOutputScalarType(self.imageData.GetScalarType()) # vtk.VTK_SHORT: [-32768->32767], vtk.VTK_UNSIGNED_CHAR: [0->255]
-        stencilToImage.Update()
-
-        # Step 6: Create a Image Data extends origin image data some properties, all scalar values equal 0
-        baseImage = vtk.vtkImageData()
-        baseImage.SetExtent(self.imageData.GetExtent())
-        baseImage.SetSpacing(self.imageData.GetSpacing())
-        baseImage.SetOrigin(self.imageData.GetOrigin())
-        baseImage.AllocateScalars(self.imageData.GetScalarType(), 1)
-
-        modifierImage = stencilToImage.GetOutput()
-
-        self.modifyImage(baseImage, modifierImage)
-    
-    def modifyImage(self, baseImage: vtk.vtkImageData, modifierImage: vtk.vtkImageData):
-
-        # Step 7: Filter scalar values inside, all inside values equal 1, and outside equal 0
-        baseExtent = baseImage.GetExtent()
-        updateExtent = [v for v in baseExtent]
-        modifierExtent = modifierImage.GetExtent()
-        for idx in range(3):
-            if modifierExtent[idx * 2] > updateExtent[idx * 2]:
-                updateExtent[idx * 2] = modifierExtent[idx * 2]
-            if modifierExtent[idx * 2 + 1] < updateExtent[idx * 2 + 1]:
-                updateExtent[idx * 2 + 1] = modifierExtent[idx * 2 + 1]
-        if updateExtent[0] > updateExtent[1] or updateExtent[2] > updateExtent[3] or updateExtent[4] > updateExtent[5]:
-            return
-
-        baseImageModified = False
-        for z in range(updateExtent[4], updateExtent[5] + 1):
-            for y in range(updateExtent[2], updateExtent[3] + 1):
-                for x in range(updateExtent[0], updateExtent[1] + 1):
-                    if modifierImage.GetScalarComponentAsFloat(x, y, z, 0) > baseImage.GetScalarComponentAsFloat(x, y, z, 0):
-                        baseImage.SetScalarComponentFromFloat(x, y, z, 0, modifierImage.GetScalarComponentAsFloat(x, y, z, 0))
-                        baseImageModified = True
-        if baseImageModified:
-            baseImage.Modified()
-
-        self.maskVolume(baseImage)
-
-    def maskVolume(self, baseImage):
-
-        # Step 8: Apply mask volume
-        maskToStencil = vtk.vtkImageToImageStencil()
-        maskToStencil.ThresholdByLower(0)
-        maskToStencil.SetInputData(baseImage)
-        maskToStencil.Update()
-        
-        stencil = vtk.vtkImageStencil()
-        stencil.SetInputData(self.imageData)
-        stencil.SetStencilConnection(maskToStencil.GetOutputPort())
-        stencil.Update()
+        # Step 5: Merge the brush stencil into the cut stencil.
+        # Stencils are combined as run-length extents, no volume is materialized.
+        if self.pipeline.modifierStencil is None:
+            self.pipeline.modifierStencil = utils.createStencil(self.imageData)
+        utils.modifyStencil(self.pipeline.modifierStencil, self.brushPolyDataToStencil.GetOutput())
+
+        self.maskVolume(self.pipeline.modifierStencil)
+
+    def maskVolume(self, stencilData: vtk.vtkImageStencilData):
+
+        # Step 6: Apply the cut stencil to the origin volume in one pass
+        maskedImageData = utils.applyStencil(self.imageData, stencilData)
 
-        # Step 9: Render the new volume
-        self.map.SetInputData(stencil.GetOutput())
+        # Step 7: Render the new volume
+        self.map.SetInputData(maskedImageData)
 
 def main() -> None:
     path = "../dicomdata/CT1.25mmStndKHONGTIEM"
@@ -0,0 +1,528 @@
+import vtk
+from vtkmodules.vtkCommonCore import vtkCommand
+from vtk.util.numpy_support import vtk_to_numpy
+
+import numpy as np
+
+from typing import List, Tuple
+from abc import ABC, abstractmethod
+import math
+
+import utils
+
+'''
+Description: A region of the volume which can be rasterized into a binary mask (in IJK coordinates of the labelmap).
+    inverted: the region is the complement of the shape (used by OUTSIDE cuts)
+'''
+class Shape(ABC):
+    def __init__(self, inverted=False) -> None:
+        self.inverted = inverted
+
+    '''
+    Description: IJK extent touched by the shape, clipped to wholeExtent.
+    '''
+    def getExtent(self, wholeExtent: List[int]) -> List[int]:
+        if self.inverted:
+            return list(wholeExtent)
+        return utils.intersectExtents(self.getShapeExtent(), wholeExtent)
+
+    @abstractmethod
+    def getShapeExtent(self) -> List[int]:
+        pass
+
+    '''
+    Description: Return a boolean array (z, y, x) of the given extent, True inside the region.
+    '''
+    def rasterize(self, extent: List[int]) -> np.ndarray:
+        mask = self.rasterizeShape(extent)
+        if self.inverted:
+            np.logical_not(mask, out=mask)
+        return mask
+
+    @abstractmethod
+    def rasterizeShape(self, extent: List[int]) -> np.ndarray:
+        pass
+
+'''
+Description: Closed surface (extruded 2D contour) given in IJK coordinates of the labelmap.
+'''
+class PrismShape(Shape):
+    def __init__(self, polyDataIjk: vtk.vtkPolyData, inverted=False) -> None:
+        super().__init__(inverted)
+        self.polyDataIjk = vtk.vtkPolyData()
+        self.polyDataIjk.DeepCopy(polyDataIjk)
+
+    def getShapeExtent(self) -> List[int]:
+        bounds = self.polyDataIjk.GetBounds()
+        return [
+            math.floor(bounds[0]), math.ceil(bounds[1]),
+            math.floor(bounds[2]), math.ceil(bounds[3]),
+            math.floor(bounds[4]), math.ceil(bounds[5])
+        ]
+
+    def rasterizeShape(self, extent: List[int]) -> np.ndarray:
+        polyDataToStencil = vtk.vtkPolyDataToImageStencil()
+        polyDataToStencil.SetInputData(self.polyDataIjk)
+        polyDataToStencil.SetOutputOrigin(0, 0, 0)
+        polyDataToStencil.SetOutputSpacing(1, 1, 1)
+        polyDataToStencil.SetOutputWholeExtent(extent)
+        polyDataToStencil.Update()
+        return utils.stencilToArray(polyDataToStencil.GetOutput(), extent)
+
+'''
+Description: Prism extruded along one IJK axis (parallel projection looking down a volume axis, e.g. the
+    I/A/P/L/R/S presets). The contour is rasterized once into a 2D mask of the two other axes and
+    broadcast along the axis, without polydata to stencil conversion.
+    polygon: (N, 2) contour in IJK coordinates of the two other axes (in increasing axis order)
+    axis: 0 (i), 1 (j) or 2 (k)
+    axisRange: [min, max] IJK coordinates of the prism along the axis
+'''
+class AxisAlignedPrismShape(Shape):
+    def __init__(self, polygon: np.ndarray, axis: int, axisRange: List[float], inverted=False) -> None:
+        super().__init__(inverted)
+        self.polygon = np.array(polygon, dtype=float)
+        self.axis = axis
+        self.axisRange = list(axisRange)
+        self.otherAxes = [other for other in range(3) if other != axis]
+
+    def getShapeExtent(self) -> List[int]:
+        extent = [0, -1, 0, -1, 0, -1]
+        for idx, other in enumerate(self.otherAxes):
+            extent[other * 2] = math.floor(self.polygon[:, idx].min())
+            extent[other * 2 + 1] = math.ceil(self.polygon[:, idx].max())
+        extent[self.axis * 2] = math.ceil(self.axisRange[0])
+        extent[self.axis * 2 + 1] = math.floor(self.axisRange[1])
+        return extent
+
+    def rasterizeShape(self, extent: List[int]) -> np.ndarray:
+        mask = np.zeros(utils.extentToShape(extent), dtype=bool)
+        axisExtent = utils.intersectExtents(self.getShapeExtent(), extent)
+        if utils.isEmptyExtent(axisExtent):
+            return mask
+
+        # Pixel centers of rasterizePolygon are at +0.5, voxel centers at integer IJK
+        first, second = self.otherAxes
+        polygonPixels = self.polygon - [extent[first * 2] - 0.5, extent[second * 2] - 0.5]
+        width = extent[first * 2 + 1] - extent[first * 2] + 1
+        height = extent[second * 2 + 1] - extent[second * 2] + 1
+        polygonMask = utils.rasterizePolygon(polygonPixels, width, height) # (second, first)
+
+        # numpy axis of the IJK axis in the (z, y, x) mask
+        numpyAxis = 2 - self.axis
+        slices = [slice(None)] * 3
+        slices[numpyAxis] = slice(
+            axisExtent[self.axis * 2] - extent[self.axis * 2],
+            axisExtent[self.axis * 2 + 1] - extent[self.axis * 2] + 1
+        )
+        mask[tuple(slices)] = np.expand_dims(polygonMask, numpyAxis)
+        return mask
+
+'''
+Description: Shape of a brush model built by the freehand styles: a prism whose two first polygons are
+    the front and back caps. When the back cap is the front cap moved along one IJK axis, the fast
+    AxisAlignedPrismShape is used, otherwise the general PrismShape.
+'''
+def createPrismShape(polyDataIjk: vtk.vtkPolyData, inverted=False, tolerance=1e-3) -> Shape:
+    polys = polyDataIjk.GetPolys()
+    if polys is not None and polys.GetNumberOfCells() >= 2:
+        points = vtk_to_numpy(polyDataIjk.GetPoints().GetData())
+        frontIds, backIds = vtk.vtkIdList(), vtk.vtkIdList()
+        polys.GetCellAtId(0, frontIds)
+        polys.GetCellAtId(1, backIds)
+        frontCap = points[[frontIds.GetId(idx) for idx in range(frontIds.GetNumberOfIds())]]
+        backCap = points[[backIds.GetId(idx) for idx in range(backIds.GetNumberOfIds())]]
+        if len(frontCap) >= 3 and len(frontCap) == len(backCap):
+            for axis in range(3):
+                otherAxes = [other for other in range(3) if other != axis]
+                # Both caps are orthogonal to the axis ...
+                if np.ptp(frontCap[:, axis]) > tolerance or np.ptp(backCap[:, axis]) > tolerance:
+                    continue
+                # ... and have the same points along the two other axes (vtkPolyDataNormals may reverse a cap)
+                frontPoints = frontCap[:, otherAxes]
+                backPoints = backCap[:, otherAxes]
+                frontPoints = frontPoints[np.lexsort(frontPoints.T)]
+                backPoints = backPoints[np.lexsort(backPoints.T)]
+                if np.abs(frontPoints - backPoints).max() < tolerance:
+                    axisValues = [frontCap[0, axis], backCap[0, axis]]
+                    return AxisAlignedPrismShape(frontCap[:, otherAxes], axis, [min(axisValues), max(axisValues)], inverted)
+    return PrismShape(polyDataIjk, inverted)
+
+'''
+Description: Distance (mm, along the direction of projection) from the camera to the first visible surface
+    of the volume rendered by mapper, for each pixel of the renderer viewport. NaN where nothing was hit.
+    Volume mappers don't write the z-buffer of the render window, the depth image of the GPU ray cast
+    mapper (RenderToImage) is rendered once instead, without swapping the buffers so the shown frame
+    doesn't change. The render evaluates the cuts queued in a CutEngine attached to the renderer.
+'''
+class SurfaceDepth():
+    def __init__(self, renderer: vtk.vtkRenderer, mapper: vtk.vtkGPUVolumeRayCastMapper) -> None:
+        camera = renderer.GetActiveCamera()
+        self.viewportOrigin = renderer.GetOrigin()
+        self.viewportSize = renderer.GetSize()
+
+        self.worldToView = utils.getWorldToViewMatrix(renderer)
+        self.viewToWorld = np.linalg.inv(self.worldToView)
+        self.cameraPosition = np.array(camera.GetPosition())
+        self.directionOfProjection = np.array(camera.GetDirectionOfProjection())
+
+        depthImage = SurfaceDepth.renderDepthImage(renderer, mapper)
+        width, height, _ = depthImage.GetDimensions()
+        # (y, x), y from the bottom of the viewport like display coordinates
+        zBufferArray = vtk_to_numpy(depthImage.GetPointData().GetScalars()).reshape(height, width)
+        pixelY, pixelX = np.mgrid[0:height, 0:width]
+        surfacePoints = self.unproject(pixelX.ravel(), pixelY.ravel(), zBufferArray.ravel())
+        self.depth = self.getDepth(surfacePoints).reshape(zBufferArray.shape)
+        # z = 1: far plane, no surface
+        self.depth[zBufferArray >= 1.0] = np.nan
+
+    '''
+    Description: Only the GPU ray cast mapper can render its depth image.
+    '''
+    @staticmethod
+    def supportsDepthImage(mapper: vtk.vtkVolumeMapper) -> bool:
+        return hasattr(mapper, "RenderToImageOn") and hasattr(mapper, "GetDepthImage")
+
+    '''
+    Description: Render the window once with the mapper drawing to an image, return its depth image
+        (normalized z of the renderer viewport, 1 where the rays didn't hit the volume).
+    '''
+    @staticmethod
+    def renderDepthImage(renderer: vtk.vtkRenderer, mapper: vtk.vtkGPUVolumeRayCastMapper) -> vtk.vtkImageData:
+        renderWindow = renderer.GetRenderWindow()
+        swapBuffers = renderWindow.GetSwapBuffers()
+        mapper.RenderToImageOn()
+        renderWindow.SwapBuffersOff()
+        renderWindow.Render()
+        depthImage = vtk.vtkImageData()
+        mapper.GetDepthImage(depthImage)
+        mapper.RenderToImageOff()
+        renderWindow.SetSwapBuffers(swapBuffers)
+        return depthImage
+
+    '''
+    Description: World points (N, 3) of pixel centers at the given z-buffer values.
+    '''
+    def unproject(self, pixelX: np.ndarray, pixelY: np.ndarray, z: np.ndarray) -> np.ndarray:
+        view = np.empty((len(z), 4))
+        view[:, 0] = 2.0 * (pixelX + 0.5) / self.viewportSize[0] - 1.0
+        view[:, 1] = 2.0 * (pixelY + 0.5) / self.viewportSize[1] - 1.0
+        view[:, 2] = z
+        view[:, 3] = 1.0
+        world = view @ self.viewToWorld.T
+        return world[:, :3] / world[:, 3:]
+
+    '''
+    Description: Pixel indices of world points (N, 3), -1 when outside of the viewport.
+    '''
+    def project(self, worldPoints: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return utils.worldToPixels(self.worldToView, self.viewportSize, worldPoints)
+
+    '''
+    Description: Distance (mm) of world points (N, 3) from the camera along the direction of projection.
+    '''
+    def getDepth(self, worldPoints: np.ndarray) -> np.ndarray:
+        return (worldPoints - self.cameraPosition) @ self.directionOfProjection
+
+'''
+Description: Part of a prism between the first visible surface and depthMm behind it, along each ray.
+    Only the thin shell is rasterized: the extent is limited to the shell and the depth test only
+    runs on voxels of the prism.
+    ijkToWorldMatrix: IJK to world matrix of the labelmap
+'''
+class DepthLimitedPrismShape(PrismShape):
+    def __init__(self, polyDataIjk: vtk.vtkPolyData, ijkToWorldMatrix: vtk.vtkMatrix4x4, surfaceDepth: SurfaceDepth, depthMm: float, inverted=False) -> None:
+        super().__init__(polyDataIjk, inverted)
+        self.ijkToWorld = np.array([[ijkToWorldMatrix.GetElement(row, col) for col in range(4)] for row in range(4)])
+        self.surfaceDepth = surfaceDepth
+        self.depthMm = depthMm
+        # Voxels centers are up to half a voxel in front of the surface
+        self.tolerance = 0.5 * np.linalg.norm(self.ijkToWorld[:3, :3], axis=0).max()
+
+    def getShapeExtent(self) -> List[int]:
+        prismExtent = super().getShapeExtent()
+
+        # Pixels covered by the prism, with a visible surface
+        prismPointsWorld = self.__ijkToWorld(vtk_to_numpy(self.polyDataIjk.GetPoints().GetData()))
+        pixelX, pixelY = self.surfaceDepth.project(prismPointsWorld)
+        if np.any(pixelX < 0):
+            return prismExtent
+        pixelX0, pixelY0 = pixelX.min(), pixelY.min()
+        depth = self.surfaceDepth.depth[pixelY0:pixelY.max() + 1, pixelX0:pixelX.max() + 1]
+        hasSurface = np.isfinite(depth)
+        if not np.any(hasSurface):
+            return [0, -1, 0, -1, 0, -1]
+        pixelY, pixelX = np.nonzero(hasSurface)
+        pixelX += pixelX0
+        pixelY += pixelY0
+        depth = depth[hasSurface]
+
+        # Shell points: on the surface and depthMm behind it
+        shellPointsWorld = np.concatenate([
+            self.__pointsAtDepth(pixelX, pixelY, depth - self.tolerance),
+            self.__pointsAtDepth(pixelX, pixelY, depth + self.depthMm + self.tolerance)
+        ])
+        shellPointsIjk = (shellPointsWorld - self.ijkToWorld[:3, 3]) @ np.linalg.inv(self.ijkToWorld[:3, :3]).T
+        shellMin = np.floor(shellPointsIjk.min(axis=0)).astype(int)
+        shellMax = np.ceil(shellPointsIjk.max(axis=0)).astype(int)
+        shellExtent = [shellMin[0], shellMax[0], shellMin[1], shellMax[1], shellMin[2], shellMax[2]]
+        return utils.intersectExtents(prismExtent, [int(value) for value in shellExtent])
+
+    def rasterizeShape(self, extent: List[int]) -> np.ndarray:
+        mask = super().rasterizeShape(extent)
+        k, j, i = np.nonzero(mask)
+        if len(i) == 0:
+            return mask
+        voxelsWorld = self.__ijkToWorld(np.stack([i + extent[0], j + extent[2], k + extent[4]], axis=1))
+        pixelX, pixelY = self.surfaceDepth.project(voxelsWorld)
+        surface = np.full(len(i), np.nan)
+        visible = pixelX >= 0
+        surface[visible] = self.surfaceDepth.depth[pixelY[visible], pixelX[visible]]
+        depth = self.surfaceDepth.getDepth(voxelsWorld)
+        with np.errstate(invalid="ignore"):
+            inShell = (depth >= surface - self.tolerance) & (depth <= surface + self.depthMm)
+        mask[k, j, i] = inShell
+        return mask
+
+    def __ijkToWorld(self, pointsIjk: np.ndarray) -> np.ndarray:
+        return pointsIjk @ self.ijkToWorld[:3, :3].T + self.ijkToWorld[:3, 3]
+
+    '''
+    Description: World points on the rays of pixel centers, at depth (mm) from the camera.
+    '''
+    def __pointsAtDepth(self, pixelX: np.ndarray, pixelY: np.ndarray, depth: np.ndarray) -> np.ndarray:
+        nearPoints = self.surfaceDepth.unproject(pixelX, pixelY, np.zeros(len(pixelX)))
+        farPoints = self.surfaceDepth.unproject(pixelX, pixelY, np.ones(len(pixelX)))
+        rays = farPoints - nearPoints
+        nearDepth = self.surfaceDepth.getDepth(nearPoints)
+        rayDepth = rays @ self.surfaceDepth.directionOfProjection
+        return nearPoints + rays * ((depth - nearDepth) / rayDepth)[:, np.newaxis]
+
+'''
+Description: Axis aligned box given by an IJK extent, e.g. from the cropping box widget.
+'''
+class BoxShape(Shape):
+    def __init__(self, extentIjk: List[int], inverted=False) -> None:
+        super().__init__(inverted)
+        self.extentIjk = list(extentIjk)
+
+    def getShapeExtent(self) -> List[int]:
+        return list(self.extentIjk)
+
+    def rasterizeShape(self, extent: List[int]) -> np.ndarray:
+        mask = np.zeros(utils.extentToShape(extent), dtype=bool)
+        box = utils.intersectExtents(self.extentIjk, extent)
+        if not utils.isEmptyExtent(box):
+            mask[utils.extentToSlices(box, extent)] = True
+        return mask
+
+'''
+Description:
+    Cuts are not applied when the contour is released, they are queued as an expression
+        removed = ((removed | shape1) & ~shape2) | shape3 ...
+    and evaluated in one fused pass over the bounding extent of all pending shapes right
+    before the next render. The original image data is never modified.
+    Rendering modes:
+        mask: mappers with a mask input (vtkGPUVolumeRayCastMapper) keep the CT resident and
+            render through a uint8 binary mask (1 = kept), only the small mask changes per cut
+        volume: other mappers (CPU ray cast, smart mapper) render a masked copy of the CT which
+            is allocated once and only its dirty extent is rewritten
+    useMask: None to pick the mode from the mapper
+    tissueClasses: colormap standard (e.g. STANDARD), when given each evaluation reports the removed
+        voxels and mm³ per class in lastReport (a new list per evaluation, see utils.formatTissueComposition)
+'''
+class CutEngine():
+    UNION = 1
+    SUBTRACT = 2
+
+    def __init__(self, imageData: vtk.vtkImageData, modifierLabelmap: vtk.vtkImageData, mapper: vtk.vtkVolumeMapper, fillValue=-1000, useMask=None, tissueClasses=None) -> None:
+        # Origin image data, read only
+        self.imageData = imageData
+        # Cut state, value > 0 means the voxel is removed
+        self.modifierLabelmap = modifierLabelmap
+        self.mapper = mapper
+        self.fillValue = fillValue
+
+        self.pendingOperations: List[Tuple[int, Shape]] = []
+        self.isHeld = False
+        self.maskedImageData = None
+
+        if useMask is None:
+            useMask = CutEngine.supportsMask(mapper)
+        self.useMask = useMask
+        self.maskImageData = None
+        if self.useMask:
+            self.__createMask()
+
+        self.interactor = None
+        self.flushTimerId = None
+        self.flushDelay = 300 # ms
+
+        self.tissueClasses = None
+        if tissueClasses is not None:
+            self.tissueClasses = utils.getTissueClasses(tissueClasses)
+        self.tissueClassLookupTable = None
+        self.lastReport = None
+
+    '''
+    Description: Only the GPU ray cast mapper can render through a mask input.
+    '''
+    @staticmethod
+    def supportsMask(mapper: vtk.vtkVolumeMapper) -> bool:
+        return hasattr(mapper, "SetMaskInput") and hasattr(mapper, "SetMaskTypeToBinary")
+
+    def union(self, shape: Shape) -> None:
+        self.pendingOperations.append((CutEngine.UNION, shape))
+
+    def subtract(self, shape: Shape) -> None:
+        self.pendingOperations.append((CutEngine.SUBTRACT, shape))
+
+    def hasPendingOperations(self) -> bool:
+        return len(self.pendingOperations) > 0
+
+    '''
+    Description: Evaluate pending operations before the renderer draws the volume.
+    '''
+    def attach(self, renderer: vtk.vtkRenderer, interactor: vtk.vtkRenderWindowInteractor) -> None:
+        renderer.AddObserver(vtkCommand.StartEvent, self.__startEvent)
+        self.interactor = interactor
+        interactor.AddObserver(vtkCommand.TimerEvent, self.__timerEvent)
+
+    '''
+    Description: Keep queued cuts pending while the user is drawing the next contour.
+    '''
+    def hold(self) -> None:
+        self.isHeld = True
+        if self.flushTimerId is not None:
+            self.interactor.DestroyTimer(self.flushTimerId)
+            self.flushTimerId = None
+
+    '''
+    Description: Release the hold and render once the user stopped cutting for flushDelay ms.
+    '''
+    def scheduleFlush(self) -> None:
+        self.isHeld = False
+        if self.interactor is None:
+            self.evaluate()
+            return
+        if self.flushTimerId is not None:
+            self.interactor.DestroyTimer(self.flushTimerId)
+        self.flushTimerId = self.interactor.CreateOneShotTimer(self.flushDelay)
+
+    def __timerEvent(self, obj: vtk.vtkRenderWindowInteractor, event: str) -> None:
+        if self.flushTimerId is None or obj.GetTimerEventId() != self.flushTimerId:
+            return
+        self.flushTimerId = None
+        if self.hasPendingOperations():
+            obj.Render()
+
+    def __startEvent(self, obj: vtk.vtkRenderer, event: str) -> None:
+        if not self.isHeld:
+            self.evaluate()
+
+    '''
+    Description: Apply all pending operations in a single pass.
+    Return: the dirty extent or None when nothing changed
+    '''
+    def evaluate(self) -> List[int]:
+        if not self.hasPendingOperations():
+            return None
+        operations = self.pendingOperations
+        self.pendingOperations = []
+
+        wholeExtent = list(self.modifierLabelmap.GetExtent())
+        dirtyExtent = None
+        for _, shape in operations:
+            dirtyExtent = utils.unionExtents(dirtyExtent, shape.getExtent(wholeExtent))
+        if dirtyExtent is None or utils.isEmptyExtent(dirtyExtent):
+            return None
+        dirtySlices = utils.extentToSlices(dirtyExtent, wholeExtent)
+
+        # Step 1: evaluate the expression on the dirty extent only
+        labelmapArray = utils.getArrayView(self.modifierLabelmap)[dirtySlices]
+        removed = labelmapArray > 0
+        previouslyRemoved = removed.copy() if self.tissueClasses is not None else None
+        for operation, shape in operations:
+            if operation == CutEngine.UNION:
+                removed |= shape.rasterize(dirtyExtent)
+            else:
+                removed &= ~shape.rasterize(dirtyExtent)
+        labelmapArray[...] = removed
+        self.modifierLabelmap.Modified()
+
+        if self.tissueClasses is not None:
+            self.__reportTissueComposition(dirtySlices, removed & ~previouslyRemoved)
+
+        # OUTSIDE cuts: shrink the working volume to the kept region
+        if any(shape.inverted for _, shape in operations):
+            keptExtent = utils.getNonZeroExtent(~removed, dirtyExtent)
+            if not utils.isEmptyExtent(keptExtent) and keptExtent != wholeExtent:
+                removed = removed[utils.extentToSlices(keptExtent, dirtyExtent)]
+                self.__crop(keptExtent)
+                dirtyExtent = keptExtent
+                dirtySlices = utils.extentToSlices(dirtyExtent, dirtyExtent)
+
+        # Step 2: update the dirty extent of the rendered mask or volume, the rest is already up to date
+        if self.useMask:
+            self.__updateMask(dirtySlices, removed)
+        else:
+            self.__maskVolume(dirtySlices, removed)
+        return dirtyExtent
+
+    '''
+    Description: Crop the CT, the cut state and the rendered mask or volume to extent, the mapper,
+        the interactor styles and later cuts keep their references and only see the kept region.
+    '''
+    def __crop(self, extent: List[int]) -> None:
+        utils.cropImageData(self.imageData, extent)
+        utils.cropImageData(self.modifierLabelmap, extent)
+        if self.maskImageData is not None:
+            utils.cropImageData(self.maskImageData, extent)
+        if self.maskedImageData is not None:
+            utils.cropImageData(self.maskedImageData, extent)
+
+    def __createMask(self) -> None:
+        self.maskImageData = vtk.vtkImageData()
+        self.maskImageData.CopyStructure(self.imageData)
+        self.maskImageData.SetDirectionMatrix(self.imageData.GetDirectionMatrix())
+        self.maskImageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+        maskArray = utils.getArrayView(self.maskImageData)
+        maskArray[...] = utils.getArrayView(self.modifierLabelmap) <= 0
+
+        # The CT stays the mapper input, only voxels with mask value 1 are rendered
+        self.mapper.SetMaskTypeToBinary()
+        self.mapper.SetMaskInput(self.maskImageData)
+
+    def __updateMask(self, dirtySlices: Tuple[slice], removed: np.ndarray) -> None:
+        maskArray = utils.getArrayView(self.maskImageData)[dirtySlices]
+        np.logical_not(removed, out=maskArray.view(bool))
+
+        self.maskImageData.GetPointData().GetScalars().Modified()
+        self.maskImageData.Modified()
+
+    '''
+    Description: Voxels and mm³ removed by this evaluation per HU class, over the dirty extent only.
+    '''
+    def __reportTissueComposition(self, dirtySlices: Tuple[slice], newlyRemoved: np.ndarray) -> None:
+        values = utils.getArrayView(self.imageData)[dirtySlices][newlyRemoved]
+        spacing = self.imageData.GetSpacing()
+        names, edges = self.tissueClasses
+        if self.tissueClassLookupTable is None:
+            self.tissueClassLookupTable = utils.getTissueClassLookupTable(edges, values.dtype)
+        self.lastReport = utils.computeTissueComposition(values, names, edges, spacing[0] * spacing[1] * spacing[2], self.tissueClassLookupTable)
+
+    def __maskVolume(self, dirtySlices: Tuple[slice], removed: np.ndarray) -> None:
+        isNew = self.maskedImageData is None
+        if isNew:
+            self.maskedImageData = vtk.vtkImageData()
+            self.maskedImageData.DeepCopy(self.imageData)
+
+        inputArray = utils.getArrayView(self.imageData)[dirtySlices]
+        resultArray = utils.getArrayView(self.maskedImageData)[dirtySlices]
+        np.copyto(resultArray, inputArray)
+        resultArray[removed] = self.fillValue # -1000 HU: air
+
+        self.maskedImageData.GetPointData().GetScalars().Modified()
+        self.maskedImageData.Modified()
+        if isNew:
+            # Render the new volume
+            self.mapper.SetInputData(self.maskedImageData)
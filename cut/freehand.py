@@ -3,6 +3,9 @@ from typing import List
 import math
 import numpy as np
 
+import utils
+import engine
+
 class Contour2DPipeline():
     def __init__(self) -> None:
         # 2D Contour Pipeline
@@ -63,6 +66,13 @@ class ImageDataPipeline():
         self.imageActor.SetMapper(self.mapper)
         self.imageActor.VisibilityOff()
 
+        # Cut region of all cuts as run-length extents (vtkImageStencilData), created on the first cut
+        self.modifierStencil = None
+        # Volume rendered by the mapper, the brush rewrites it in place when the mapper has no mask input
+        self.maskedImageData = None
+        # Mask input of the mapper (1: rendered, 0: cut), the sphere brush only rewrites this mask
+        self.maskImageData = None
+
 class BeforeInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __init__(self, pipeline, pipeline2, imgDataPipeline, imageData, map) -> None:
         self.pipeline = pipeline
@@ -71,6 +81,7 @@ class BeforeInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.imageData = imageData
         self.map = map
         self.AddObserver(vtk.vtkCommand.LeftButtonReleaseEvent, self.leftButtonReleaseEvent)
+        self.AddObserver(vtk.vtkCommand.KeyPressEvent, self.keyPressEvent)
 
     def leftButtonReleaseEvent(self, obj, event) -> None:
         # print(self.imageData.GetSpacing())
@@ -78,6 +89,14 @@ class BeforeInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         style = InteractorStyle(self.pipeline, self.pipeline2, self.imgDataPipeline, self.imageData, self.map)
         self.GetInteractor().SetInteractorStyle(style)
 
+    def keyPressEvent(self, obj, event) -> None:
+        # b: sphere brush erase mode
+        if self.GetInteractor().GetKeySym() == "b":
+            style = SphereBrushInteractorStyle(self.pipeline, self.pipeline2, self.imgDataPipeline, self.imageData, self.map)
+            self.GetInteractor().SetInteractorStyle(style)
+            return
+        self.OnKeyPress()
+
 class InteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __init__(self, pipeline, pipeline2, imgDataPipeline, imageData, map) -> None:
         self.pipeline = pipeline
@@ -408,150 +427,152 @@ class InteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def paintApply(self):
         self.brushPolyDataToStencil.Update()
         stencilData = self.brushPolyDataToStencil.GetOutput() # vtkImageStencilData
-        stencilExtent = stencilData.GetExtent()
-        # print(stencilExtent)
-        # ...
-        # vtkImageStencilToImage will convert an image stencil into a binary image
-        # The default output will be an 8-bit image with a value of 1 inside the stencil and 0 outside
-        stencilToImage = vtk.vtkImageStencilToImage()
-        stencilToImage.SetInputData(self.brushPolyDataToStencil.GetOutput())
-        # print(self.brushPolyDataToStencil.GetOutput())
-        stencilToImage.SetInsideValue(1)
-        stencilToImage.SetOutsideValue(0)
-        stencilToImage.SetOutputScalarType(self.imageData.GetScalarType()) # vtk.VTK_SHORT: [-32768->32767], vtk.VTK_UNSIGNED_CHAR: [0->255]
-        # stencilToImage.SetOutputScalarType(vtk.VTK_UNSIGNED_CHAR)
-        stencilToImage.Update()
-        # print(stencilToImage.GetOutput()) # vtkImageData
-
-        orientedBrushPositionerOutput = vtk.vtkImageData()
-        orientedBrushPositionerOutput.DeepCopy(stencilToImage.GetOutput())
-
-        imageToWorld = vtk.vtkMatrix4x4()
-        imageToWorld.Identity()
-        origin = self.imageData.GetOrigin()
-        spacing = self.imageData.GetSpacing()
-        directionMatrix = self.imageData.GetDirectionMatrix()
-        for row in range(3):
-            for col in range(3):
-                imageToWorld.SetElement(row, col, spacing[col] * directionMatrix.GetElement(row, col))
-            imageToWorld.SetElement(row, 3, origin[row])
-
-        mat = vtk.vtkMatrix4x4()
-        mat.DeepCopy(imageToWorld)
-        isModified = False
-        nspacing = list(orientedBrushPositionerOutput.GetSpacing())
-        norigin = list(orientedBrushPositionerOutput.GetOrigin())
-        ndirections = orientedBrushPositionerOutput.GetDirectionMatrix()
-        for col in range(3):
-            len = 0
-            for row in range(3):
-                len += mat.GetElement(row, col) * mat.GetElement(row, col)
-            len = math.sqrt(len)
-            # Set spacing
-            if nspacing[col] != len:
-                nspacing[col] = len
-                isModified = True
-            for row in range(3):
-                mat.SetElement(row, col, mat.GetElement(row, col) / len)
-        for row in range(3):
-            for col in range(3):
-                # Set directions
-                if ndirections.GetElement(row, col) != mat.GetElement(row, col):
-                    ndirections.SetElement(row, col, mat.GetElement(row, col))
-                    isModified = True
-                # Set origin
-                if norigin[row] != mat.GetElement(row, 3):
-                    norigin[row] = mat.GetElement(row, 3)
-                    isModified = True
-        if isModified:
-            orientedBrushPositionerOutput.SetSpacing(nspacing)
-            orientedBrushPositionerOutput.SetOrigin(norigin)
-            orientedBrushPositionerOutput.Modified()
-        # print(orientedBrushPositionerOutput)
-
-        # self.imgDataPipeline.imageData.DeepCopy(orientedBrushPositionerOutput)
-        # self.imgDataPipeline.imageData.DeepCopy(stencilToImage.GetOutput())
-        # self.imgDataPipeline.imageData.DeepCopy(brushPositioner.GetOutput())
-        # print(self.imgDataPipeline.imageData)
-        # self.imgDataPipeline.imageActor.VisibilityOn()
-        # self.GetInteractor().Render()
-
-        baseImage = vtk.vtkImageData() # modifierLabelmap
-        baseImage.SetExtent(self.imageData.GetExtent())
-        baseImage.SetOrigin(self.imageData.GetOrigin())
-        baseImage.SetSpacing(self.imageData.GetSpacing())
-        baseImage.SetDirectionMatrix(self.imageData.GetDirectionMatrix())
-        baseImage.AllocateScalars(self.imageData.GetScalarType(), 1)
-        # print(baseImage)
-
-        # modifierImage = stencilToImage.GetOutput() # vtkImageData
-        # print(modifierImage)
-
-        # self.modifyImage(baseImage, modifierImage)
-        self.modifyImage(baseImage, orientedBrushPositionerOutput)
-
-    def modifyImage(self, baseImage: vtk.vtkImageData, modifierImage: vtk.vtkImageData):
-        baseExtent = baseImage.GetExtent()
-        updateExtent = [v for v in baseExtent]
-        modifierExtent = modifierImage.GetExtent()
-        for idx in range(3):
-            if modifierExtent[idx * 2] > updateExtent[idx * 2]:
-                updateExtent[idx * 2] = modifierExtent[idx * 2]
-            if modifierExtent[idx * 2 + 1] < updateExtent[idx * 2 + 1]:
-                updateExtent[idx * 2 + 1] = modifierExtent[idx * 2 + 1]
-        if updateExtent[0] > updateExtent[1] or updateExtent[2] > updateExtent[3] or updateExtent[4] > updateExtent[5]:
-            return
-        
-        baseIncX = vtk.reference(0); baseIncY = vtk.reference(0); baseIncZ = vtk.reference(0)
-        modifierIncX = vtk.reference(0); modifierIncY = vtk.reference(0); modifierIncZ = vtk.reference(0)
 
-        # baseImage.GetContinuousIncrements(updateExtent, baseIncX, baseIncY, baseIncZ)
-        # modifierImage.GetContinuousIncrements(updateExtent, modifierIncX, modifierIncY, modifierIncZ)
-        # print(baseIncX, baseIncY, baseIncZ); print(modifierIncX, modifierIncY, modifierIncZ)
+        # Merge the brush stencil into the cut stencil as run-length extents,
+        # without converting it to an image and back
+        if self.imgDataPipeline.modifierStencil is None:
+            self.imgDataPipeline.modifierStencil = utils.createStencil(self.imageData)
+        utils.modifyStencil(self.imgDataPipeline.modifierStencil, stencilData)
 
-        maxX = (updateExtent[1] - updateExtent[0]) * baseImage.GetNumberOfScalarComponents()
-        maxY = updateExtent[3] - updateExtent[2]
-        maxZ = updateExtent[5] - updateExtent[4]
-        
-        # baseImagePtr =  baseImage.GetScalarPointerForExtent(updateExtent)
-        # modifierImagePtr = modifierImage.GetScalarPointerForExtent(updateExtent)
-
-        baseImageModified = False
-        # print(updateExtent)
-        for z in range(updateExtent[4], updateExtent[5] + 1):
-            for y in range(updateExtent[2], updateExtent[3] + 1):
-                for x in range(updateExtent[0], updateExtent[1] + 1):
-                    if modifierImage.GetScalarComponentAsFloat(x, y, z, 0) > baseImage.GetScalarComponentAsFloat(x, y, z, 0):
-                        baseImage.SetScalarComponentFromFloat(x, y, z, 0, modifierImage.GetScalarComponentAsFloat(x, y, z, 0))
-                        baseImageModified = True
-        if baseImageModified:
-            baseImage.Modified()
-        # print(baseImage)
-
-        # ...
-
-        self.maskVolume(baseImage)
+        self.maskVolume(self.imgDataPipeline.modifierStencil)
     
-    def maskVolume(self, baseImage):
+    def maskVolume(self, stencilData: vtk.vtkImageStencilData):
+
+        # mask volume in one pass, voxels inside the stencil become air (-1000 HU)
+        maskedImageData = utils.applyStencil(self.imageData, stencilData)
+
+        self.imgDataPipeline.maskedImageData = maskedImageData
+        self.map.SetInputData(maskedImageData)
+
+'''
+Description: Erase with a sphere brush while dragging, like the paint effect of 3D Slicer.
+    Each MouseMoveEvent stamps a precomputed sphere mask at the picked position: the brush is
+    merged into the cut stencil and cleared in the mask input of the mapper, so the CT texture is
+    not uploaded again (1 byte per voxel instead of the whole CT). Mappers without a mask input
+    re-mask the brush extent of the rendered volume instead, like CutEngine.
+    Press b to go back to the freehand contour.
+    radiusMm: radius of the brush in mm
+'''
+class SphereBrushInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
+    def __init__(self, pipeline, pipeline2, imgDataPipeline, imageData, map, radiusMm=5.0, fillValue=-1000) -> None:
+        self.pipeline = pipeline
+        self.pipeline2 = pipeline2
+        self.imgDataPipeline = imgDataPipeline
+        self.imageData = imageData
+        self.map = map
+        self.fillValue = fillValue
+        self.isErasing = False
+        self.lastPositionIjk = None
+        self.useMask = engine.CutEngine.supportsMask(map)
+
+        # The sphere mask only depends on the radius and the spacing: compute it once
+        self.sphereMask, self.sphereHalfSize = utils.createSphereMask(radiusMm, self.imageData.GetSpacing())
+        self.worldToIjkMatrix = vtk.vtkMatrix4x4()
+        utils.GetImageToWorldMatrix(self.imageData, self.worldToIjkMatrix)
+        self.worldToIjkMatrix.Invert()
+
+        self.AddObserver(vtk.vtkCommand.LeftButtonPressEvent, self.leftButtonPressEvent)
+        self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.mouseMoveEvent)
+        self.AddObserver(vtk.vtkCommand.LeftButtonReleaseEvent, self.leftButtonReleaseEvent)
+        self.AddObserver(vtk.vtkCommand.KeyPressEvent, self.keyPressEvent)
 
-        # mask volume
-        maskToStencil = vtk.vtkImageToImageStencil()
-        maskToStencil.ThresholdByLower(0)
-        maskToStencil.SetInputData(baseImage)
-        maskToStencil.Update()
-        
-        stencil = vtk.vtkImageStencil()
-        stencil.SetInputData(self.imageData)
-        stencil.SetStencilConnection(maskToStencil.GetOutputPort())
-        stencil.Update()
-
-        # self.imgDataPipeline.imageData.DeepCopy(baseImage)
-        # print(self.imgDataPipeline.imageData)
-        # self.imgDataPipeline.imageActor.VisibilityOn()
-        # self.GetInteractor().Render()
-        # print(stencil.GetOutput()) # vtkImageData
+    def leftButtonPressEvent(self, obj, event) -> None:
+        self.isErasing = True
+        self.lastPositionIjk = None
+        self.paintAtEventPosition()
+
+    def mouseMoveEvent(self, obj, event) -> None:
+        if self.isErasing:
+            self.paintAtEventPosition()
+        else:
+            self.OnMouseMove()
+
+    def leftButtonReleaseEvent(self, obj, event) -> None:
+        self.isErasing = False
+        self.lastPositionIjk = None
+
+    def keyPressEvent(self, obj, event) -> None:
+        if self.GetInteractor().GetKeySym() == "b":
+            style = BeforeInteractorStyle(self.pipeline, self.pipeline2, self.imgDataPipeline, self.imageData, self.map)
+            self.GetInteractor().SetInteractorStyle(style)
+            return
+        self.OnKeyPress()
+
+    def paintAtEventPosition(self) -> None:
+        interactor = self.GetInteractor()
+        renderer = interactor.GetRenderWindow().GetRenderers().GetFirstRenderer()
+        eventPosition = interactor.GetEventPosition()
+        picker = interactor.GetPicker()
+        if not picker.Pick(eventPosition[0], eventPosition[1], 0, renderer):
+            return
+        positionIjk = self.worldToIjkMatrix.MultiplyPoint(list(picker.GetPickPosition()) + [1.0])[:3]
+
+        # Fast drags move more than the brush size between two events, fill the gap
+        stampPositions = [positionIjk]
+        if self.lastPositionIjk is not None:
+            distance = max(abs(positionIjk[idx] - self.lastPositionIjk[idx]) / max(self.sphereHalfSize[idx], 1) for idx in range(3))
+            numberOfSteps = math.ceil(distance * 2)
+            stampPositions = [
+                [self.lastPositionIjk[idx] + (positionIjk[idx] - self.lastPositionIjk[idx]) * step / numberOfSteps for idx in range(3)]
+                for step in range(1, numberOfSteps + 1)
+            ]
+        self.lastPositionIjk = positionIjk
+
+        for stampPosition in stampPositions:
+            self.paintApply(stampPosition)
+        interactor.Render()
+
+    def paintApply(self, positionIjk: List[float]) -> None:
+        center = [round(positionIjk[idx]) for idx in range(3)]
+        brushExtent = [
+            center[0] - self.sphereHalfSize[0], center[0] + self.sphereHalfSize[0],
+            center[1] - self.sphereHalfSize[1], center[1] + self.sphereHalfSize[1],
+            center[2] - self.sphereHalfSize[2], center[2] + self.sphereHalfSize[2]
+        ]
+        wholeExtent = list(self.imageData.GetExtent())
+        extent = utils.intersectExtents(brushExtent, wholeExtent)
+        if utils.isEmptyExtent(extent):
+            return
+        brushMask = self.sphereMask[utils.extentToSlices(extent, brushExtent)]
+
+        # Cut state, used by the next freehand contour cuts
+        if self.imgDataPipeline.modifierStencil is None:
+            self.imgDataPipeline.modifierStencil = utils.createStencil(self.imageData)
+        utils.modifyStencil(self.imgDataPipeline.modifierStencil, utils.arrayToStencil(brushMask, extent))
 
-        self.map.SetInputData(stencil.GetOutput())
+        if self.useMask:
+            self.updateMask(extent, wholeExtent, brushMask)
+            return
+
+        # Re-mask the brush extent only, the rendered volume is allocated once
+        if self.imgDataPipeline.maskedImageData is None:
+            self.imgDataPipeline.maskedImageData = vtk.vtkImageData()
+            self.imgDataPipeline.maskedImageData.DeepCopy(self.imageData)
+            self.map.SetInputData(self.imgDataPipeline.maskedImageData)
+        maskedImageData = self.imgDataPipeline.maskedImageData
+        utils.getArrayView(maskedImageData)[utils.extentToSlices(extent, wholeExtent)][brushMask] = self.fillValue
+        maskedImageData.GetPointData().GetScalars().Modified()
+        maskedImageData.Modified()
+
+    '''
+    Description: Clear the brush in the mask input of the mapper. The mask is created on the first stamp
+        from the cut stencil, the mapper input stays the CT (or the volume masked by the freehand cuts).
+    '''
+    def updateMask(self, extent: List[int], wholeExtent: List[int], brushMask: np.ndarray) -> None:
+        if self.imgDataPipeline.maskImageData is None:
+            maskImageData = vtk.vtkImageData()
+            maskImageData.CopyStructure(self.imageData)
+            maskImageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+            np.logical_not(utils.stencilToArray(self.imgDataPipeline.modifierStencil, wholeExtent), out=utils.getArrayView(maskImageData).view(bool))
+            self.imgDataPipeline.maskImageData = maskImageData
+            self.map.SetMaskTypeToBinary()
+            self.map.SetMaskInput(maskImageData)
+            # The cut stencil already holds this stamp
+            return
+        maskImageData = self.imgDataPipeline.maskImageData
+        utils.getArrayView(maskImageData)[utils.extentToSlices(extent, wholeExtent)][brushMask] = 0
+        maskImageData.GetPointData().GetScalars().Modified()
+        maskImageData.Modified()
 
 """
     Description: calculate input data for transfer function.
@@ -608,7 +629,8 @@ def main():
     rgb_points = to_rgb_points(STANDARD)
     colors = vtk.vtkNamedColors()
     reader = vtk.vtkDICOMImageReader()
-    map = vtk.vtkSmartVolumeMapper()
+    # The GPU ray cast mapper renders the sphere brush through a mask input
+    map = vtk.vtkGPUVolumeRayCastMapper()
     # map = vtk.vtkFixedPointVolumeRayCastMapper()
     vol = vtk.vtkVolume()
     volProperty = vtk.vtkVolumeProperty()
@@ -649,9 +671,6 @@ def main():
 
     # print(imageData)
     
-    # This option will use hardware accelerated rendering exclusively
-    # This is a good option if you know there is hardware acceleration
-    map.SetRequestedRenderModeToGPU()
     map.SetInputData(imageData)
 
     volProperty.SetInterpolationTypeToLinear()
@@ -2,22 +2,125 @@ import vtk
 from vtkmodules.vtkCommonCore import vtkMath, vtkCommand
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 
+import numpy as np
+
 from enum import Enum
 from typing import List, Tuple
 import time
 
 import utils
+import engine
 
 class Operation(Enum): 
     INSIDE=1,
     OUTSIDE=2
 
-# Description: Drawing a 2D contour on display coordinates
+'''
+Description: Translucent preview of the voxels removed by the contour being drawn, on a coarse level
+    of the volume (every coarseFactor voxel along each axis).
+    The coarse voxels which are not air and not cut yet are projected on the screen once when drawing
+    starts, the camera doesn't move while drawing. Each update only rasterizes the contour and looks up
+    the projected voxels.
+'''
+class CutPreviewPipeline():
+    def __init__(self, coarseFactor=4, airThreshold=-500) -> None:
+        self.coarseFactor = coarseFactor
+        self.airThreshold = airThreshold
+        self.viewportSize = None
+        self.pixelIndices = None
+        self.pointsWorld = None
+        self.pointIds = None
+        # numpy arrays shared with the preview polydata
+        self.selectedPointsWorld = None
+
+        self.polyData = vtk.vtkPolyData()
+        self.mapper = vtk.vtkPolyDataMapper()
+        self.mapper.SetInputData(self.polyData)
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(self.mapper)
+        self.actor.GetProperty().SetColor(1, 0, 0)
+        self.actor.GetProperty().SetOpacity(0.3)
+        self.actor.GetProperty().SetPointSize(coarseFactor)
+        self.actor.PickableOff()
+        self.actor.VisibilityOff()
+
+    def begin(self, renderer: vtk.vtkRenderer, imageData: vtk.vtkImageData, modifierLabelmap: vtk.vtkImageData) -> None:
+        step = self.coarseFactor
+        imageArray = utils.getArrayView(imageData)[::step, ::step, ::step]
+        labelmapArray = utils.getArrayView(modifierLabelmap)[::step, ::step, ::step]
+        k, j, i = np.nonzero((imageArray > self.airThreshold) & (labelmapArray <= 0))
+        extent = imageData.GetExtent()
+        pointsIjk = np.stack([i * step + extent[0], j * step + extent[2], k * step + extent[4]], axis=1)
+
+        imageToWorldMatrix = vtk.vtkMatrix4x4()
+        utils.GetImageToWorldMatrix(imageData, imageToWorldMatrix)
+        imageToWorld = np.array([[imageToWorldMatrix.GetElement(row, col) for col in range(4)] for row in range(4)])
+        pointsWorld = (pointsIjk @ imageToWorld[:3, :3].T + imageToWorld[:3, 3]).astype(np.float32)
+
+        self.viewportSize = renderer.GetSize()
+        pixelX, pixelY = utils.worldToPixels(utils.getWorldToViewMatrix(renderer), self.viewportSize, pointsWorld)
+        visible = pixelX >= 0
+        self.pixelIndices = pixelY[visible] * self.viewportSize[0] + pixelX[visible]
+        self.pointsWorld = pointsWorld[visible]
+        self.pointIds = np.arange(len(self.pointsWorld), dtype=np.int64)
+
+    '''
+    Description: Show the coarse voxels inside (INSIDE) or outside (OUTSIDE) of the contour.
+        contourXY: contour points in viewport coordinates (N, 2)
+    '''
+    def update(self, contourXY: np.ndarray, inverted: bool) -> None:
+        if self.pixelIndices is None:
+            return
+        contourMask = utils.rasterizePolygon(contourXY, self.viewportSize[0], self.viewportSize[1])
+        selected = contourMask.ravel()[self.pixelIndices]
+        if inverted:
+            np.logical_not(selected, out=selected)
+        self.selectedPointsWorld = self.pointsWorld[selected]
+        numberOfPoints = len(self.selectedPointsWorld)
+
+        # One poly vertex cell, the point coordinates and ids are not copied
+        points = vtk.vtkPoints()
+        points.SetData(numpy_to_vtk(self.selectedPointsWorld))
+        verts = vtk.vtkCellArray()
+        verts.SetData(
+            numpy_to_vtk(np.array([0, numberOfPoints], dtype=np.int64), deep=True, array_type=vtk.VTK_ID_TYPE),
+            numpy_to_vtk(self.pointIds[:numberOfPoints], array_type=vtk.VTK_ID_TYPE)
+        )
+        self.polyData.SetPoints(points)
+        self.polyData.SetVerts(verts)
+        self.actor.VisibilityOn()
+
+    def end(self) -> None:
+        self.pixelIndices = None
+        self.pointsWorld = None
+        self.pointIds = None
+        self.selectedPointsWorld = None
+        self.polyData.Initialize()
+        self.actor.VisibilityOff()
+
+'''
+Description: Drawing a 2D contour on display coordinates
+    The contour is a single polyline backed by preallocated numpy buffers (capacity doubles when full).
+    The VTK arrays wrap the buffers once (again only when the capacity grows), adding a point only
+    updates the number of tuples and the cell offsets.
+    While drawing, the last frame of the volume is shown as the background and the volume is hidden,
+    so extending the contour doesn't ray cast the volume again.
+'''
 class Contour2DPipeline():
     def __init__(self) -> None:
         # 2D Contour Pipeline
         self.isDragging = False
+        self.capacity = 256
+        self.numberOfPoints = 0
+        self.isClosed = False
+        # (x, y, 0) display coordinates of the contour points
+        self.pointsBuffer = np.zeros((self.capacity, 3))
+        # Point ids of the polyline, one more id to close the contour
+        self.connectivityBuffer = np.zeros(self.capacity + 1, dtype=np.int64)
+        # Offsets of the single polyline cell: [0, number of ids]
+        self.offsetsBuffer = np.zeros(2, dtype=np.int64)
         self.polyData = vtk.vtkPolyData()
+        self.__wrapBuffers()
         self.mapper = vtk.vtkPolyDataMapper2D()
         self.mapper.SetInputData(self.polyData)
         self.actor = vtk.vtkActor2D()
@@ -38,6 +141,9 @@ class Contour2DPipeline():
         outlinePropertyThin.SetLineWidth(1)
         self.actorThin.VisibilityOff()
 
+        # Preview of the voxels the cut would remove, while drawing
+        self.preview = CutPreviewPipeline()
+
         # Test
         colors = vtk.vtkNamedColors()
         self.polyData3D = vtk.vtkPolyData()
@@ -61,25 +167,120 @@ class Contour2DPipeline():
         self.imageDataActor = vtk.vtkImageSlice()
         self.imageDataActor.SetMapper(self.imageDataMapper)
         self.imageDataActor.VisibilityOff()
+
+        # Cached frame of the volume, shown as the background while drawing
+        self.frameTexture = vtk.vtkTexture()
+        self.hiddenVolumes = []
         # self.imageDataActor = vtk.vtkActor()
         # self.imageDataActor.SetMapper(self.imageDataMapper)
         # self.imageDataActor.VisibilityOff()
 
+    def resetContour(self, x: float, y: float) -> None:
+        self.numberOfPoints = 0
+        self.isClosed = False
+        self.appendContourPoint(x, y)
+
+    def appendContourPoint(self, x: float, y: float) -> None:
+        if self.numberOfPoints == self.capacity:
+            self.capacity *= 2
+            pointsBuffer = np.zeros((self.capacity, 3))
+            pointsBuffer[:self.numberOfPoints] = self.pointsBuffer[:self.numberOfPoints]
+            self.pointsBuffer = pointsBuffer
+            connectivityBuffer = np.zeros(self.capacity + 1, dtype=np.int64)
+            connectivityBuffer[:self.numberOfPoints] = self.connectivityBuffer[:self.numberOfPoints]
+            self.connectivityBuffer = connectivityBuffer
+            self.__wrapBuffers()
+        self.pointsBuffer[self.numberOfPoints] = [x, y, 0]
+        self.connectivityBuffer[self.numberOfPoints] = self.numberOfPoints
+        self.numberOfPoints += 1
+        self.__updateContourPolyData()
+
+    def closeContour(self) -> None:
+        self.connectivityBuffer[self.numberOfPoints] = 0
+        self.isClosed = True
+        self.__updateContourPolyData()
+
+    '''
+    Description: Contour points (N, 2) in display coordinates, a view on the buffer.
+    '''
+    def getContourPointsXY(self) -> np.ndarray:
+        return self.pointsBuffer[:self.numberOfPoints, :2]
+
+    '''
+    Description: Wrap the numpy buffers in the VTK arrays of the polydata, the arrays share memory with the buffers.
+    '''
+    def __wrapBuffers(self) -> None:
+        self.pointsArray = numpy_to_vtk(self.pointsBuffer)
+        self.connectivityArray = numpy_to_vtk(self.connectivityBuffer, array_type=vtk.VTK_ID_TYPE)
+        self.offsetsArray = numpy_to_vtk(self.offsetsBuffer, array_type=vtk.VTK_ID_TYPE)
+        points = vtk.vtkPoints()
+        points.SetData(self.pointsArray)
+        lines = vtk.vtkCellArray()
+        lines.SetData(self.offsetsArray, self.connectivityArray)
+        self.polyData.SetPoints(points)
+        self.polyData.SetLines(lines)
+        self.__updateContourPolyData()
+
+    def __updateContourPolyData(self) -> None:
+        numberOfIds = self.numberOfPoints + 1 if self.isClosed else self.numberOfPoints
+        # Shrinking or growing within the capacity keeps the memory of the buffers
+        self.pointsArray.SetNumberOfTuples(self.numberOfPoints)
+        self.connectivityArray.SetNumberOfValues(numberOfIds)
+        self.offsetsBuffer[1] = numberOfIds
+        self.pointsArray.Modified()
+        self.connectivityArray.Modified()
+        self.offsetsArray.Modified()
+        self.polyData.GetPoints().Modified()
+        self.polyData.GetLines().Modified()
+        self.polyData.Modified()
+
+    '''
+    Description: Show the last rendered frame as the background and hide the volumes.
+    '''
+    def freezeBackground(self, renderer: vtk.vtkRenderer) -> None:
+        windowToImage = vtk.vtkWindowToImageFilter()
+        windowToImage.SetInput(renderer.GetRenderWindow())
+        windowToImage.ShouldRerenderOff()
+        windowToImage.SetViewport(renderer.GetViewport())
+        windowToImage.Update()
+        frame = vtk.vtkImageData()
+        frame.DeepCopy(windowToImage.GetOutput())
+        self.frameTexture.SetInputData(frame)
+
+        renderer.SetBackgroundTexture(self.frameTexture)
+        renderer.TexturedBackgroundOn()
+        self.hiddenVolumes = []
+        volumes = renderer.GetVolumes()
+        volumes.InitTraversal()
+        volume = volumes.GetNextVolume()
+        while volume is not None:
+            if volume.GetVisibility():
+                volume.VisibilityOff()
+                self.hiddenVolumes.append(volume)
+            volume = volumes.GetNextVolume()
+
+    def unfreezeBackground(self, renderer: vtk.vtkRenderer) -> None:
+        renderer.TexturedBackgroundOff()
+        for volume in self.hiddenVolumes:
+            volume.VisibilityOn()
+        self.hiddenVolumes = []
+
 # Description: Interaction before cropping freehand
 class BeforeCropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
-    def __init__(self, contour2Dpipeline, imageData, modifierLabelmap, operation, mapper) -> None:
+    def __init__(self, contour2Dpipeline, imageData, modifierLabelmap, operation, cutEngine, depthMm=None) -> None:
         self.contour2Dpipeline = contour2Dpipeline
         self.imageData = imageData
         self.modifierLabelmap = modifierLabelmap
         self.operation = operation
-        self.mapper = mapper
+        self.cutEngine = cutEngine
+        self.depthMm = depthMm
 
         self.AddObserver(vtkCommand.LeftButtonReleaseEvent, self.__leftButtonReleaseEvent)
 
     def __leftButtonReleaseEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
         self.OnLeftButtonUp()
 
-        style = CropFreehandInteractorStyle(self.contour2Dpipeline, self.imageData, self.modifierLabelmap, self.operation, self.mapper)
+        style = CropFreehandInteractorStyle(self.contour2Dpipeline, self.imageData, self.modifierLabelmap, self.operation, self.cutEngine, self.depthMm)
         self.GetInteractor().SetInteractorStyle(style)
 
 '''
@@ -88,13 +289,14 @@ Description: Interaction for cropping freehand
     Step 2: Mapping display space points to world positions
     Step 3: Take 2D contour as polydata line, and extrude surfaces from the near clipping plane
             to the far clipping plane.
-    Step 4: Take the rasterized polydata from step 3, and do a 3D stencil operation/filter, where
-            you leave voxels on if it's in the rasterized volume, and vice-versa. This can be
-            inplemented as a filter, at the cost of duplicating the volume memory.
+            With depthMm, only the part from the first visible surface (depth image of the GPU
+            ray cast mapper) to depthMm behind it is cut.
+    Step 4: Queue the polydata from step 3 in the cut engine. Queued cuts are rasterized and
+            applied together in one pass over their extent before the next render.
     Step 5: Render the new volume
 '''
 class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
-    def __init__(self, contour2Dpipeline, imageData, modifierLabelmap, operation, mapper) -> None:
+    def __init__(self, contour2Dpipeline, imageData, modifierLabelmap, operation, cutEngine, depthMm=None) -> None:
         # Pipeline used to drawing a 2D contour on the screen
         self.contour2Dpipeline = contour2Dpipeline
         # Origin image data
@@ -102,9 +304,17 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         # Image data extends some properties from origin image data such as: 
         # extent, origin, spacing, direction and scalar type
         self.modifierLabelmap = modifierLabelmap
-        self.mapper = mapper
+        # Evaluates queued cuts and renders the masked volume
+        self.cutEngine = cutEngine
         # operation: INSIDE or OUTSIDE
         self.operation = operation
+        # Depth of the cut behind the visible surface in mm, None: cut through the whole volume
+        self.depthMm = depthMm
+        # Depth of the visible surface (engine.SurfaceDepth) read when drawing starts, None: cut through
+        self.surfaceDepth = None
+        # The cut preview is updated every previewInterval mouse move events
+        self.previewInterval = 3
+        self.numberOfMoveEvents = 0
     
         # Events
         self.AddObserver(vtkCommand.LeftButtonPressEvent, self.__leftButtonPressEvent)
@@ -123,21 +333,9 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.worldToModifierLabelmapIjkTransformer.SetTransform(self.worldToModifierLabelmapIjkTransform)
         self.worldToModifierLabelmapIjkTransformer.SetInputConnection(self.brushPolyDataNormals.GetOutputPort())
 
-        # Image stencil là một đối tượng dữ liệu dạng ma trận nhị phân có cùng kích thước và phân giải với một hình ảnh.
-        # Sử dụng image stencil để thực hiện các phép biến đổi hoặc lọc hình ảnh trên phạm vi chỉ định bởi vtkPolyData.
-        self.brushPolyDataToStencil = vtk.vtkPolyDataToImageStencil()
-        self.brushPolyDataToStencil .SetOutputOrigin(0, 0, 0)
-        self.brushPolyDataToStencil.SetOutputSpacing(1, 1, 1)
-        self.brushPolyDataToStencil.SetInputConnection(self.worldToModifierLabelmapIjkTransformer.GetOutputPort())
-
     def __createGlyph(self, eventPosition: Tuple) -> None:
         if self.contour2Dpipeline.isDragging:
-            points = vtk.vtkPoints()
-            lines = vtk.vtkCellArray()
-            self.contour2Dpipeline.polyData.SetPoints(points)
-            self.contour2Dpipeline.polyData.SetLines(lines)
-
-            points.InsertNextPoint(eventPosition[0], eventPosition[1], 0)
+            self.contour2Dpipeline.resetContour(eventPosition[0], eventPosition[1])
 
             # Thin
             pointsThin = vtk.vtkPoints()
@@ -161,19 +359,9 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 
     def __updateGlyphWithNewPosition(self, eventPosition: Tuple, finalize: bool) -> None:
         if self.contour2Dpipeline.isDragging:
-            points = self.contour2Dpipeline.polyData.GetPoints()
-            newPointIndex = points.InsertNextPoint(eventPosition[0], eventPosition[1], 0)
-            points.Modified()
-
-            idList = vtk.vtkIdList()
+            self.contour2Dpipeline.appendContourPoint(eventPosition[0], eventPosition[1])
             if finalize:
-                idList.InsertNextId(newPointIndex)
-                idList.InsertNextId(0)
-            else:
-                idList.InsertNextId(newPointIndex - 1)
-                idList.InsertNextId(newPointIndex)
-
-            self.contour2Dpipeline.polyData.InsertNextCell(vtk.VTK_LINE, idList)
+                self.contour2Dpipeline.closeContour()
 
             self.contour2Dpipeline.polyDataThin.GetPoints().SetPoint(1, eventPosition[0], eventPosition[1], 0)
             self.contour2Dpipeline.polyDataThin.GetPoints().Modified()
@@ -183,29 +371,56 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 
     def __leftButtonPressEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
         self.contour2Dpipeline.isDragging = True
+        renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+        # Only the GPU ray cast mapper gives the depth of the visible surface, other mappers cut through the whole volume
+        # Read before the hold (the render applies the queued cuts) and before the volumes are hidden
+        self.surfaceDepth = None
+        if self.depthMm is not None and engine.SurfaceDepth.supportsDepthImage(self.cutEngine.mapper):
+            self.surfaceDepth = engine.SurfaceDepth(renderer, self.cutEngine.mapper)
+        # Don't evaluate queued cuts while drawing the next contour
+        self.cutEngine.hold()
         eventPosition = self.GetInteractor().GetEventPosition()
         self.__createGlyph(eventPosition)
+        self.contour2Dpipeline.preview.begin(renderer, self.imageData, self.modifierLabelmap)
+        # The camera doesn't move while drawing, don't ray cast the volume for each new point
+        self.contour2Dpipeline.freezeBackground(renderer)
+        self.numberOfMoveEvents = 0
         self.OnLeftButtonDown()
 
     def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
         if self.contour2Dpipeline.isDragging:
             eventPosition = self.GetInteractor().GetEventPosition()
             self.__updateGlyphWithNewPosition(eventPosition, False)
+            self.numberOfMoveEvents += 1
+            if self.numberOfMoveEvents % self.previewInterval == 0:
+                self.__updatePreview()
             self.GetInteractor().Render()
+
+    def __updatePreview(self) -> None:
+        renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+        viewportOrigin = renderer.GetOrigin()
+        contourXY = self.contour2Dpipeline.getContourPointsXY() - viewportOrigin
+        self.contour2Dpipeline.preview.update(contourXY, self.operation == Operation.OUTSIDE)
             
     def __leftButtonReleaseEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
         if self.contour2Dpipeline.isDragging:
             eventPosition = self.GetInteractor().GetEventPosition()
             self.contour2Dpipeline.isDragging = False
             self.__updateGlyphWithNewPosition(eventPosition, True)
+            # The full resolution cut replaces the preview
+            self.contour2Dpipeline.preview.end()
+            renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+            self.contour2Dpipeline.unfreezeBackground(renderer)
             start = time.time()
             self.__paintApply()
             stop = time.time()
             print("-----")
             print("__paintApply():", stop - start)
+            # Queued cuts are evaluated when the user stops cutting
+            self.cutEngine.scheduleFlush()
             self.OnLeftButtonUp()
 
-            style = vtk.vtkInteractorStyleTrackballCamera()
+            style = BeforeCropFreehandInteractorStyle(self.contour2Dpipeline, self.imageData, self.modifierLabelmap, self.operation, self.cutEngine, self.depthMm)
             self.GetInteractor().SetInteractorStyle(style)
 
     '''
@@ -312,8 +527,8 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
                 for i in range(3):
                     p1World[i] = cameraPos[i] + tF * ray[i]
                     p2World[i] = cameraPos[i] + tB * ray[i]
-                closedSurfacePoints.InsertNextPoint(p1World)
-                closedSurfacePoints.InsertNextPoint(p2World)
+            closedSurfacePoints.InsertNextPoint(p1World)
+            closedSurfacePoints.InsertNextPoint(p2World)
 
         # Skirt
         closedSurfaceStrips = vtk.vtkCellArray() # object to represent cell connectivity
@@ -354,7 +569,6 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     '''
     Description:
         Using a transform matrix to convert from world coordinates to model (image) coordinates.
-        Set bounds for image stencil with two cases: INSIDE or OUTSIDE
     '''
     def __updateBrushStencil(self) -> None:
         self.worldToModifierLabelmapIjkTransform.Identity()
@@ -370,12 +584,10 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 
         self.worldToModifierLabelmapIjkTransformer.Update()
 
-        self.brushPolyDataToStencil.SetOutputWholeExtent(self.modifierLabelmap.GetExtent())
-
     '''
     Description: 
-        Convert from image stencil to image data, set cropped region equal 1.
-        Set spacing, origin and direction.
+        Queue the brush model (in IJK coordinates) in the cut engine.
+        INSIDE removes the prism, OUTSIDE removes its complement.
     '''
     def __paintApply(self) -> None:
         start = time.time()
@@ -389,71 +601,17 @@ class CropFreehandInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         stop = time.time()
         print("__updateBrushStencil():", stop-start)
 
-        self.brushPolyDataToStencil.Update()
-    
-        # vtkImageStencilToImage will convert an image stencil into a binary image
-        # The default output will be an 8-bit image with a value of 1 inside the stencil and 0 outside
-        stencilToImage = vtk.vtkImageStencilToImage()
-        stencilToImage.SetInputData(self.brushPolyDataToStencil.GetOutput())
-
-        stencilToImage.SetInsideValue(self.operation == Operation.INSIDE)
-        stencilToImage.SetOutsideValue(self.operation != Operation.INSIDE)
-
-        stencilToImage.SetOutputScalarType(self.modifierLabelmap.GetScalarType()) # vtk.VTK_SHORT: [-32768->32767], vtk.VTK_UNSIGNED_CHAR: [0->255]
-        stencilToImage.Update()
-
-        orientedBrushPositionerOutput = vtk.vtkImageData()
-        orientedBrushPositionerOutput.DeepCopy(stencilToImage.GetOutput())
-
-        imageToWorld = vtk.vtkMatrix4x4()
-        utils.GetImageToWorldMatrix(self.modifierLabelmap, imageToWorld)
-
-        utils.SetImageToWorldMatrix(orientedBrushPositionerOutput, imageToWorld)
-
-        utils.modifyImage(self.modifierLabelmap, orientedBrushPositionerOutput)
-        start = time.time()
-        self.__maskVolume()
-        stop = time.time()
-        print("__maskVolume():", stop-start)
-
-    '''
-    Description: Apply the mask for volume and render the new volume
-        Hard edge: CT-Bone, CT-Angio
-        Soft edge: CT-Muscle, CT-Mip
-    '''
-    def __maskVolume(self, fillValue=-1000) -> None:
-        # Hard, Soft edge
-        # Thresholding of modifierLabelmap
-        thresh = vtk.vtkImageThreshold()
-        maskMin = 0
-        maskMax = 1
-        thresh.SetOutputScalarTypeToUnsignedChar() # vtk.VTK_UNSIGNED_CHAR: 0-255
-        thresh.SetInputData(self.modifierLabelmap)
-        thresh.ThresholdByLower(0) # <= 0
-        thresh.SetInValue(maskMin)
-        thresh.SetOutValue(maskMax)
-        thresh.Update()
-        maskImage = thresh.GetOutput()
-
-        nshape = tuple(reversed(maskImage.GetDimensions())) # (z, y, x)
-
-        # Convert binary mask image and origin image data from vtkDataArray (supper class) to numpy
-        maskArray = vtk_to_numpy(maskImage.GetPointData().GetScalars()).reshape(nshape).astype(float)
-        inputArray = vtk_to_numpy(self.imageData.GetPointData().GetScalars()).reshape(nshape)
-
-        resultArray = inputArray[:] * (1 - maskArray[:]) + float(fillValue) * maskArray[:] # -1000 HU: air
-
-        result = numpy_to_vtk(resultArray.astype(inputArray.dtype).reshape(1, -1)[0])   
-        
-        maskedImageData = vtk.vtkImageData()
-        maskedImageData.SetExtent(self.modifierLabelmap.GetExtent())
-        maskedImageData.SetOrigin(self.modifierLabelmap.GetOrigin())
-        maskedImageData.SetSpacing(self.modifierLabelmap.GetSpacing())
-        maskedImageData.SetDirectionMatrix(self.modifierLabelmap.GetDirectionMatrix())
-        maskedImageData.GetPointData().SetScalars(result)
-        
-        # Render the new volume
-        self.mapper.SetInputData(maskedImageData)
+        brushModel_ModifierLabelmapIjk = self.worldToModifierLabelmapIjkTransformer.GetOutput() # vtkPolyData
+        if self.surfaceDepth is None:
+            # Axis aligned parallel projection cuts skip the polydata to stencil conversion
+            shape = engine.createPrismShape(brushModel_ModifierLabelmapIjk, self.operation == Operation.OUTSIDE)
+        else:
+            # The camera didn't move since the depth was read when drawing started
+            ijkToWorldMatrix = vtk.vtkMatrix4x4()
+            utils.GetImageToWorldMatrix(self.modifierLabelmap, ijkToWorldMatrix)
+            shape = engine.DepthLimitedPrismShape(brushModel_ModifierLabelmapIjk, ijkToWorldMatrix, self.surfaceDepth, self.depthMm, self.operation == Operation.OUTSIDE)
+            self.surfaceDepth = None
+        self.cutEngine.union(shape)
 
 """
     Description: calculate input data for transfer function.
@@ -508,8 +666,10 @@ def main() -> None:
     rgb_points = to_rgb_points(STANDARD)
     colors = vtk.vtkNamedColors()
     reader = vtk.vtkDICOMImageReader()
-    mapper = vtk.vtkSmartVolumeMapper()
-    # map = vtk.vtkFixedPointVolumeRayCastMapper()
+    # GPU ray cast mapper renders cuts through a mask input, the CT is uploaded once
+    mapper = vtk.vtkGPUVolumeRayCastMapper()
+    # CPU fallback: cuts are rendered by rewriting a masked copy of the volume
+    # mapper = vtk.vtkFixedPointVolumeRayCastMapper()
     volume = vtk.vtkVolume()
     volumeProperty = vtk.vtkVolumeProperty()
     renderer = vtk.vtkRenderer()
@@ -542,9 +702,6 @@ def main() -> None:
     modifierLabelmap.GetPointData().GetScalars().Fill(0)
     # print(imageData)
 
-    # This option will use hardware accelerated rendering exclusively
-    # This is a good option if you know there is hardware acceleration
-    mapper.SetRequestedRenderModeToGPU()
     mapper.SetInputData(imageData)
 
     volumeProperty.SetInterpolationTypeToLinear()
@@ -586,6 +743,7 @@ def main() -> None:
     renderer.AddActor(outlineActor)
     renderer.AddActor(contour2Dpipeline.actor)
     renderer.AddActor(contour2Dpipeline.actorThin)
+    renderer.AddActor(contour2Dpipeline.preview.actor)
     # renderer.AddActor(contour2Dpipeline.polyData3Dactor)
     # renderer.AddActor(contour2Dpipeline.imageDataActor)
     
@@ -594,8 +752,21 @@ def main() -> None:
     renderWindow.AddRenderer(renderer)
     
     renderWindowIn.SetRenderWindow(renderWindow)
+    # Cuts are queued and evaluated together before the next render
+    # Each cut reports the removed tissue per class of STANDARD
+    cutEngine = engine.CutEngine(imageData, modifierLabelmap, mapper, tissueClasses=STANDARD)
+    cutEngine.attach(renderer, renderWindowIn)
+    printedReports = []
+    def printTissueComposition(obj: vtk.vtkRenderer, event: str) -> None:
+        # lastReport is replaced by each evaluation
+        if cutEngine.lastReport is not None and (not printedReports or printedReports[-1] is not cutEngine.lastReport):
+            printedReports[:] = [cutEngine.lastReport]
+            print(utils.formatTissueComposition(cutEngine.lastReport))
+    renderer.AddObserver(vtk.vtkCommand.EndEvent, printTissueComposition)
     operation = Operation.INSIDE
-    style = BeforeCropFreehandInteractorStyle(contour2Dpipeline, imageData, modifierLabelmap, operation, mapper)
+    # e.g. 10: only cut 10 mm behind the visible surface, None: cut through the whole volume
+    depthMm = None
+    style = BeforeCropFreehandInteractorStyle(contour2Dpipeline, imageData, modifierLabelmap, operation, cutEngine, depthMm)
     renderWindowIn.SetInteractorStyle(style)
 
     renderWindowIn.Initialize()
@@ -2,6 +2,8 @@ import vtk
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 from vtkmodules.vtkCommonCore import vtkMath
 
+import numpy as np
+
 import math
 from typing import List, Tuple
 
@@ -180,4 +182,284 @@ def normalizeMask(maskArray):
     maskMax = maskArray.max()
     mask = (maskArray.astype(float) - maskMin) / float(maskMax - maskMin)
 
-    return mask
\ No newline at end of file
+    return mask
+
+'''
+Description: Helpers for working on a part (extent) of an image with numpy.
+    Extents use the VTK convention [i0, i1, j0, j1, k0, k1], bounds included.
+    Arrays use the numpy order of the scalars: (z, y, x).
+'''
+def isEmptyExtent(extent: List[int]) -> bool:
+    return extent[0] > extent[1] or extent[2] > extent[3] or extent[4] > extent[5]
+
+def intersectExtents(extent1: List[int], extent2: List[int]) -> List[int]:
+    result = [0, -1, 0, -1, 0, -1]
+    for idx in range(3):
+        result[idx * 2] = max(extent1[idx * 2], extent2[idx * 2])
+        result[idx * 2 + 1] = min(extent1[idx * 2 + 1], extent2[idx * 2 + 1])
+    return result
+
+def unionExtents(extent1: List[int], extent2: List[int]) -> List[int]:
+    if extent1 is None or isEmptyExtent(extent1):
+        return list(extent2)
+    if isEmptyExtent(extent2):
+        return list(extent1)
+    result = [0, -1, 0, -1, 0, -1]
+    for idx in range(3):
+        result[idx * 2] = min(extent1[idx * 2], extent2[idx * 2])
+        result[idx * 2 + 1] = max(extent1[idx * 2 + 1], extent2[idx * 2 + 1])
+    return result
+
+def extentToShape(extent: List[int]) -> Tuple[int]:
+    return (extent[5] - extent[4] + 1, extent[3] - extent[2] + 1, extent[1] - extent[0] + 1)
+
+'''
+Description: numpy slices selecting extent inside an array covering wholeExtent.
+'''
+def extentToSlices(extent: List[int], wholeExtent: List[int]) -> Tuple[slice]:
+    return (
+        slice(extent[4] - wholeExtent[4], extent[5] - wholeExtent[4] + 1),
+        slice(extent[2] - wholeExtent[2], extent[3] - wholeExtent[2] + 1),
+        slice(extent[0] - wholeExtent[0], extent[1] - wholeExtent[0] + 1)
+    )
+
+'''
+Description: Return the scalars of imageData as a (z, y, x) numpy array sharing memory with VTK.
+'''
+def getArrayView(imageData: vtk.vtkImageData) -> np.ndarray:
+    nshape = extentToShape(imageData.GetExtent())
+    return vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(nshape)
+
+'''
+Description: Convert an image stencil into a boolean (z, y, x) array covering extent.
+'''
+def stencilToArray(stencilData: vtk.vtkImageStencilData, extent: List[int]) -> np.ndarray:
+    stencilToImage = vtk.vtkImageStencilToImage()
+    stencilToImage.SetInputData(stencilData)
+    stencilToImage.SetInsideValue(1)
+    stencilToImage.SetOutsideValue(0)
+    stencilToImage.SetOutputScalarTypeToUnsignedChar()
+    stencilToImage.Update()
+
+    stencilImage = stencilToImage.GetOutput()
+    mask = np.zeros(extentToShape(extent), dtype=bool)
+    commonExtent = intersectExtents(stencilImage.GetExtent(), extent)
+    if not isEmptyExtent(commonExtent):
+        mask[extentToSlices(commonExtent, extent)] = getArrayView(stencilImage)[extentToSlices(commonExtent, stencilImage.GetExtent())] > 0
+    return mask
+
+'''
+Description: Create an empty stencil covering the extent of imageData, in IJK coordinates
+    (origin 0, spacing 1) like the brush stencils. Cuts are merged into it as run-length extents,
+    see modifyStencil.
+'''
+def createStencil(imageData: vtk.vtkImageData) -> vtk.vtkImageStencilData:
+    stencilData = vtk.vtkImageStencilData()
+    stencilData.SetExtent(imageData.GetExtent())
+    stencilData.SetSpacing(1, 1, 1)
+    stencilData.SetOrigin(0, 0, 0)
+    stencilData.AllocateExtents()
+    return stencilData
+
+'''
+Description: Merge (or remove) the extents of modifierStencil into baseStencil.
+    Both stencils are in IJK coordinates of the same image. No image is materialized.
+'''
+def modifyStencil(baseStencil: vtk.vtkImageStencilData, modifierStencil: vtk.vtkImageStencilData, subtract=False) -> None:
+    wholeExtent = list(baseStencil.GetExtent())
+    if subtract:
+        baseStencil.Subtract(modifierStencil)
+    else:
+        baseStencil.Add(modifierStencil)
+    # Add() grows the extent to the brush extent. Clip() drops the runs outside the image but the reported
+    # extent stays grown, the consumers (stencilToArray, vtkImageStencil) intersect it with the image extent
+    baseStencil.Clip(wholeExtent)
+    baseStencil.Modified()
+
+'''
+Description: Set voxels inside the stencil to fillValue (-1000 HU: air) in one pass.
+    The origin image data is not modified, the output is the only allocated volume.
+'''
+def applyStencil(imageData: vtk.vtkImageData, stencilData: vtk.vtkImageStencilData, fillValue=-1000) -> vtk.vtkImageData:
+    stencil = vtk.vtkImageStencil()
+    stencil.SetInputData(imageData)
+    stencil.SetStencilData(stencilData)
+    stencil.ReverseStencilOn()
+    stencil.SetBackgroundValue(fillValue)
+    stencil.Update()
+    return stencil.GetOutput()
+
+'''
+Description: IJK extent of the non zero voxels of a (z, y, x) array covering wholeExtent.
+Return: an empty extent when the array is all zero
+'''
+def getNonZeroExtent(array: np.ndarray, wholeExtent: List[int]) -> List[int]:
+    result = [0, -1, 0, -1, 0, -1]
+    # numpy axis of i, j, k
+    for idx, axis in enumerate([2, 1, 0]):
+        otherAxes = tuple(other for other in range(3) if other != axis)
+        indices = np.flatnonzero(np.any(array, axis=otherAxes))
+        if len(indices) == 0:
+            return [0, -1, 0, -1, 0, -1]
+        result[idx * 2] = wholeExtent[idx * 2] + int(indices[0])
+        result[idx * 2 + 1] = wholeExtent[idx * 2] + int(indices[-1])
+    return result
+
+'''
+Description: Crop imageData to extent in place. Origin, spacing and direction are kept and the
+    extent is shifted, so IJK and world coordinates of the remaining voxels do not change.
+    The scalars are a numpy view on the old scalars when the cropped region is contiguous
+    (only k is cropped), otherwise only the cropped region is copied.
+'''
+def cropImageData(imageData: vtk.vtkImageData, extent: List[int]) -> None:
+    oldScalars = imageData.GetPointData().GetScalars()
+    view = getArrayView(imageData)[extentToSlices(extent, imageData.GetExtent())]
+    if not view.flags.c_contiguous:
+        view = np.ascontiguousarray(view)
+
+    scalars = numpy_to_vtk(view.ravel(), deep=False, array_type=oldScalars.GetDataType())
+    scalars.SetName(oldScalars.GetName())
+
+    croppedImageData = vtk.vtkImageData()
+    croppedImageData.SetExtent(extent)
+    croppedImageData.SetOrigin(imageData.GetOrigin())
+    croppedImageData.SetSpacing(imageData.GetSpacing())
+    croppedImageData.SetDirectionMatrix(imageData.GetDirectionMatrix())
+    croppedImageData.GetPointData().SetScalars(scalars)
+
+    imageData.ShallowCopy(croppedImageData)
+    imageData.Modified()
+
+'''
+Description: Convert a boolean (z, y, x) array covering extent into an image stencil in IJK coordinates
+    (origin 0, spacing 1), the inverse of stencilToArray.
+'''
+def arrayToStencil(mask: np.ndarray, extent: List[int]) -> vtk.vtkImageStencilData:
+    maskImage = vtk.vtkImageData()
+    maskImage.SetExtent(extent)
+    maskImage.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+    getArrayView(maskImage)[...] = mask
+
+    imageToStencil = vtk.vtkImageToImageStencil()
+    imageToStencil.SetInputData(maskImage)
+    imageToStencil.ThresholdByUpper(1)
+    imageToStencil.Update()
+    return imageToStencil.GetOutput()
+
+'''
+Description: Boolean (z, y, x) mask of a sphere in IJK coordinates, centered in the array.
+    The voxels are anisotropic, the sphere is an ellipsoid in IJK with radius radiusMm / spacing.
+Return: the mask and the half size of the mask along i, j, k
+'''
+def createSphereMask(radiusMm: float, spacing: List[float]) -> Tuple[np.ndarray, List[int]]:
+    halfSize = [max(0, math.floor(radiusMm / spacing[idx])) for idx in range(3)]
+    k, j, i = np.ogrid[
+        -halfSize[2]:halfSize[2] + 1,
+        -halfSize[1]:halfSize[1] + 1,
+        -halfSize[0]:halfSize[0] + 1
+    ]
+    distance2 = (i * spacing[0]) ** 2 + (j * spacing[1]) ** 2 + (k * spacing[2]) ** 2
+    return distance2 <= radiusMm ** 2, halfSize
+
+'''
+Description: World to view matrix of the renderer as a numpy array, the same matrix as
+    vtkRenderer::WorldToView: x, y in [-1, 1] over the viewport, z in [0, 1] like the z-buffer.
+'''
+def getWorldToViewMatrix(renderer: vtk.vtkRenderer) -> np.ndarray:
+    camera = renderer.GetActiveCamera()
+    mat = camera.GetCompositeProjectionTransformMatrix(renderer.GetTiledAspectRatio(), 0, 1)
+    return np.array([[mat.GetElement(row, col) for col in range(4)] for row in range(4)])
+
+'''
+Description: Pixel indices (relative to the viewport) of world points (N, 3), -1 when outside of the viewport.
+'''
+def worldToPixels(worldToView: np.ndarray, viewportSize: List[int], worldPoints: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    view = worldPoints @ worldToView[:3, :3].T + worldToView[:3, 3]
+    w = worldPoints @ worldToView[3, :3] + worldToView[3, 3]
+    pixelX = np.floor((view[:, 0] / w + 1.0) * 0.5 * viewportSize[0]).astype(np.int64)
+    pixelY = np.floor((view[:, 1] / w + 1.0) * 0.5 * viewportSize[1]).astype(np.int64)
+    outside = (pixelX < 0) | (pixelX >= viewportSize[0]) | (pixelY < 0) | (pixelY >= viewportSize[1])
+    pixelX[outside] = -1
+    pixelY[outside] = -1
+    return pixelX, pixelY
+
+'''
+Description: Rasterize a closed polygon given in pixel coordinates (N, 2) into a boolean (height, width)
+    array with the even-odd rule, a pixel is inside when its center is inside.
+'''
+def rasterizePolygon(pointsXY: np.ndarray, width: int, height: int) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=bool)
+    if len(pointsXY) < 3:
+        return mask
+    x0, y0 = pointsXY[:, 0], pointsXY[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    # Crossings of each edge (column) with the horizontal line through the pixel centers of each row,
+    # only rows covered by the polygon
+    firstRow = max(0, int(math.floor(y0.min())))
+    lastRow = min(height - 1, int(math.ceil(y0.max())))
+    if firstRow > lastRow:
+        return mask
+    rowY = np.arange(firstRow, lastRow + 1)[:, np.newaxis] + 0.5
+    crosses = (y0 <= rowY) != (y1 <= rowY)
+    rows, edges = np.nonzero(crosses)
+    if len(rows) == 0:
+        return mask
+    t = (rowY[rows, 0] - y0[edges]) / (y1[edges] - y0[edges])
+    crossingX = x0[edges] + t * (x1[edges] - x0[edges])
+
+    # Toggle the inside state from the first pixel center right of each crossing
+    columns = np.clip(np.ceil(crossingX - 0.5), 0, width).astype(np.int64)
+    numberOfRows = lastRow - firstRow + 1
+    toggles = np.bincount(rows * (width + 1) + columns, minlength=numberOfRows * (width + 1)).reshape(numberOfRows, width + 1)
+    mask[firstRow:lastRow + 1] = np.logical_xor.accumulate(toggles[:, :width] % 2 == 1, axis=1)
+    return mask
+
+'''
+Description: Split a colormap standard (e.g. STANDARD: air, lung, fat, soft tissue, bone) into HU classes.
+    The edge between two classes is the middle between the end of a range and the start of the next one.
+Return: the class names and the len(names) - 1 class edges
+'''
+def getTissueClasses(standard: List[dict]) -> Tuple[List[str], np.ndarray]:
+    names = [item["name"] for item in standard]
+    edges = [(standard[idx]["range"][-1] + standard[idx + 1]["range"][0]) / 2 for idx in range(len(standard) - 1)]
+    return names, np.array(edges)
+
+'''
+Description: Class of every value of an 8 or 16 bit integer type (e.g. int16 CT), indexed by the bit pattern
+    of the value. The voxels are counted per value and the counts are folded into classes with the table,
+    instead of a binary search per voxel.
+Return: None for other scalar types
+'''
+def getTissueClassLookupTable(edges: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "iu" or dtype.itemsize > 2:
+        return None
+    bitPatterns = np.arange(2 ** (8 * dtype.itemsize), dtype=np.dtype("u{}".format(dtype.itemsize)))
+    return np.searchsorted(edges, bitPatterns.view(dtype), side="right").astype(np.uint8)
+
+'''
+Description: Count voxels and volume (mm³) per HU class with a single bincount.
+    values: HU values of the voxels to count
+    voxelVolume: volume of one voxel in mm³
+    lookupTable: from getTissueClassLookupTable for the type of values, optional
+'''
+def computeTissueComposition(values: np.ndarray, names: List[str], edges: np.ndarray, voxelVolume: float, lookupTable=None) -> List[dict]:
+    values = values.ravel()
+    if lookupTable is None:
+        counts = np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(names))
+    else:
+        valueCounts = np.bincount(values.view(np.dtype("u{}".format(values.itemsize))), minlength=len(lookupTable))
+        counts = np.bincount(lookupTable, weights=valueCounts, minlength=len(names)).astype(np.int64)
+    return [
+        {"name": name, "voxels": int(count), "volume": float(count * voxelVolume)}
+        for name, count in zip(names, counts)
+    ]
+
+def formatTissueComposition(composition: List[dict]) -> str:
+    totalVoxels = sum(item["voxels"] for item in composition)
+    totalVolume = sum(item["volume"] for item in composition)
+    lines = ["Removed: {} voxels, {:.1f} mm³".format(totalVoxels, totalVolume)]
+    for item in composition:
+        lines.append("    {}: {} voxels, {:.1f} mm³".format(item["name"], item["voxels"], item["volume"]))
+    return "\n".join(lines)
@@ -1,25 +1,47 @@
 from typing import List
 import vtk
 import utils
+import picker
+import glyphs
 
 """
     Description: class contains objects for angle measurement in the world coordinate system.
 """
 class AngleMeasurementPipeline():
-    def __init__(self) -> None:
+    def __init__(self, endpoints: glyphs.EndpointGlyphs = None) -> None:
         colors = vtk.vtkNamedColors()
         self.isDragging = False
-
-        # Line
+        # Picker used instead of the one of the interactor (picker.BlockVolumePicker), None: interactor picker
+        self.picker = None
+        # Picker of the hover marker only (picker.DepthBufferPicker), None: picker
+        self.hoverPicker = None
+        # Places the text actors of all finished measurements when the camera changed (utils.LabelProjector)
+        self.labelProjector = None
+
+        # Lines, fixed topology: 3 points updated in place when drawing
+        # line: the first point with the second point, it also holds the three points of the angle
         self.line = vtk.vtkPolyData()
+        points = vtk.vtkPoints()
+        points.SetNumberOfPoints(3)
+        for pointId in range(3):
+            points.SetPoint(pointId, 0, 0, 0)
+        lines = vtk.vtkCellArray()
+        lines.InsertNextCell(2, [0, 1])
+        self.line.SetPoints(points)
+        self.line.SetLines(lines)
+        # secondLine: the second point with the third point, same points
+        self.secondLine = vtk.vtkPolyData()
+        secondLines = vtk.vtkCellArray()
+        secondLines.InsertNextCell(2, [1, 2])
+        self.secondLine.SetPoints(points)
+        self.secondLine.SetLines(secondLines)
 
         # Arc
         self.arc = vtk.vtkArcSource()
         self.arc.SetResolution(30)
 
-        # Sphere
-        self.sphere = vtk.vtkSphereSource()
-        self.sphere.SetRadius(5)
+        # Spheres, shared with the other measurements when endpoints is given
+        self.endpoints = endpoints if endpoints is not None else glyphs.EndpointGlyphs()
 
         # Filter
         # vtkTubeFilter is a filter that generates a tube around each input line
@@ -28,6 +50,11 @@ class AngleMeasurementPipeline():
         self.tubeFilter.SetNumberOfSides(20)
         self.tubeFilter.SetRadius(1)
 
+        self.secondTubeFilter = vtk.vtkTubeFilter()
+        self.secondTubeFilter.SetInputData(self.secondLine)
+        self.secondTubeFilter.SetNumberOfSides(20)
+        self.secondTubeFilter.SetRadius(1)
+
         self.arcTubeFilter = vtk.vtkTubeFilter()
         self.arcTubeFilter.SetInputConnection(self.arc.GetOutputPort())
         self.arcTubeFilter.SetNumberOfSides(20)
@@ -38,20 +65,11 @@ class AngleMeasurementPipeline():
         self.firstLineMapper.SetInputConnection(self.tubeFilter.GetOutputPort())
 
         self.secondLineMapper = vtk.vtkPolyDataMapper()
-        self.secondLineMapper.SetInputConnection(self.tubeFilter.GetOutputPort())
+        self.secondLineMapper.SetInputConnection(self.secondTubeFilter.GetOutputPort())
 
         self.arcMapper = vtk.vtkPolyDataMapper()
         self.arcMapper.SetInputConnection(self.arcTubeFilter.GetOutputPort())
 
-        self.firstSphereMapper = vtk.vtkPolyDataMapper()
-        self.firstSphereMapper.SetInputConnection(self.sphere.GetOutputPort())
-
-        self.secondSphereMapper = vtk.vtkPolyDataMapper()
-        self.secondSphereMapper.SetInputConnection(self.sphere.GetOutputPort())
-
-        self.thirdSphereMapper =  vtk.vtkPolyDataMapper()
-        self.thirdSphereMapper.SetInputConnection(self.sphere.GetOutputPort())
-
         # Actors
         property = vtk.vtkProperty()
         property.SetColor(colors.GetColor3d("Tomato"))
@@ -84,23 +102,10 @@ class AngleMeasurementPipeline():
         textProperty.BoldOn()
         self.textActor.VisibilityOff()
 
-        # Used to mark the first point
-        self.firstSphereActor = vtk.vtkActor()
-        self.firstSphereActor.SetMapper(self.firstSphereMapper)
-        self.firstSphereActor.GetProperty().SetColor(0, 1, 0)
-        self.firstSphereActor.VisibilityOff()
-
-        # Used to mark the second point
-        self.secondSphereActor = vtk.vtkActor()
-        self.secondSphereActor.SetMapper(self.secondSphereMapper)
-        self.secondSphereActor.GetProperty().SetColor(0, 1, 0)
-        self.secondSphereActor.VisibilityOff()
-
-        # Used to mark the third point
-        self.thirdSphereActor = vtk.vtkActor()
-        self.thirdSphereActor.SetMapper(self.thirdSphereMapper)
-        self.thirdSphereActor.GetProperty().SetColor(0, 1, 0)
-        self.thirdSphereActor.VisibilityOff()
+        # Used to mark the first, the second and the third point
+        self.firstSphere = self.endpoints.AddEndpoint((0, 1, 0))
+        self.secondSphere = self.endpoints.AddEndpoint((0, 1, 0))
+        self.thirdSphere = self.endpoints.AddEndpoint((0, 1, 0))
 
 """
     Description:
@@ -136,6 +141,8 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.AddObserver(vtk.vtkCommand.LeftButtonPressEvent, self.__leftButtonPressEvent)
         self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.__mouseMoveEvent)
         self.AddObserver(vtk.vtkCommand.LeftButtonReleaseEvent, self.__leftButtonReleaseEvent)
+        # Mouse moves are handled at most once per frame
+        self.mouseMoveCoalescer = utils.MouseMoveCoalescer(self, self.__updateMousePosition)
     
     """
         Description:
@@ -144,12 +151,17 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             Used to draw two lines connecting the first point with the second point
             and the second point with the third point.
             Display the arc and the text actor.
+            Only the latest position is kept, it is handled by __updateMousePosition at the next frame.
     """
     def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        self.mouseMoveCoalescer.push(self.GetInteractor().GetEventPosition())
+
+    """
+        Description: A handle function of the latest mouse position.
+    """
+    def __updateMousePosition(self, eventPosition: List[int]) -> None:
         # vtkCellPicker object, it shoots a ray into the volume and returns the point where the ray intersects an isosurface of a chosen opacity
-        cellPicker = self.GetInteractor().GetPicker()
-        # The position of mouse in the display coordinate system
-        eventPosition = self.GetInteractor().GetEventPosition()
+        cellPicker = self.pipeline.picker or self.GetInteractor().GetPicker()
         # vtkRenderer object
         renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
         # vtkCamera object
@@ -157,10 +169,10 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 
         if not self.pipeline.isDragging:
             # Return a point in the world coordinate system on surface or out
-            pickPosition = utils.getPickPosition(eventPosition, cellPicker, renderer, camera)
+            pickPosition = utils.getPickPosition(eventPosition, self.pipeline.hoverPicker or cellPicker, renderer, camera)
             # Used to mark the position of mouse in the world coordinate system
-            self.pipeline.firstSphereActor.SetPosition(pickPosition)
-            self.pipeline.firstSphereActor.VisibilityOn()
+            self.pipeline.firstSphere.SetPosition(pickPosition)
+            self.pipeline.firstSphere.VisibilityOn()
         else:
             # Return vtkPoints object
             points = self.pipeline.line.GetPoints()
@@ -171,39 +183,24 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             
             if self.checkNumberOfPoints == 1:
                 # Used to mark the position of mouse in the world coordinate system
-                self.pipeline.secondSphereActor.SetPosition(pickPosition)
-                self.pipeline.secondSphereActor.VisibilityOn()
+                self.pipeline.secondSphere.SetPosition(pickPosition)
+                self.pipeline.secondSphere.VisibilityOn()
 
-                # Save the second point with its id into vtkPoints object
+                # Save the second point with its id into vtkPoints object, the third point follows it until the second click
                 points.SetPoint(1, pickPosition)
+                points.SetPoint(2, pickPosition)
                 # Update the modification time for this object and its Data
                 points.Modified()
-
-                # vtkIdList may represent any type of integer id, but usually represents point and cell ids
-                idList = vtk.vtkIdList()
-                idList.InsertNextId(0)
-                idList.InsertNextId(1)
-
-                # Insert a cell of type VTK_LINE
-                self.pipeline.line.InsertNextCell(vtk.VTK_LINE, idList)
             if self.checkNumberOfPoints == 2:
                 # Used to mark the position of mouse in the world coordinate system
-                self.pipeline.thirdSphereActor.SetPosition(pickPosition)
-                self.pipeline.thirdSphereActor.VisibilityOn()
+                self.pipeline.thirdSphere.SetPosition(pickPosition)
+                self.pipeline.thirdSphere.VisibilityOn()
 
                 # Save the third point with its id into vtkPoints object
                 points.SetPoint(2, pickPosition)
                 # Update the modification time for this object and its Data
                 points.Modified()
 
-                # vtkIdList may represent any type of integer id, but usually represents point and cell ids
-                idList = vtk.vtkIdList()
-                idList.InsertNextId(1)
-                idList.InsertNextId(2)
-
-                # Insert a cell of type VTK_LINE
-                self.pipeline.line.InsertNextCell(vtk.VTK_LINE, idList)
-
                 # Method used to calculate the angle, the arc and the position of text actor
                 utils.buildArcAngleMeasurement(self.pipeline.arc, self.pipeline.textActor, renderer, points)
         self.GetInteractor().Render()
@@ -214,6 +211,8 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             Used to mark the position of points in world coordinates when click.
     """
     def __leftButtonPressEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        # Handle the pending mouse move first, the dragged point is the latest position
+        self.mouseMoveCoalescer.flush()
         # vtkRenderer object
         renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
         # vtkCamera object
@@ -221,7 +220,7 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         # The position of mouse in the display coordinate system
         eventPosition = self.GetInteractor().GetEventPosition()
         # Return vtkCellPicker object, it shoots a ray into the volume and returns the point where the ray intersects an isosurface of a chosen opacity
-        cellPicker = self.GetInteractor().GetPicker()
+        cellPicker = self.pipeline.picker or self.GetInteractor().GetPicker()
         
         self.checkNumberOfPoints += 1
         if self.checkNumberOfPoints == 1:
@@ -231,23 +230,15 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             pickPosition = utils.getPickPosition(eventPosition, cellPicker, renderer, camera)
 
             # Marking the first point
-            self.pipeline.firstSphereActor.GetProperty().SetColor(1, 0, 0)
-            self.pipeline.firstSphereActor.SetPosition(pickPosition)
-
-            # vtkPoints represents 3D points used to save 2 points in world coordinates
-            points = vtk.vtkPoints()
-            # vtkCellArray object to represent cell connectivity
-            aline = vtk.vtkCellArray()
-            # Set objects into vtkPolyData object
-            self.pipeline.line.SetPoints(points)
-            self.pipeline.line.SetLines(aline)
-        
-            # Insert the first point into vtkPoints object when having left button press
-            points.InsertNextPoint(pickPosition)
-            # Insert the second point into vtkPoints object when having left button press, default value
-            points.InsertNextPoint(0, 0, 0)
-            # Insert the third point into vtkPoints object when having left button press, default value
-            points.InsertNextPoint(0, 0, 0)
+            self.pipeline.firstSphere.SetColor(1, 0, 0)
+            self.pipeline.firstSphere.SetPosition(pickPosition)
+
+            # vtkPoints used to save 3 points in world coordinates
+            points = self.pipeline.line.GetPoints()
+            # The first point when having left button press, the other points follow the mouse (empty lines until then)
+            for pointId in range(3):
+                points.SetPoint(pointId, pickPosition)
+            points.Modified()
 
             # Turn on the first line actor object
             self.pipeline.firstLineActor.VisibilityOn()
@@ -259,8 +250,8 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
                 pickPosition = points.GetPoint(1)
 
                 # Marking the second point
-                self.pipeline.secondSphereActor.GetProperty().SetColor(1, 0, 0)
-                self.pipeline.secondSphereActor.SetPosition(pickPosition)
+                self.pipeline.secondSphere.SetColor(1, 0, 0)
+                self.pipeline.secondSphere.SetPosition(pickPosition)
 
                 # Turn on the second line actor object
                 self.pipeline.secondLineActor.VisibilityOn()
@@ -273,8 +264,8 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
                 pickPosition = points.GetPoint(2)
 
                 # Marking the third point
-                self.pipeline.thirdSphereActor.GetProperty().SetColor(1, 0, 0)
-                self.pipeline.thirdSphereActor.SetPosition(pickPosition)
+                self.pipeline.thirdSphere.SetColor(1, 0, 0)
+                self.pipeline.thirdSphere.SetPosition(pickPosition)
         # Override method of super class
         self.OnLeftButtonDown()
 
@@ -287,7 +278,15 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __leftButtonReleaseEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
         self.OnLeftButtonUp()
         if self.checkNumberOfPoints == 3:
+            self.mouseMoveCoalescer.cancel()
             self.pipeline.isDragging = False # Stop drawing
+            # From now on the text actor is placed by the label projector
+            renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+            anchor = utils.buildArcAngleMeasurement(self.pipeline.arc, self.pipeline.textActor, renderer, self.pipeline.line.GetPoints())
+            if anchor is not None:
+                if self.pipeline.labelProjector is None:
+                    self.pipeline.labelProjector = utils.LabelProjector(renderer)
+                self.pipeline.labelProjector.AddLabel(self.pipeline.textActor, anchor)
 
             # Set interactor style when stop drawing
             style = AfterAngleMeasurementInteractorStyle(self.pipeline)
@@ -301,19 +300,7 @@ class AngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 class AfterAngleMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __init__(self, pipeline: AngleMeasurementPipeline) -> None:
         self.pipeline = pipeline
-        self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.__mouseMoveEvent)
-
-    """
-        Description:
-            A handle function used to update the position of text actor when having mouse move event.
-    """
-    def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
-        renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
-        points = self.pipeline.line.GetPoints()
-        # Update the position of text actor
-        utils.buildArcAngleMeasurement(self.pipeline.arc, self.pipeline.textActor, renderer, points)
-        self.GetInteractor().Render()
-        self.OnMouseMove()
+        # The text actor follows the camera through pipeline.labelProjector, no mouse move handler
 
 """
     Description: calculate input data for transfer function
@@ -370,7 +357,8 @@ def main():
     rgb_points = to_rgb_points(STANDARD)
     colors = vtk.vtkNamedColors()
     reader = vtk.vtkDICOMImageReader()
-    map = vtk.vtkSmartVolumeMapper()
+    # GPU mapper: the hover picker reads its depth image (picker.DepthBufferPicker)
+    map = vtk.vtkGPUVolumeRayCastMapper()
     vol = vtk.vtkVolume()
     volProperty = vtk.vtkVolumeProperty()
     render = vtk.vtkRenderer()
@@ -392,9 +380,6 @@ def main():
     reader.SetDirectoryName(path)
     reader.Update()
     
-    # This option will use hardware accelerated rendering exclusively
-    # This is a good option if you know there is hardware acceleration
-    map.SetRequestedRenderModeToGPU()
     map.SetInputData(reader.GetOutput())
 
     volProperty.SetInterpolationTypeToLinear()
@@ -424,7 +409,7 @@ def main():
     render.SetBackground(colors.GetColor3d("White"))
     render.AddVolume(vol)
     render.AddActor(outlineActor)
-    render.AddActor(pipeline.firstSphereActor); render.AddActor(pipeline.secondSphereActor); render.AddActor(pipeline.thirdSphereActor)
+    render.AddActor(pipeline.endpoints.actor)
     render.AddActor(pipeline.firstLineActor); render.AddActor(pipeline.secondLineActor)
     render.AddActor(pipeline.arcActor)
     render.AddActor(pipeline.textActor)
@@ -438,6 +423,9 @@ def main():
     cellPicker.AddPickList(vol)
     cellPicker.PickFromListOn()
     renIn.SetPicker(cellPicker)
+    pipeline.picker = picker.BlockVolumePicker(vol)
+    pipeline.hoverPicker = picker.DepthBufferPicker(vol, pipeline.picker)
+    pipeline.labelProjector = utils.LabelProjector(render)
     style = BeforeAngleMeasurementInteractorStyle(pipeline)
     renIn.SetInteractorStyle(style)
 
@@ -0,0 +1,91 @@
+import vtk
+from typing import List, Tuple
+
+"""
+    Description:
+        Spheres marking the end points of the measurements, drawn by one vtkGlyph3DMapper (one actor) for all
+        measurements instead of one mapper and one actor per sphere.
+        Each end point is a point of the glyph polydata with a color and a visibility (mask), it is updated in place.
+"""
+class EndpointGlyphs():
+    def __init__(self, radius=5) -> None:
+        self.sphere = vtk.vtkSphereSource()
+        self.sphere.SetRadius(radius)
+
+        self.points = vtk.vtkPoints()
+        self.colors = vtk.vtkUnsignedCharArray()
+        self.colors.SetName("Colors")
+        self.colors.SetNumberOfComponents(3)
+        self.visibility = vtk.vtkBitArray() # vtkGlyph3DMapper masks with a bit array only
+        self.visibility.SetName("Visibility")
+
+        self.polyData = vtk.vtkPolyData()
+        self.polyData.SetPoints(self.points)
+        self.polyData.GetPointData().AddArray(self.colors)
+        self.polyData.GetPointData().AddArray(self.visibility)
+
+        # vtkGlyph3DMapper draws a copy of the sphere at each point
+        self.mapper = vtk.vtkGlyph3DMapper()
+        self.mapper.SetInputData(self.polyData)
+        self.mapper.SetSourceConnection(self.sphere.GetOutputPort())
+        self.mapper.ScalingOff()
+        self.mapper.OrientOff()
+        self.mapper.SetScalarModeToUsePointFieldData()
+        self.mapper.SelectColorArray("Colors")
+        self.mapper.SetColorModeToDirectScalars()
+        self.mapper.MaskingOn()
+        self.mapper.SetMaskArray("Visibility")
+
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(self.mapper)
+        self.actor.PickableOff()
+
+    """
+        Description: add a hidden end point at the origin.
+        Return: the end point
+    """
+    def AddEndpoint(self, color: Tuple[float] = (0, 1, 0)) -> "Endpoint":
+        index = self.points.InsertNextPoint(0, 0, 0)
+        self.colors.InsertNextTuple3(0, 0, 0)
+        self.visibility.InsertNextValue(0)
+        endpoint = Endpoint(self, index)
+        endpoint.SetColor(*color)
+        return endpoint
+
+    def Modified(self) -> None:
+        self.polyData.Modified()
+
+"""
+    Description: one end point of EndpointGlyphs, same methods as the sphere actor it replaces.
+"""
+class Endpoint():
+    def __init__(self, glyphs: EndpointGlyphs, index: int) -> None:
+        self.glyphs = glyphs
+        self.index = index
+
+    def SetPosition(self, position: List[float]) -> None:
+        self.glyphs.points.SetPoint(self.index, position)
+        self.glyphs.points.Modified()
+        self.glyphs.Modified()
+
+    def GetPosition(self) -> Tuple[float]:
+        return self.glyphs.points.GetPoint(self.index)
+
+    """
+        Description: color with components between 0 and 1 (like vtkProperty.SetColor).
+    """
+    def SetColor(self, red: float, green: float, blue: float) -> None:
+        self.glyphs.colors.SetTuple3(self.index, round(red * 255), round(green * 255), round(blue * 255))
+        self.glyphs.colors.Modified()
+        self.glyphs.Modified()
+
+    def SetVisibility(self, visibility: bool) -> None:
+        self.glyphs.visibility.SetValue(self.index, 1 if visibility else 0)
+        self.glyphs.visibility.Modified()
+        self.glyphs.Modified()
+
+    def VisibilityOn(self) -> None:
+        self.SetVisibility(True)
+
+    def VisibilityOff(self) -> None:
+        self.SetVisibility(False)
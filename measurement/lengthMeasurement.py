@@ -1,5 +1,7 @@
 import vtk
 import utils
+import picker
+import glyphs
 from typing import List
 
 """
@@ -7,17 +9,31 @@ from typing import List
         Class contains objects for drawing line in the world coordinate system.
 """
 class LengthMeasurementPipeline():
-    def __init__(self) -> None:
+    def __init__(self, endpoints: glyphs.EndpointGlyphs = None) -> None:
         colors = vtk.vtkNamedColors()
         self.isDragging = False
+        # Picker used instead of the one of the interactor (picker.BlockVolumePicker), None: interactor picker
+        self.picker = None
+        # Picker of the hover marker only (picker.DepthBufferPicker), None: picker
+        self.hoverPicker = None
+        # Places the text actors of all finished measurements when the camera changed (utils.LabelProjector)
+        self.labelProjector = None
 
         # Line
         # vtkPolyData represents a geometric structure consisting of vertices, lines, polygons, and/or triangle strips
+        # Fixed topology: 2 points and 1 line, the points are updated in place when drawing
         self.line = vtk.vtkPolyData()
-
-        # Sphere source
-        self.sphere = vtk.vtkSphereSource()
-        self.sphere.SetRadius(5)
+        points = vtk.vtkPoints()
+        points.SetNumberOfPoints(2)
+        points.SetPoint(0, 0, 0, 0)
+        points.SetPoint(1, 0, 0, 0)
+        lines = vtk.vtkCellArray()
+        lines.InsertNextCell(2, [0, 1])
+        self.line.SetPoints(points)
+        self.line.SetLines(lines)
+
+        # Spheres, shared with the other measurements when endpoints is given
+        self.endpoints = endpoints if endpoints is not None else glyphs.EndpointGlyphs()
 
         # Filter
         # vtkTubeFilter is a filter that generates a tube around each input line
@@ -30,12 +46,6 @@ class LengthMeasurementPipeline():
         self.lineMapper = vtk.vtkPolyDataMapper()
         self.lineMapper.SetInputConnection(self.tubeFilter.GetOutputPort())
 
-        self.firstSphereMapper = vtk.vtkPolyDataMapper()
-        self.firstSphereMapper.SetInputConnection(self.sphere.GetOutputPort())
-
-        self.secondSphereMapper = vtk.vtkPolyDataMapper()
-        self.secondSphereMapper.SetInputConnection(self.sphere.GetOutputPort())
-        
         # Actors
         self.lineActor = vtk.vtkActor()
         self.lineActor.SetMapper(self.lineMapper)
@@ -54,15 +64,8 @@ class LengthMeasurementPipeline():
         self.textActor.VisibilityOff()
 
         # Marking the first point and the second point by two spheres
-        self.firstSphereActor = vtk.vtkActor()
-        self.firstSphereActor.GetProperty().SetColor(0, 1, 0)
-        self.firstSphereActor.SetMapper(self.firstSphereMapper)
-        self.firstSphereActor.VisibilityOff()
-        
-        self.secondSphereActor = vtk.vtkActor()
-        self.secondSphereActor.GetProperty().SetColor(0, 1, 0)
-        self.secondSphereActor.SetMapper(self.secondSphereMapper)
-        self.secondSphereActor.VisibilityOff()
+        self.firstSphere = self.endpoints.AddEndpoint((0, 1, 0))
+        self.secondSphere = self.endpoints.AddEndpoint((0, 1, 0))
 
 """
     Description: 
@@ -99,22 +102,30 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.AddObserver(vtk.vtkCommand.LeftButtonPressEvent, self.__leftButtonPressEvent)
         self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.__mouseMoveEvent)
         self.AddObserver(vtk.vtkCommand.LeftButtonReleaseEvent, self.__leftButtonReleaseEvent)
+        # Mouse moves are handled at most once per frame
+        self.mouseMoveCoalescer = utils.MouseMoveCoalescer(self, self.__updateMousePosition)
 
     """
         Description:
             A handle function when having mouse move event.
+            Only the latest position is kept, it is handled by __updateMousePosition at the next frame.
+    """
+    def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        self.mouseMoveCoalescer.push(self.GetInteractor().GetEventPosition())
+
+    """
+        Description:
+            A handle function of the latest mouse position.
             Used to mark the position of mouse in world coordinates when moving.
             Used to draw a line connecting two points.
     """
-    def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+    def __updateMousePosition(self, eventPosition: List[int]) -> None:
         # vtkRenderer object
         renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
         # vtkCamera object
         camera = renderer.GetActiveCamera()
-        # The position of mouse in the display coordinate system
-        eventPosition = list(self.GetInteractor().GetEventPosition())
         # vtkCellPicker object, it shoots a ray into the volume and returns the point where the ray intersects an isosurface of a chosen opacity
-        cellPicker = self.GetInteractor().GetPicker()
+        cellPicker = self.pipeline.picker or self.GetInteractor().GetPicker()
 
         if self.pipeline.isDragging:
             if self.checkNumberOfPoints == 1:
@@ -126,29 +137,22 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
                 pickPosition = utils.getPickPosition(eventPosition, cellPicker, renderer, camera, True, firstPoint)
                 
                 # Marking the second point when drawing
-                self.pipeline.secondSphereActor.SetPosition(pickPosition)
-                self.pipeline.secondSphereActor.VisibilityOn() # Turn on the second sphere
+                self.pipeline.secondSphere.SetPosition(pickPosition)
+                self.pipeline.secondSphere.VisibilityOn() # Turn on the second sphere
 
-                # Save the second point
+                # Save the second point, the line between the two points already exists
                 points.SetPoint(1, pickPosition)
                 # Update the modification time for this object and its Data
                 points.Modified()
 
-                # vtkIdList may represent any type of integer id, but usually represents point and cell ids
-                idList = vtk.vtkIdList()
-                idList.InsertNextId(0) # Insert id of the first point
-                idList.InsertNextId(1) # Insert id of the second point
-
-                # Insert a cell of type VTK_LINE
-                self.pipeline.line.InsertNextCell(vtk.VTK_LINE, idList)
                 # Method used to calculate the position of text actor
                 utils.buildTextActorLengthMeasurement(self.pipeline.textActor, renderer, points)
 
         else: # TODO: code need to processed in javascript
-            pickPosition = utils.getPickPosition(eventPosition, cellPicker, renderer, camera)
+            pickPosition = utils.getPickPosition(eventPosition, self.pipeline.hoverPicker or cellPicker, renderer, camera)
             # Marking the position of mouse in world coordinates
-            self.pipeline.firstSphereActor.SetPosition(pickPosition)
-            self.pipeline.firstSphereActor.VisibilityOn() # Turn on the first sphere
+            self.pipeline.firstSphere.SetPosition(pickPosition)
+            self.pipeline.firstSphere.VisibilityOn() # Turn on the first sphere
         self.GetInteractor().Render()
     
     """
@@ -157,6 +161,8 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             Used to mark the position of points in world coordinates when click.
     """
     def __leftButtonPressEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        # Handle the pending mouse move first, the second point is the latest dragged position
+        self.mouseMoveCoalescer.flush()
         # vtkRenderer object
         renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
         # vtkCamera object
@@ -164,7 +170,7 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         # The position of mouse in the display coordinate system
         eventPosition = list(self.GetInteractor().GetEventPosition()) # the position of mouse in display coordinate system 
         # vtkCellPicker object, it shoots a ray into the volume and returns the point where the ray intersects an isosurface of a chosen opacity
-        cellPicker = self.GetInteractor().GetPicker()
+        cellPicker = self.pipeline.picker or self.GetInteractor().GetPicker()
 
         self.checkNumberOfPoints += 1 # Add a point
         if self.checkNumberOfPoints == 1:
@@ -174,29 +180,23 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
             pickPosition = utils.getPickPosition(eventPosition, cellPicker, renderer, camera)
     
             # Marking the first point when having left button down event
-            self.pipeline.firstSphereActor.GetProperty().SetColor(1, 0, 0)
-            self.pipeline.firstSphereActor.SetPosition(pickPosition)
-
-            # vtkPoints represents 3D points used to save 2 points in world coordinates
-            points = vtk.vtkPoints()
-            # vtkCellArray object to represent cell connectivity
-            aline = vtk.vtkCellArray()
-            # Set objects into vtkPolyData object
-            self.pipeline.line.SetPoints(points)
-            self.pipeline.line.SetLines(aline)
-
-            # Insert the first point into vtkPoints object when having left button down
-            points.InsertNextPoint(pickPosition)
-            # Insert the second point into vtkPoints object
-            points.InsertNextPoint(0, 0, 0) # defauld
+            self.pipeline.firstSphere.SetColor(1, 0, 0)
+            self.pipeline.firstSphere.SetPosition(pickPosition)
+
+            # vtkPoints used to save 2 points in world coordinates
+            points = self.pipeline.line.GetPoints()
+            # The first point when having left button down, the second point follows the mouse (empty line until then)
+            points.SetPoint(0, pickPosition)
+            points.SetPoint(1, pickPosition)
+            points.Modified()
 
             self.pipeline.lineActor.VisibilityOn() # Turn on line actor object
             self.pipeline.textActor.VisibilityOn() # Turn on text actor object
         elif self.checkNumberOfPoints == 2:
             points = self.pipeline.line.GetPoints()
             pickPosition = points.GetPoint(1) # Return the second point
-            self.pipeline.secondSphereActor.GetProperty().SetColor(1, 0, 0) # Set red color for the second sphere
-            self.pipeline.secondSphereActor.SetPosition(pickPosition) # Set position for the second sphere
+            self.pipeline.secondSphere.SetColor(1, 0, 0) # Set red color for the second sphere
+            self.pipeline.secondSphere.SetPosition(pickPosition) # Set position for the second sphere
         # Override method of super class
         self.OnLeftButtonDown()
 
@@ -209,7 +209,14 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         # Override method of super class
         self.OnLeftButtonUp()
         if self.checkNumberOfPoints == 2:
+            self.mouseMoveCoalescer.cancel()
             self.pipeline.isDragging = False # Stop drawing
+            # From now on the text actor is placed by the label projector
+            renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+            anchor = utils.buildTextActorLengthMeasurement(self.pipeline.textActor, renderer, self.pipeline.line.GetPoints())
+            if self.pipeline.labelProjector is None:
+                self.pipeline.labelProjector = utils.LabelProjector(renderer)
+            self.pipeline.labelProjector.AddLabel(self.pipeline.textActor, anchor)
             # Set interactor style when stop drawing
             style = AfterLengthMeasurementInteractorStyle(self.pipeline)
             self.GetInteractor().SetInteractorStyle(style)
@@ -222,22 +229,7 @@ class LengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
 class AfterLengthMeasurementInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
     def __init__(self, pipeline: LengthMeasurementPipeline) -> None:
         self.pipeline = pipeline
-        self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.__mouseMoveEvent)
-    
-    """
-        Description:
-            A handle function used to update the position of text actor when having mouse move event.
-    """
-    def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
-        renderer = self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
-        points = self.pipeline.line.GetPoints()
-
-        # Method used to update the position of text actor
-        utils.buildTextActorLengthMeasurement(self.pipeline.textActor, renderer, points)
-
-        self.GetInteractor().Render()
-        # Override method of super class
-        self.OnMouseMove()
+        # The text actor follows the camera through pipeline.labelProjector, no mouse move handler
 
 """
     Description: calculate input data for transfer function.
@@ -329,7 +321,8 @@ def main():
     rgb_points = to_rgb_points(STANDARD)
     colors = vtk.vtkNamedColors()
     reader = vtk.vtkDICOMImageReader()
-    map = vtk.vtkSmartVolumeMapper()
+    # GPU mapper: the hover picker reads its depth image (picker.DepthBufferPicker)
+    map = vtk.vtkGPUVolumeRayCastMapper()
     vol = vtk.vtkVolume()
     volProperty = vtk.vtkVolumeProperty()
     render = vtk.vtkRenderer()
@@ -352,9 +345,6 @@ def main():
     reader.SetDirectoryName(path2)
     reader.Update()
     
-    # This option will use hardware accelerated rendering exclusively
-    # This is a good option if you know there is hardware acceleration
-    # map.SetRequestedRenderModeToGPU()
     map.SetInputData(reader.GetOutput())
 
     # volProperty.SetInterpolationTypeToLinear()
@@ -385,8 +375,7 @@ def main():
     # Add actors of pipeline
     render.AddActor(pipeline.lineActor)
     render.AddActor(pipeline.textActor)
-    render.AddActor(pipeline.firstSphereActor)
-    render.AddActor(pipeline.secondSphereActor)
+    render.AddActor(pipeline.endpoints.actor)
     
     renWin.SetWindowName("3D Dicom")
     renWin.SetSize(500, 500)
@@ -397,6 +386,9 @@ def main():
     cellPicker.AddPickList(vol)
     cellPicker.PickFromListOn()
     renIn.SetPicker(cellPicker)
+    pipeline.picker = picker.BlockVolumePicker(vol)
+    pipeline.hoverPicker = picker.DepthBufferPicker(vol, pipeline.picker)
+    pipeline.labelProjector = utils.LabelProjector(render)
     style = BeforeLengthMeasurementInteractorStyle(pipeline)
     renIn.SetInteractorStyle(style)
 
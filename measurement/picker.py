@@ -0,0 +1,337 @@
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+import numpy as np
+
+from typing import List, Optional, Tuple
+import math
+
+"""
+    Description:
+        Volume picker with empty space skipping, used instead of vtkCellPicker for the measurements.
+        1. the volume is split into blocks (blockSize³ voxels), the min/max scalar of each block is computed once
+           (blocks overlap by one voxel so that trilinear interpolation inside a block only uses its voxels).
+        2. a block is empty when the scalar opacity of its whole [min, max] range is below the opacity isovalue,
+           recomputed only when the scalar opacity function (preset) changes.
+        3. the ray of the pick is clipped to the volume, the blocks it crosses are listed in order and the empty
+           ones are skipped.
+        4. inside the first non-empty blocks the ray is sampled every half voxel with trilinear interpolation, the
+           first sample above the isovalue is refined by bisection.
+        Same interface as vtkCellPicker for utils.getPickPosition: Pick(x, y, z, renderer), GetPickPosition().
+"""
+class BlockVolumePicker():
+    def __init__(self, volume: vtk.vtkVolume, blockSize=8, opacityIsovalue=0.05) -> None:
+        self.volume = volume
+        self.blockSize = blockSize
+        self.opacityIsovalue = opacityIsovalue
+        self.pickPosition = (0.0, 0.0, 0.0)
+
+        self.imageData = None
+        self.imageMTime = -1
+        self.opacityMTime = -1
+        self.scalars = None # (z, y, x) view on the scalars of the volume
+        self.blockMin = None # (z, y, x) blocks
+        self.blockMax = None
+        self.blockOccupied = None
+        self.opacityTable = None
+        self.opacityRange = None
+        self.opacityValues = None
+        self.matrixMTime = -1
+        self.indexToWorld = None
+        self.worldToIndex = None
+
+    def SetVolumeOpacityIsovalue(self, opacityIsovalue: float) -> None:
+        self.opacityIsovalue = opacityIsovalue
+        self.opacityMTime = -1
+
+    def GetPickPosition(self) -> Tuple[float]:
+        return self.pickPosition
+
+    """
+        Description: min and max of every block along one axis, the blocks overlap by one voxel.
+    """
+    def __reduceBlocks(self, array: np.ndarray, axis: int, function: np.ufunc) -> np.ndarray:
+        size = self.blockSize
+        array = np.moveaxis(array, axis, 0)
+        numberOfBlocks = max(1, math.ceil((array.shape[0] - 1) / size))
+        result = np.empty((numberOfBlocks,) + array.shape[1:], dtype=array.dtype)
+        for block in range(numberOfBlocks):
+            result[block] = function.reduce(array[block * size:(block + 1) * size + 1], axis=0)
+        return np.moveaxis(result, 0, axis)
+
+    """
+        Description: rebuild the block grid when the volume changed and the empty blocks when the preset changed.
+    """
+    def __update(self) -> None:
+        imageData = self.volume.GetMapper().GetInput()
+        imageMTime = max(imageData.GetMTime(), imageData.GetPointData().GetScalars().GetMTime())
+        if imageData is not self.imageData or imageMTime != self.imageMTime:
+            self.imageData = imageData
+            self.imageMTime = imageMTime
+            dimensions = imageData.GetDimensions()
+            self.scalars = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+            self.blockMin = self.scalars
+            self.blockMax = self.scalars
+            for axis in range(3):
+                self.blockMin = self.__reduceBlocks(self.blockMin, axis, np.minimum)
+                self.blockMax = self.__reduceBlocks(self.blockMax, axis, np.maximum)
+            self.opacityMTime = -1
+
+        opacityFunction = self.volume.GetProperty().GetScalarOpacity()
+        if opacityFunction.GetMTime() != self.opacityMTime:
+            self.opacityMTime = opacityFunction.GetMTime()
+            scalarRange = (float(self.blockMin.min()), float(self.blockMax.max()))
+            # One entry per integer value for integer volumes
+            numberOfValues = int(min(max(scalarRange[1] - scalarRange[0] + 1, 2), 65536))
+            table = np.empty(numberOfValues)
+            opacityFunction.GetTable(scalarRange[0], scalarRange[1], numberOfValues, table)
+            self.opacityTable = table
+            self.opacityRange = scalarRange
+            self.opacityValues = np.linspace(scalarRange[0], scalarRange[1], numberOfValues)
+
+            # A block is occupied if an opacity >= isovalue exists in its [min, max] range
+            aboveCount = np.concatenate([[0], np.cumsum(table >= self.opacityIsovalue)])
+            low = self.__tableIndices(self.blockMin, np.floor)
+            high = self.__tableIndices(self.blockMax, np.ceil)
+            self.blockOccupied = aboveCount[high + 1] > aboveCount[low]
+
+        matrixMTime = max(self.volume.GetMTime(), self.imageMTime)
+        if matrixMTime != self.matrixMTime:
+            self.matrixMTime = matrixMTime
+            self.indexToWorld = self.__getIndexToWorldMatrix()
+            self.worldToIndex = np.linalg.inv(self.indexToWorld)
+
+    def __tableIndices(self, values: np.ndarray, rounding) -> np.ndarray:
+        low, high = self.opacityRange
+        scale = (len(self.opacityTable) - 1) / (high - low) if high > low else 0.0
+        return np.clip(rounding((values - low) * scale), 0, len(self.opacityTable) - 1).astype(np.int64)
+
+    def __opacity(self, values: np.ndarray) -> np.ndarray:
+        return np.interp(values, self.opacityValues, self.opacityTable)
+
+    """
+        Description: trilinear interpolation of the scalars at (N, 3) ijk points inside the volume.
+    """
+    def __interpolate(self, ijk: np.ndarray) -> np.ndarray:
+        nz, ny, nx = self.scalars.shape
+        base = np.floor(ijk).astype(np.int64)
+        base = np.minimum(np.maximum(base, 0), [max(nx - 2, 0), max(ny - 2, 0), max(nz - 2, 0)])
+        fraction = ijk - base
+        i0, j0, k0 = base[:, 0], base[:, 1], base[:, 2]
+        i1, j1, k1 = np.minimum(i0 + 1, nx - 1), np.minimum(j0 + 1, ny - 1), np.minimum(k0 + 1, nz - 1)
+        fx, fy, fz = fraction[:, 0], fraction[:, 1], fraction[:, 2]
+        s = self.scalars
+        c00 = s[k0, j0, i0] * (1 - fx) + s[k0, j0, i1] * fx
+        c01 = s[k0, j1, i0] * (1 - fx) + s[k0, j1, i1] * fx
+        c10 = s[k1, j0, i0] * (1 - fx) + s[k1, j0, i1] * fx
+        c11 = s[k1, j1, i0] * (1 - fx) + s[k1, j1, i1] * fx
+        return (c00 * (1 - fy) + c01 * fy) * (1 - fz) + (c10 * (1 - fy) + c11 * fy) * fz
+
+    """
+        Description: matrix from ijk to world coordinates (image geometry and the matrix of the volume).
+    """
+    def __getIndexToWorldMatrix(self) -> np.ndarray:
+        imageData = self.imageData
+        direction = np.array([imageData.GetDirectionMatrix().GetElement(row, column) for row in range(3) for column in range(3)]).reshape(3, 3)
+        indexToPhysical = np.eye(4)
+        indexToPhysical[:3, :3] = direction * np.array(imageData.GetSpacing())
+        indexToPhysical[:3, 3] = imageData.GetOrigin()
+        propMatrix = self.volume.GetMatrix()
+        propToWorld = np.array([propMatrix.GetElement(row, column) for row in range(4) for column in range(4)]).reshape(4, 4)
+        return propToWorld @ indexToPhysical
+
+    """
+        Description: ray (in ijk coordinates) through a display position, from the near to the far clipping plane.
+    """
+    def __getRay(self, x: float, y: float, renderer: vtk.vtkRenderer, worldToIndex: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        points = []
+        for z in (0.0, 1.0):
+            renderer.SetDisplayPoint(x, y, z)
+            renderer.DisplayToWorld()
+            worldPoint = renderer.GetWorldPoint()
+            w = worldPoint[3] if worldPoint[3] else 1.0
+            points.append(worldToIndex @ np.array([worldPoint[0] / w, worldPoint[1] / w, worldPoint[2] / w, 1.0]))
+        start = points[0][:3]
+        return start, points[1][:3] - start
+
+    """
+        Description: entry and exit of the ray in the box [0, dimension - 1] (slab method).
+        Return: None if the ray misses the volume
+    """
+    def __clipRay(self, start: np.ndarray, direction: np.ndarray) -> Optional[Tuple[float, float]]:
+        upper = np.array(self.scalars.shape[::-1], dtype=float) - 1
+        tEnter, tExit = 0.0, 1.0
+        for axis in range(3):
+            if abs(direction[axis]) < 1e-12:
+                if start[axis] < 0 or start[axis] > upper[axis]:
+                    return None
+                continue
+            t0 = (0 - start[axis]) / direction[axis]
+            t1 = (upper[axis] - start[axis]) / direction[axis]
+            tEnter = max(tEnter, min(t0, t1))
+            tExit = min(tExit, max(t0, t1))
+        if tEnter > tExit:
+            return None
+        return tEnter, tExit
+
+    """
+        Description: blocks crossed by the ray between tEnter and tExit, in order.
+        Return: (t at the entry of each block, t at its exit, block indices (N, 3) in i, j, k)
+    """
+    def __traverseBlocks(self, start: np.ndarray, direction: np.ndarray, tEnter: float, tExit: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        size = self.blockSize
+        crossings = [np.array([tEnter, tExit])]
+        for axis in range(3):
+            if abs(direction[axis]) < 1e-12:
+                continue
+            a, b = sorted([start[axis] + tEnter * direction[axis], start[axis] + tExit * direction[axis]])
+            planes = np.arange(math.floor(a / size) + 1, math.floor(b / size) + 1) * size
+            crossings.append((planes - start[axis]) / direction[axis])
+        t = np.unique(np.concatenate(crossings))
+        t = t[(t >= tEnter) & (t <= tExit)]
+        if len(t) < 2:
+            t = np.array([tEnter, tExit])
+        middle = (t[:-1] + t[1:]) / 2
+        gridShape = np.array(self.blockOccupied.shape[::-1])
+        blocks = np.clip(np.floor((start + middle[:, np.newaxis] * direction) / size).astype(np.int64), 0, gridShape - 1)
+        return t[:-1], t[1:], blocks
+
+    """
+        Description: shoot a ray through the display position (x, y), z is ignored (same signature as vtkCellPicker).
+        Return: 1 if an opaque point was found, its position is returned by GetPickPosition, else 0
+    """
+    def Pick(self, x: float, y: float, z: float, renderer: vtk.vtkRenderer) -> int:
+        self.__update()
+        start, direction = self.__getRay(x, y, renderer, self.worldToIndex)
+        clipped = self.__clipRay(start, direction)
+        if clipped is None:
+            return 0
+
+        blockStarts, blockEnds, blocks = self.__traverseBlocks(start, direction, *clipped)
+        occupied = np.flatnonzero(self.blockOccupied[blocks[:, 2], blocks[:, 1], blocks[:, 0]])
+        # Half a voxel between samples
+        step = 0.5 / max(np.linalg.norm(direction), 1e-12)
+        for index in occupied:
+            t = np.arange(blockStarts[index], blockEnds[index] + step, step)
+            t[-1] = min(t[-1], blockEnds[index])
+            opacity = self.__opacity(self.__interpolate(start + t[:, np.newaxis] * direction))
+            above = np.flatnonzero(opacity >= self.opacityIsovalue)
+            if len(above) == 0:
+                continue
+            hit = t[above[0]]
+            if above[0] > 0:
+                # Bisection between the last sample below the isovalue and the first one above
+                low, high = t[above[0] - 1], hit
+                for _ in range(6):
+                    middle = (low + high) / 2
+                    if self.__opacity(self.__interpolate((start + middle * direction)[np.newaxis]))[0] >= self.opacityIsovalue:
+                        high = middle
+                    else:
+                        low = middle
+                hit = high
+            ijk = start + hit * direction
+            self.pickPosition = tuple(float(value) for value in (self.indexToWorld @ np.append(ijk, 1.0))[:3])
+            return 1
+        return 0
+
+"""
+    Description:
+        Picker for the hover markers: one depth buffer lookup and one display to world transform per pick.
+        The volume mappers do not write the z-buffer of the render window, the depth buffer of the volume is read
+        from its own vtkGPUVolumeRayCastMapper (RenderToImage, depth image): the render window is rendered once
+        with only the volume visible and without swapping the buffers, the displayed frame does not change and the
+        volume texture is shared with the normal rendering. It is rendered again only when the camera, the volume
+        or the size changed. While the camera is moving (the pose changed since the previous pick) the buffer is
+        stale and the pick is done by fallbackPicker, the buffer is rendered once the pose is the same for two picks.
+        Other mappers (no depth image) always use fallbackPicker.
+        Clicks (committed points) must use fallbackPicker, the depth buffer is only accurate to about a pixel.
+"""
+class DepthBufferPicker():
+    def __init__(self, volume: vtk.vtkVolume, fallbackPicker) -> None:
+        self.volume = volume
+        self.fallbackPicker = fallbackPicker
+        self.pickPosition = (0.0, 0.0, 0.0)
+        self.depthImage = vtk.vtkImageData()
+
+        self.depth = None # (height, width) normalized depth of the renderer viewport
+        self.depthKey = None
+        self.lastKey = None
+
+    def GetPickPosition(self) -> Tuple[float]:
+        return self.pickPosition
+
+    def IsSupported(self) -> bool:
+        return hasattr(self.volume.GetMapper(), "GetDepthImage")
+
+    """
+        Description: camera pose, volume and viewport size the depth buffer depends on.
+    """
+    def __getKey(self, renderer: vtk.vtkRenderer) -> tuple:
+        imageData = self.volume.GetMapper().GetInput()
+        return (renderer.GetActiveCamera().GetMTime(), self.volume.GetMTime(), imageData.GetMTime(), imageData.GetPointData().GetScalars().GetMTime(), renderer.GetSize())
+
+    def __renderDepth(self, renderer: vtk.vtkRenderer) -> None:
+        mapper = self.volume.GetMapper()
+        renderWindow = renderer.GetRenderWindow()
+        # The markers and measurements must not hide the volume (the rays stop at the opaque geometry)
+        hiddenProps = []
+        props = renderer.GetViewProps()
+        props.InitTraversal()
+        for _ in range(props.GetNumberOfItems()):
+            prop = props.GetNextProp()
+            if prop is not self.volume and prop.GetVisibility():
+                prop.VisibilityOff()
+                hiddenProps.append(prop)
+        swapBuffers = renderWindow.GetSwapBuffers()
+        mapper.RenderToImageOn()
+        renderWindow.SwapBuffersOff()
+        try:
+            renderWindow.Render()
+            mapper.GetDepthImage(self.depthImage)
+        finally:
+            mapper.RenderToImageOff()
+            renderWindow.SetSwapBuffers(swapBuffers)
+            for prop in hiddenProps:
+                prop.VisibilityOn()
+
+        width, height = renderer.GetSize()
+        depthWidth, depthHeight, _ = self.depthImage.GetDimensions()
+        if (depthWidth, depthHeight) != (width, height):
+            self.depth = None
+            return
+        self.depth = vtk_to_numpy(self.depthImage.GetPointData().GetScalars()).reshape(depthHeight, depthWidth)
+
+    def __fallbackPick(self, x: float, y: float, z: float, renderer: vtk.vtkRenderer) -> int:
+        check = self.fallbackPicker.Pick(x, y, z, renderer)
+        if check:
+            self.pickPosition = tuple(self.fallbackPicker.GetPickPosition())
+        return check
+
+    """
+        Description: same signature as vtkCellPicker.Pick, z is ignored.
+        Return: 1 if the volume is under the display position (x, y), its position is returned by GetPickPosition, else 0
+    """
+    def Pick(self, x: float, y: float, z: float, renderer: vtk.vtkRenderer) -> int:
+        key = self.__getKey(renderer)
+        if key != self.depthKey:
+            if key != self.lastKey or not self.IsSupported():
+                self.lastKey = key
+                return self.__fallbackPick(x, y, z, renderer)
+            self.__renderDepth(renderer)
+            self.depthKey = key
+        if self.depth is None:
+            return self.__fallbackPick(x, y, z, renderer)
+
+        originX, originY = renderer.GetOrigin()
+        column, row = int(round(x)) - originX, int(round(y)) - originY
+        if row < 0 or row >= self.depth.shape[0] or column < 0 or column >= self.depth.shape[1]:
+            return 0
+        depth = float(self.depth[row, column])
+        if depth >= 1.0:
+            return 0
+        renderer.SetDisplayPoint(x, y, depth)
+        renderer.DisplayToWorld()
+        worldPoint = renderer.GetWorldPoint()
+        w = worldPoint[3] if worldPoint[3] else 1.0
+        self.pickPosition = (worldPoint[0] / w, worldPoint[1] / w, worldPoint[2] / w)
+        return 1
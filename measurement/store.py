@@ -0,0 +1,452 @@
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+import numpy as np
+import utils
+import transforms
+import picker
+import lengthMeasurement
+
+from typing import Dict, List, Optional, Tuple
+import math
+import sys
+
+LENGTH = 0
+ANGLE = 1
+NUMBER_OF_POINTS = (2, 3) # number of points of each measurement type
+ARC_RESOLUTION = 30
+
+"""
+    Description:
+        Store of many length and angle measurements in numpy arrays (struct of arrays), drawn by four shared actors:
+        1. lineActor: the segments of all measurements (lines rendered as tubes).
+        2. arcActor: the arcs of the angles, same property as lineActor.
+        3. handleActor: one sphere per point, vtkGlyph3DMapper.
+        4. labelActor: the length or the angle of each measurement, vtkLabeledDataMapper.
+        The mappers read the polydata wrapping the numpy arrays directly, a drag copies no points.
+        Each measurement has 3 point slots (a length uses the first 2), the VTK points wrap the numpy arrays
+        so moving a point only updates the arrays in place, the cells are rebuilt when a measurement is added or removed.
+        Handles are found with a screen-space grid (cells of hitRadius pixels) rebuilt when the camera changed,
+        the grid cell of a dragged handle is updated in place.
+"""
+class MeasurementStore():
+    def __init__(self, capacity=64, handleRadius=5, hitRadius=8) -> None:
+        colors = vtk.vtkNamedColors()
+        self.count = 0
+        self.hitRadius = hitRadius
+        self.version = 0 # incremented when a measurement is added or removed
+        self.__allocate(capacity)
+
+        # Segments and arcs, two polydata with their own points: one mapper each
+        self.lines = vtk.vtkPolyData()
+        self.lineMapper = vtk.vtkPolyDataMapper()
+        self.lineMapper.SetInputData(self.lines)
+        self.lineActor = vtk.vtkActor()
+        self.lineActor.SetMapper(self.lineMapper)
+        self.lineActor.GetProperty().SetColor(colors.GetColor3d("Tomato"))
+        self.lineActor.GetProperty().SetLineWidth(3)
+        self.lineActor.GetProperty().RenderLinesAsTubesOn()
+        self.lineActor.PickableOff()
+        self.arcs = vtk.vtkPolyData()
+        self.arcMapper = vtk.vtkPolyDataMapper()
+        self.arcMapper.SetInputData(self.arcs)
+        self.arcActor = vtk.vtkActor()
+        self.arcActor.SetMapper(self.arcMapper)
+        self.arcActor.SetProperty(self.lineActor.GetProperty())
+        self.arcActor.PickableOff()
+
+        # Handles, the unused slots have a zero scale
+        self.handles = vtk.vtkPolyData()
+        sphere = vtk.vtkSphereSource()
+        sphere.SetRadius(handleRadius)
+        self.handleMapper = vtk.vtkGlyph3DMapper()
+        self.handleMapper.SetInputData(self.handles)
+        self.handleMapper.SetSourceConnection(sphere.GetOutputPort())
+        self.handleMapper.OrientOff()
+        self.handleMapper.ScalingOn()
+        self.handleMapper.SetScaleModeToScaleByMagnitude()
+        self.handleMapper.SetScaleArray("Scales")
+        self.handleMapper.ScalarVisibilityOff()
+        self.handleActor = vtk.vtkActor()
+        self.handleActor.SetMapper(self.handleMapper)
+        self.handleActor.GetProperty().SetColor(1, 0, 0)
+        self.handleActor.PickableOff()
+
+        # Labels
+        self.labelPoints = vtk.vtkPolyData()
+        self.labelMapper = vtk.vtkLabeledDataMapper()
+        self.labelMapper.SetInputData(self.labelPoints)
+        self.labelMapper.SetLabelModeToLabelFieldData()
+        self.labelMapper.SetFieldDataName("Labels")
+        textProperty = self.labelMapper.GetLabelTextProperty()
+        textProperty.SetColor(colors.GetColor3d("Tomato"))
+        textProperty.SetFontSize(15)
+        textProperty.ShadowOn()
+        textProperty.BoldOn()
+        self.labelActor = vtk.vtkActor2D()
+        self.labelActor.SetMapper(self.labelMapper)
+
+        # Screen-space grid of the handles
+        self.gridKey = None
+        self.grid: Dict[Tuple[int, int], List[int]] = {}
+        self.gridCells = None # grid cell of each handle
+        self.transforms = None # transforms.RendererTransforms of the renderer of the grid
+        self.__rebuildTopology()
+
+    def __allocate(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.points = np.zeros((capacity, 3, 3))
+        self.types = np.zeros(capacity, dtype=np.int8)
+        self.values = np.zeros(capacity)
+        self.labels = np.empty(capacity, dtype=object)
+        self.labelPositions = np.zeros((capacity, 3))
+        self.arcPoints = np.zeros((capacity, ARC_RESOLUTION + 1, 3))
+        self.handleScales = np.zeros(capacity * 3, dtype=np.float32)
+
+    def __grow(self) -> None:
+        count = self.count
+        old = (self.points, self.types, self.values, self.labels, self.labelPositions, self.arcPoints, self.handleScales)
+        self.__allocate(self.capacity * 2)
+        for new, array in zip((self.points, self.types, self.values, self.labels, self.labelPositions, self.arcPoints), old):
+            new[:count] = array[:count]
+        self.handleScales[:count * 3] = old[-1][:count * 3]
+
+    """
+        Description: build the cells of the lines and the arcs and wrap the numpy arrays, when the number of measurements changed.
+    """
+    def __rebuildTopology(self) -> None:
+        count = self.count
+        types = self.types[:count]
+
+        # Keep references to the numpy arrays wrapped by VTK
+        self.vtkPoints = vtk.vtkPoints()
+        self.vtkPoints.SetData(numpy_to_vtk(self.points.reshape(-1, 3)))
+        self.vtkArcPoints = vtk.vtkPoints()
+        self.vtkArcPoints.SetData(numpy_to_vtk(self.arcPoints.reshape(-1, 3)))
+
+        # Segments: (0, 1) for all measurements and (1, 2) for the angles
+        first = np.arange(count, dtype=np.int64) * 3
+        angles = first[types == ANGLE]
+        segments = np.concatenate([np.stack([first, first + 1], axis=1), np.stack([angles + 1, angles + 2], axis=1)])
+        self.lines.SetPoints(self.vtkPoints)
+        self.lines.SetLines(self.__createCellArray(segments))
+
+        # Arcs: one polyline per angle
+        arcIds = np.flatnonzero(types == ANGLE)[:, np.newaxis] * (ARC_RESOLUTION + 1) + np.arange(ARC_RESOLUTION + 1)
+        self.arcs.SetPoints(self.vtkArcPoints)
+        self.arcs.SetLines(self.__createCellArray(arcIds))
+
+        self.handles.SetPoints(self.vtkPoints)
+        scales = numpy_to_vtk(self.handleScales)
+        scales.SetName("Scales")
+        self.handles.GetPointData().AddArray(scales)
+
+        self.labelPoints.SetPoints(vtk.vtkPoints())
+        self.labelPoints.GetPoints().SetData(numpy_to_vtk(self.labelPositions[:count]))
+        labelArray = vtk.vtkStringArray()
+        labelArray.SetName("Labels")
+        labelArray.SetNumberOfValues(count)
+        for index in range(count):
+            labelArray.SetValue(index, self.labels[index])
+        self.labelPoints.GetPointData().AddArray(labelArray)
+        self.labelArray = labelArray
+
+        self.version += 1
+
+    def __createCellArray(self, cells: np.ndarray) -> vtk.vtkCellArray:
+        cellArray = vtk.vtkCellArray()
+        numberOfCells, cellSize = cells.shape[0], cells.shape[1] if cells.ndim == 2 else 0
+        offsets = np.arange(numberOfCells + 1, dtype=np.int64) * cellSize
+        cellArray.SetData(numpy_to_vtk(offsets, deep=True, array_type=vtk.VTK_ID_TYPE), numpy_to_vtk(cells.ravel().astype(np.int64), deep=True, array_type=vtk.VTK_ID_TYPE))
+        return cellArray
+
+    """
+        Description: value, label, label position and arc of one measurement.
+    """
+    def __updateMeasurement(self, index: int) -> None:
+        points = self.points[index]
+        if self.types[index] == LENGTH:
+            distance = float(np.linalg.norm(points[1] - points[0]))
+            self.values[index] = distance
+            self.labels[index] = f"{round(distance, 1)}mm"
+            self.labelPositions[index] = (points[0] + points[1]) / 2
+            return
+
+        vector1, vector2 = points[0] - points[1], points[2] - points[1]
+        length1, length2 = np.linalg.norm(vector1), np.linalg.norm(vector2)
+        if length1 < 1e-3 or length2 < 1e-3:
+            self.values[index] = 0.0
+            self.labels[index] = f"{0.0}deg"
+            self.labelPositions[index] = points[1]
+            self.arcPoints[index] = points[1]
+            return
+        vector1, vector2 = vector1 / length1, vector2 / length2
+        angle = math.degrees(math.acos(float(np.clip(np.dot(vector1, vector2), -1.0, 1.0))))
+        self.values[index] = angle
+        self.labels[index] = f"{round(angle, 1)}deg"
+
+        # Arc at half and label at 0.7 of the shortest side, like utils.buildArcAngleMeasurement
+        length = min(length1, length2)
+        t = np.linspace(0, 1, ARC_RESOLUTION + 1)[:, np.newaxis]
+        directions = (1 - t) * vector1 + t * vector2
+        norms = np.linalg.norm(directions, axis=1, keepdims=True)
+        directions = np.where(norms > 1e-6, directions / np.maximum(norms, 1e-6), vector1)
+        self.arcPoints[index] = points[1] + 0.5 * length * directions
+        self.labelPositions[index] = points[1] + 0.7 * length * directions[ARC_RESOLUTION // 2]
+
+    def __modified(self, index: int) -> None:
+        self.vtkPoints.Modified()
+        self.lines.Modified()
+        self.handles.Modified()
+        if self.types[index] == ANGLE:
+            self.vtkArcPoints.Modified()
+            self.arcs.Modified()
+        self.labelArray.SetValue(index, self.labels[index])
+        self.labelPoints.GetPoints().Modified()
+        self.labelPoints.Modified()
+
+    def AddToRenderer(self, renderer: vtk.vtkRenderer) -> None:
+        renderer.AddActor(self.lineActor)
+        renderer.AddActor(self.arcActor)
+        renderer.AddActor(self.handleActor)
+        renderer.AddActor(self.labelActor)
+
+    def GetNumberOfMeasurements(self) -> int:
+        return self.count
+
+    """
+        Description: add a measurement, the missing points are set to the last given point.
+        Return: index of the measurement
+    """
+    def AddMeasurement(self, measurementType: int, points: List[List[float]]) -> int:
+        if self.count == self.capacity:
+            self.__grow()
+        index = self.count
+        numberOfPoints = NUMBER_OF_POINTS[measurementType]
+        self.types[index] = measurementType
+        for pointId in range(3):
+            self.points[index, pointId] = points[min(pointId, len(points) - 1)]
+        self.handleScales[index * 3:index * 3 + 3] = [1.0 if pointId < numberOfPoints else 0.0 for pointId in range(3)]
+        self.count += 1
+        self.__updateMeasurement(index)
+        self.__rebuildTopology()
+        return index
+
+    """
+        Description: remove a measurement, the last measurement takes its index.
+    """
+    def RemoveMeasurement(self, index: int) -> None:
+        last = self.count - 1
+        for array in (self.points, self.types, self.values, self.labels, self.labelPositions, self.arcPoints):
+            array[index] = array[last]
+        self.handleScales[index * 3:index * 3 + 3] = self.handleScales[last * 3:last * 3 + 3]
+        self.handleScales[last * 3:last * 3 + 3] = 0.0
+        self.count -= 1
+        self.__rebuildTopology()
+
+    def GetPoint(self, index: int, pointId: int) -> Tuple[float]:
+        return tuple(float(value) for value in self.points[index, pointId])
+
+    def GetType(self, index: int) -> int:
+        return int(self.types[index])
+
+    def GetValue(self, index: int) -> float:
+        return float(self.values[index])
+
+    def GetLabel(self, index: int) -> str:
+        return self.labels[index]
+
+    """
+        Description: move one point in place, the next points of a measurement being placed can follow it (follow=True).
+    """
+    def SetPoint(self, index: int, pointId: int, position: List[float], follow=False) -> None:
+        lastPointId = NUMBER_OF_POINTS[self.types[index]] - 1 if follow else pointId
+        for movedId in range(pointId, lastPointId + 1):
+            self.points[index, movedId] = position
+            self.__moveHandleInGrid(index * 3 + movedId)
+        self.__updateMeasurement(index)
+        self.__modified(index)
+
+    def __getGridCells(self, worldPoints: np.ndarray) -> np.ndarray:
+        return np.floor(self.transforms.WorldToDisplay(worldPoints)[:, :2] / self.hitRadius).astype(np.int64)
+
+    """
+        Description: rebuild the grid when the camera, the viewport or the measurements changed.
+    """
+    def __updateGrid(self, renderer: vtk.vtkRenderer) -> None:
+        if self.transforms is None or self.transforms.renderer is not renderer:
+            self.transforms = transforms.RendererTransforms(renderer)
+        self.transforms.Update()
+        key = (self.transforms.key, self.version)
+        if key == self.gridKey:
+            return
+        self.gridKey = key
+        self.gridCells = self.__getGridCells(self.points[:self.count].reshape(-1, 3))
+        self.grid = {}
+        for handleId in np.flatnonzero(self.handleScales[:self.count * 3]):
+            self.grid.setdefault(tuple(self.gridCells[handleId]), []).append(int(handleId))
+
+    def __moveHandleInGrid(self, handleId: int) -> None:
+        if self.gridKey is None or self.gridKey[1] != self.version or handleId >= len(self.gridCells):
+            return
+        oldCell = tuple(self.gridCells[handleId])
+        newCell = self.__getGridCells(self.points.reshape(-1, 3)[handleId:handleId + 1])[0]
+        if tuple(newCell) == oldCell or not self.handleScales[handleId]:
+            return
+        self.grid[oldCell].remove(handleId)
+        if not self.grid[oldCell]:
+            del self.grid[oldCell]
+        self.grid.setdefault(tuple(newCell), []).append(handleId)
+        self.gridCells[handleId] = newCell
+
+    """
+        Description: handle under a display position, the 3x3 grid cells around it are checked.
+        Return: (index of the measurement, point id) of the nearest handle within hitRadius pixels, None if no handle
+    """
+    def FindHandle(self, displayPosition: List[int], renderer: vtk.vtkRenderer) -> Optional[Tuple[int, int]]:
+        self.__updateGrid(renderer)
+        cellX, cellY = int(displayPosition[0] // self.hitRadius), int(displayPosition[1] // self.hitRadius)
+        candidates = [handleId for dx in (-1, 0, 1) for dy in (-1, 0, 1) for handleId in self.grid.get((cellX + dx, cellY + dy), ())]
+        if not candidates:
+            return None
+        display = self.transforms.WorldToDisplay(self.points.reshape(-1, 3)[candidates])[:, :2]
+        distances = np.linalg.norm(display - np.asarray(displayPosition[:2], dtype=float), axis=1)
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > self.hitRadius:
+            return None
+        return divmod(candidates[nearest], 3)
+
+"""
+    Description:
+        MeasurementStoreInteractorStyle class extends vtkInteractorStyleTrackballCamera class.
+        One style for all the measurements of a MeasurementStore (not re-created per click):
+        1. left button on a handle: drag the handle.
+        2. otherwise in LENGTH or ANGLE mode: each click places a point of a new measurement, the next point follows the mouse.
+        3. otherwise: rotate, pan,... the camera.
+        Keys: "l" LENGTH mode, "a" ANGLE mode, "Escape" no mode, "Delete" removes the measurement of the handle under the mouse.
+"""
+class MeasurementStoreInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
+    def __init__(self, store: MeasurementStore, picker) -> None:
+        self.store = store
+        self.picker = picker # vtkCellPicker or picker.BlockVolumePicker
+        self.mode = None # None, LENGTH or ANGLE
+        self.dragging = None # (index, point id) of the dragged handle
+        self.placing = None # (index, point id) of the point following the mouse
+        self.AddObserver(vtk.vtkCommand.LeftButtonPressEvent, self.__leftButtonPressEvent)
+        self.AddObserver(vtk.vtkCommand.MouseMoveEvent, self.__mouseMoveEvent)
+        self.AddObserver(vtk.vtkCommand.LeftButtonReleaseEvent, self.__leftButtonReleaseEvent)
+        self.AddObserver(vtk.vtkCommand.KeyPressEvent, self.__keyPressEvent)
+        # Mouse moves are handled at most once per frame
+        self.mouseMoveCoalescer = utils.MouseMoveCoalescer(self, self.__updateMousePosition)
+
+    def SetMode(self, mode: Optional[int]) -> None:
+        self.mode = mode
+
+    def __keyPressEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        keySym = self.GetInteractor().GetKeySym()
+        if keySym in ("l", "a", "Escape"):
+            self.SetMode({"l": LENGTH, "a": ANGLE, "Escape": None}[keySym])
+            return
+        if keySym == "Delete" and self.dragging is None and self.placing is None:
+            handle = self.store.FindHandle(self.GetInteractor().GetEventPosition(), self.__getRenderer())
+            if handle is not None:
+                self.store.RemoveMeasurement(handle[0])
+                self.GetInteractor().Render()
+
+    def __getRenderer(self) -> vtk.vtkRenderer:
+        return self.GetInteractor().GetRenderWindow().GetRenderers().GetFirstRenderer()
+
+    """
+        Description: point on the volume under the mouse, out of the volume the point keeps the depth of reference.
+    """
+    def __pick(self, eventPosition: List[int], renderer: vtk.vtkRenderer, reference: List[float]) -> List[float]:
+        if self.picker.Pick(eventPosition[0], eventPosition[1], 0, renderer):
+            return list(self.picker.GetPickPosition())
+        return utils.convertFromDisplayCoords2WorldCoords(list(eventPosition), list(reference), renderer)
+
+    def __leftButtonPressEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        self.mouseMoveCoalescer.flush()
+        renderer = self.__getRenderer()
+        eventPosition = self.GetInteractor().GetEventPosition()
+
+        if self.placing is not None:
+            # Fix the point following the mouse, the next one follows the mouse until the last point
+            index, pointId = self.placing
+            self.placing = (index, pointId + 1) if pointId + 1 < NUMBER_OF_POINTS[self.store.GetType(index)] else None
+            return
+
+        handle = self.store.FindHandle(eventPosition, renderer)
+        if handle is not None:
+            self.dragging = handle
+            return
+
+        if self.mode is not None:
+            position = self.__pick(eventPosition, renderer, renderer.GetActiveCamera().GetFocalPoint())
+            index = self.store.AddMeasurement(self.mode, [position])
+            self.placing = (index, 1)
+            self.GetInteractor().Render()
+            return
+        # Override method of super class
+        self.OnLeftButtonDown()
+
+    def __mouseMoveEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        if self.dragging is None and self.placing is None:
+            # Override method of super class
+            self.OnMouseMove()
+            return
+        self.mouseMoveCoalescer.push(self.GetInteractor().GetEventPosition())
+
+    def __updateMousePosition(self, eventPosition: List[int]) -> None:
+        moving = self.dragging or self.placing
+        if moving is None:
+            return
+        index, pointId = moving
+        renderer = self.__getRenderer()
+        position = self.__pick(eventPosition, renderer, self.store.GetPoint(index, pointId))
+        self.store.SetPoint(index, pointId, position, follow=self.placing is not None)
+        self.GetInteractor().Render()
+
+    def __leftButtonReleaseEvent(self, obj: vtk.vtkInteractorStyleTrackballCamera, event: str) -> None:
+        if self.dragging is not None:
+            self.mouseMoveCoalescer.flush()
+            self.dragging = None
+            return
+        # Override method of super class
+        self.OnLeftButtonUp()
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "../dicomdata/Ankle"
+
+    colors = vtk.vtkNamedColors()
+    reader = vtk.vtkDICOMImageReader()
+    reader.SetDirectoryName(path)
+    reader.Update()
+
+    map = vtk.vtkGPUVolumeRayCastMapper()
+    map.SetInputData(reader.GetOutput())
+    volProperty = vtk.vtkVolumeProperty()
+    lengthMeasurement.set_volume_properties(volProperty)
+    vol = vtk.vtkVolume()
+    vol.SetMapper(map)
+    vol.SetProperty(volProperty)
+
+    render = vtk.vtkRenderer()
+    render.SetBackground(colors.GetColor3d("White"))
+    render.AddVolume(vol)
+    store = MeasurementStore()
+    store.AddToRenderer(render)
+
+    renWin = vtk.vtkRenderWindow()
+    renWin.SetWindowName("3D Dicom - measurements (l: length, a: angle, Escape: camera, Delete: remove)")
+    renWin.SetSize(500, 500)
+    renWin.AddRenderer(render)
+
+    renIn = vtk.vtkRenderWindowInteractor()
+    renIn.SetRenderWindow(renWin)
+    style = MeasurementStoreInteractorStyle(store, picker.BlockVolumePicker(vol))
+    renIn.SetInteractorStyle(style)
+
+    renIn.Initialize()
+    renIn.Start()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import vtk
+import numpy as np
+
+from typing import List, Union
+import weakref
+
+"""
+    Description:
+        Vectorized coordinate transforms of a renderer, same results as SetWorldPoint/WorldToDisplay and
+        SetDisplayPoint/DisplayToWorld of vtkRenderer but for (N, 3) arrays of points.
+        Coordinate systems:
+            world: the scene
+            view: normalized device coordinates, x and y in [-1, 1], z in [0, 1] (depth)
+            display: pixels of the render window, z is the depth (same as the z-buffer)
+        The matrices and their inverses are cached and recomputed only when the camera or the viewport changed.
+"""
+class RendererTransforms():
+    def __init__(self, renderer: vtk.vtkRenderer) -> None:
+        self.renderer = renderer
+        self.key = None
+        self.worldToView = None
+        self.viewToWorld = None
+        self.viewToDisplay = None
+        self.displayToView = None
+        self.worldToDisplay = None
+        self.displayToWorld = None
+
+    """
+        Description: recompute the matrices if the camera (or its MTime) or the viewport changed.
+        Return: True if the matrices were recomputed
+    """
+    def Update(self) -> bool:
+        camera = self.renderer.GetActiveCamera()
+        aspect = self.renderer.GetTiledAspectRatio()
+        key = (camera, camera.GetMTime(), self.renderer.GetSize(), self.renderer.GetOrigin(), aspect)
+        if key == self.key:
+            return False
+        self.key = key
+
+        # vtkRenderer.WorldToView uses the composite projection with the depth in [0, 1]
+        matrix = camera.GetCompositeProjectionTransformMatrix(aspect, 0, 1)
+        self.worldToView = np.array([matrix.GetElement(row, column) for row in range(4) for column in range(4)]).reshape(4, 4)
+        self.viewToWorld = np.linalg.inv(self.worldToView)
+
+        width, height = self.renderer.GetSize()
+        originX, originY = self.renderer.GetOrigin()
+        self.viewToDisplay = np.array([
+            [width / 2, 0, 0, originX + width / 2],
+            [0, height / 2, 0, originY + height / 2],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1]])
+        self.displayToView = np.linalg.inv(self.viewToDisplay)
+
+        self.worldToDisplay = self.viewToDisplay @ self.worldToView
+        self.displayToWorld = self.viewToWorld @ self.displayToView
+        return True
+
+    def __apply(self, matrix: np.ndarray, points: Union[np.ndarray, List[List[float]]]) -> np.ndarray:
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        homogeneous = points @ matrix[:, :3].T + matrix[:, 3]
+        w = homogeneous[:, 3:4]
+        return homogeneous[:, :3] / np.where(w != 0, w, 1.0)
+
+    def WorldToView(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.worldToView, points)
+
+    def ViewToWorld(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.viewToWorld, points)
+
+    def ViewToDisplay(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.viewToDisplay, points)
+
+    def DisplayToView(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.displayToView, points)
+
+    def WorldToDisplay(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.worldToDisplay, points)
+
+    def DisplayToWorld(self, points: np.ndarray) -> np.ndarray:
+        self.Update()
+        return self.__apply(self.displayToWorld, points)
+
+    """
+        Description: batch form of utils.convertFromDisplayCoords2WorldCoords, the depth of the points is the depth of reference.
+        Params:
+            points: (N, 2) points in display coordinates
+            reference: a point in world coordinates (e.g. the focal point of the camera)
+        Return: (N, 3) points in world coordinates
+    """
+    def DisplayToWorldAtDepth(self, points: np.ndarray, reference: List[float]) -> np.ndarray:
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        depth = self.WorldToDisplay(reference)[0, 2]
+        return self.DisplayToWorld(np.column_stack([points, np.full(len(points), depth)]))
+
+# Shared transforms of each renderer, used by the one-point helpers of utils
+rendererTransforms = weakref.WeakKeyDictionary()
+
+"""
+    Description: the shared RendererTransforms of a renderer, created on first use.
+        Note: Update() of the shared object may have been called by another user, keep an own RendererTransforms
+        to know whether the camera changed (e.g. utils.LabelProjector).
+"""
+def getRendererTransforms(renderer: vtk.vtkRenderer) -> RendererTransforms:
+    if renderer not in rendererTransforms:
+        rendererTransforms[renderer] = RendererTransforms(renderer)
+    return rendererTransforms[renderer]
+
+"""
+    Description: batch form of utils.findProjectionPoint, projection of secondPoints on the planes through firstPoints
+        with the normal directionOfProjection, along directionOfProjection.
+    Params:
+        firstPoints: (N, 3) or (3,) points in world coordinates
+        secondPoints: (N, 3) or (3,) points in world coordinates
+        directionOfProjection: (N, 3) or (3,) vectors
+    Return: (N, 3) projection points
+"""
+def findProjectionPoints(firstPoints: np.ndarray, secondPoints: np.ndarray, directionOfProjection: np.ndarray) -> np.ndarray:
+    firstPoints = np.asarray(firstPoints, dtype=float).reshape(-1, 3)
+    secondPoints = np.asarray(secondPoints, dtype=float).reshape(-1, 3)
+    directionOfProjection = np.asarray(directionOfProjection, dtype=float).reshape(-1, 3)
+    t = np.sum(directionOfProjection * (firstPoints - secondPoints), axis=1) / np.sum(directionOfProjection * directionOfProjection, axis=1)
+    return secondPoints + directionOfProjection * t[:, np.newaxis]
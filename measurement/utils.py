@@ -1,13 +1,16 @@
 import vtk
 from vtkmodules.vtkCommonCore import vtkMath
-from typing import List
+from typing import List, Optional
+import numpy as np
 import math
+import transforms
 
 """
     Description:
         1. convert the focal point to homogenous coordinates.
         2. convert the focal point to display coordinates then select z-axis.
         3. convert the input point (in display coordinates) with selected z-axis above to world coordinates.
+        One point of transforms.RendererTransforms.DisplayToWorldAtDepth.
     Params:
         point: a point in display coordinates with z = 0
         focalPoint: the focal point of camera object (in world coordinates) used to select z-axis
@@ -15,35 +18,17 @@ import math
     Return: a point (in world coordinates)
 """
 def convertFromDisplayCoords2WorldCoords(point: List[int], focalPoint: List[float], renderer: vtk.vtkRenderer) -> List[float]:
-    # Select z-axis when convert the focal point from homogeneous coordinates to display coordinates
-    renderer.SetWorldPoint(focalPoint[0], focalPoint[1], focalPoint[2], 1) 
-    renderer.WorldToDisplay()
-    displayCoord = renderer.GetDisplayPoint()
-    selectionz = displayCoord[2] # the distance from the position of camera to screen
-
-    # Convert from display coordinates to world coordinates
-    renderer.SetDisplayPoint(point[0], point[1], selectionz)
-    renderer.DisplayToWorld()
-    worldPoint = renderer.GetWorldPoint()
-
-    # Convert from homogeneous coordinates to world coordinates
-    pickPosition = [0, 0, 0]
-    for i in range(3):
-        pickPosition[i] = worldPoint[i] / worldPoint[3] if worldPoint[3] else worldPoint[i]
-    return pickPosition
+    return transforms.getRendererTransforms(renderer).DisplayToWorldAtDepth([point[:2]], focalPoint)[0].tolist()
 
 """
-    Description: convert a point from world coordinates to display coordinates.
+    Description: convert a point from world coordinates to display coordinates, one point of transforms.RendererTransforms.WorldToDisplay.
     Params:
         point: a point (in world coordinates)
         renderer: used to convert coordinates
     Return: a point (in display coordinates)
 """
 def convertFromWorldCoords2DisplayCoords(point: List[float], renderer: vtk.vtkRenderer) -> List[float]:
-    # Specify a point location in world coordinates. This method takes homogeneous coordinates
-    renderer.SetWorldPoint(point[0], point[1], point[2], 1)
-    renderer.WorldToDisplay()
-    return list(renderer.GetDisplayPoint()) # Return specified point location in display coordinates 
+    return transforms.getRendererTransforms(renderer).WorldToDisplay([point[:3]])[0].tolist()
 
 """
     Description:
@@ -67,9 +52,6 @@ def getEuclideanDistanceBetween2Points(firstPoint: List[float], secondPoint: Lis
     Return: the projection point of the second point
 """
 def findProjectionPoint(firstPoint: List[float], secondPoint: List[float], directionOfProjection: List[float]) -> List[float]:
-    x1 = firstPoint[0]; y1 = firstPoint[1]; z1 = firstPoint[2]
-    a = directionOfProjection[0]; b = directionOfProjection[1]; c = directionOfProjection[2]
-    x2 = secondPoint[0]; y2 = secondPoint[1]; z2 = secondPoint[2]
     '''
         The first point: [x1, y1, z1] (in world coordinates)
         The direction of projection: [a, b, c] (the normal vector of the plane, the direction vector of the straight line)
@@ -80,12 +62,9 @@ def findProjectionPoint(firstPoint: List[float], secondPoint: List[float], direc
             x = x2 + at
             y = y2 + bt
             z = z2 + ct
+        One point of transforms.findProjectionPoints.
     '''
-    x = lambda t: x2 + a * t
-    y = lambda t: y2 + b * t
-    z = lambda t: z2 + c * t
-    t = (a * x1 - a * x2 + b * y1 - b * y2 + c * z1 - c * z2) / (a*a + b*b + c*c)
-    return [x(t), y(t), z(t)]
+    return transforms.findProjectionPoints(firstPoint, secondPoint, directionOfProjection)[0].tolist()
 
 """
     Description:
@@ -114,6 +93,112 @@ def getPickPosition(point: List[int], cellPicker: vtk.vtkCellPicker, renderer: v
             pickPosition = projectionPoint
     return pickPosition
 
+"""
+    Description:
+        Coalesces the mouse move events of an interactor style: only the latest position is kept and it is
+        handled at most once per frame by a one-shot timer, a position equal to the handled one is skipped.
+    Params:
+        style: the interactor style, its TimerEvent observer receives the timer
+        callback: called with the latest position (in display coordinates)
+        frameInterval: minimum time between two callbacks in milliseconds (16: 60 frames per second)
+"""
+class MouseMoveCoalescer():
+    def __init__(self, style: vtk.vtkInteractorStyle, callback, frameInterval=16) -> None:
+        self.style = style
+        self.callback = callback
+        self.frameInterval = frameInterval
+        self.position = None # the latest position, not handled yet
+        self.handledPosition = None
+        self.timerId = None
+        style.AddObserver(vtk.vtkCommand.TimerEvent, self.__timerEvent)
+
+    def push(self, position: List[int]) -> None:
+        position = tuple(position)
+        if self.timerId is None and position == self.handledPosition:
+            return
+        self.position = position
+        if self.timerId is None:
+            timerId = self.style.GetInteractor().CreateOneShotTimer(self.frameInterval)
+            if timerId:
+                self.timerId = timerId
+            else: # No timer support, handle the event now
+                self.flush()
+
+    """
+        Description: handle the pending position now, used before a click so that the click sees the latest position.
+    """
+    def flush(self) -> None:
+        if self.timerId is not None:
+            self.style.GetInteractor().DestroyTimer(self.timerId)
+            self.timerId = None
+        if self.position is not None:
+            position, self.position = self.position, None
+            if position != self.handledPosition:
+                self.handledPosition = position
+                self.callback(list(position))
+
+    """
+        Description: drop the pending position, used when the style is replaced.
+    """
+    def cancel(self) -> None:
+        if self.timerId is not None:
+            self.style.GetInteractor().DestroyTimer(self.timerId)
+            self.timerId = None
+        self.position = None
+
+    def __timerEvent(self, obj: vtk.vtkInteractorStyle, event: str) -> None:
+        if self.timerId is None or self.style.GetInteractor().GetTimerEventId() != self.timerId:
+            # Timer of the style itself
+            self.style.OnTimer()
+            return
+        self.timerId = None # One-shot timers are destroyed by the interactor
+        self.flush()
+
+"""
+    Description:
+        Places the text actors of the finished measurements: the anchors (in world coordinates) of all labels are
+        projected with one matrix product before each render of the renderer, only when the camera or the viewport changed.
+    Params:
+        renderer: the renderer of the text actors, its StartEvent triggers the update
+"""
+class LabelProjector():
+    def __init__(self, renderer: vtk.vtkRenderer) -> None:
+        self.renderer = renderer
+        self.transforms = transforms.RendererTransforms(renderer)
+        self.textActors: List[vtk.vtkTextActor] = []
+        self.anchors = np.zeros((0, 3))
+        self.isValid = False
+        renderer.AddObserver(vtk.vtkCommand.StartEvent, self.__startEvent)
+
+    def AddLabel(self, textActor: vtk.vtkTextActor, anchor: List[float]) -> None:
+        self.textActors.append(textActor)
+        self.anchors = np.vstack([self.anchors, np.asarray(anchor, dtype=float).reshape(1, 3)])
+        self.isValid = False
+
+    def RemoveLabel(self, textActor: vtk.vtkTextActor) -> None:
+        if textActor in self.textActors:
+            index = self.textActors.index(textActor)
+            del self.textActors[index]
+            self.anchors = np.delete(self.anchors, index, axis=0)
+
+    """
+        Description: set the display position of all text actors if the camera or the viewport changed.
+        Return: True if the text actors were moved
+    """
+    def Update(self) -> bool:
+        if not self.textActors:
+            return False
+        if not self.transforms.Update() and self.isValid:
+            return False
+        self.isValid = True
+        displayPositions = np.round(self.transforms.WorldToDisplay(self.anchors)[:, :2]).astype(int)
+        for textActor, (x, y) in zip(self.textActors, displayPositions.tolist()):
+            textActor.SetDisplayPosition(x, y)
+        return True
+
+    def __startEvent(self, obj: vtk.vtkRenderer, event: str) -> None:
+        self.Update()
+
 """
     Description:
         Method returns the angle between two vectors.
@@ -147,9 +232,9 @@ def getAngleDegrees(firstPoint: List[float], secondPoint: List[float], thirdPoin
         textActor: need to set its position and input data
         renderer: used to convert coordinates
         points: object contains points in world coordinates
-    Return: None
+    Return: the anchor of the text actor (the middle point, in world coordinates), None if there are not 2 points
 """
-def buildTextActorLengthMeasurement(textActor: vtk.vtkTextActor, renderer: vtk.vtkRenderer, points: vtk.vtkPoints) -> None:
+def buildTextActorLengthMeasurement(textActor: vtk.vtkTextActor, renderer: vtk.vtkRenderer, points: vtk.vtkPoints) -> Optional[List[float]]:
     if points.GetNumberOfPoints() == 2:
         firstPoint = list(points.GetPoint(0))
         secondPoint = list(points.GetPoint(1))
@@ -164,6 +249,8 @@ def buildTextActorLengthMeasurement(textActor: vtk.vtkTextActor, renderer: vtk.v
         # Display the euclide distance and set position of text actor
         textActor.SetInput(f"{round(distance, 1)}mm")
         textActor.SetDisplayPosition(round(displayCoords[0]), round(displayCoords[1]))
+        return midPoint
+    return None
 
 """
     Description:
@@ -174,9 +261,9 @@ def buildTextActorLengthMeasurement(textActor: vtk.vtkTextActor, renderer: vtk.v
         textActor: need to set its position and input data
         renderer: used to convert coordinates
         points: object contains points in world coordinates
-    Return: None
+    Return: the anchor of the text actor (in world coordinates), None if the angle is not defined
 """
-def buildArcAngleMeasurement(arc: vtk.vtkArcSource, textActor: vtk.vtkTextActor, renderer: vtk.vtkRenderer, points: vtk.vtkPoints) -> None:
+def buildArcAngleMeasurement(arc: vtk.vtkArcSource, textActor: vtk.vtkTextActor, renderer: vtk.vtkRenderer, points: vtk.vtkPoints) -> Optional[List[float]]:
     if points.GetNumberOfPoints() == 3:
         # Get three points
         firstPoint = points.GetPoint(0)
@@ -190,7 +277,7 @@ def buildArcAngleMeasurement(arc: vtk.vtkArcSource, textActor: vtk.vtkTextActor,
         vector2 = [thirdPoint[0] - secondPoint[0], thirdPoint[1] - secondPoint[1], thirdPoint[2] - secondPoint[2]]
 
         if (abs(vector1[0]) < 0.001 and abs(vector1[1]) < 0.001 and abs(vector1[2]) < 0.001) or (abs(vector2[0]) < 0.001 and abs(vector2[1]) < 0.001 and abs(vector2[2]) < 0.001):
-            return
+            return None
         
         # Return norm of vector
         l1 = vtkMath.Normalize(vector1) 
@@ -225,6 +312,8 @@ def buildArcAngleMeasurement(arc: vtk.vtkArcSource, textActor: vtk.vtkTextActor,
         textActorPositionDisplay = convertFromWorldCoords2DisplayCoords(textActorPositionWorld, renderer)
         textActor.SetInput(f"{round(angle, 1)}deg")
         textActor.SetPosition(round(textActorPositionDisplay[0]), round(textActorPositionDisplay[1]))
+        return textActorPositionWorld
+    return None
 
 def to_rgb_points(colormap: List[dict]) -> List[list]:
     rgb_points = []
@@ -0,0 +1,86 @@
+import sys
+import os
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cut"))
+
+import vtk
+import numpy as np
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+import bed
+
+'''
+Description: Compare splitSegmentsCoarseToFine and the in place removeBed with the full resolution splitSegments on a phantom: a patient
+    (ellipsoid cylinder with a head) lying on a curved table one voxel below it, a headrest touching nothing
+    and noise islands. The table and the headrest are closer to the patient than a block of the coarse grid.
+    The masks must be equal for every downsampleFactor.
+'''
+SHAPE = (120, 90, 110) # z, y, x (dimensions not a multiple of the factors)
+
+def createPhantom() -> vtk.vtkImageData:
+    z, y, x = np.indices(SHAPE)
+    volume = np.full(SHAPE, -1000, dtype=np.int16)
+    body = ((x - 55) / 40.0) ** 2 + ((y - 45) / 25.0) ** 2 <= 1
+    body &= (z >= 10) & (z < 95)
+    head = ((x - 55) / 18.0) ** 2 + ((y - 48) / 18.0) ** 2 + ((z - 104) / 12.0) ** 2 <= 1
+    volume[body | head] = 40
+    volume[body & (((x - 40) / 6.0) ** 2 + ((y - 45) / 6.0) ** 2 <= 1)] = -800 # lung, inside the patient
+
+    # Table: curved shell 1 voxel below the back of the patient, 2 voxels thick
+    bottom = 45 + 25 * np.sqrt(np.clip(1 - ((x - 55) / 40.0) ** 2, 0, None))
+    table = (y >= bottom + 2) & (y < bottom + 4) & (x >= 8) & (x < 102)
+    volume[table & ~(body | head)] = 200
+    # Headrest: block under the head, 1 voxel gap
+    headrest = (z >= 96) & (z < 116) & (x >= 45) & (x < 65) & (y >= 67) & (y < 72)
+    volume[headrest & ~(body | head | table)] = 300
+
+    random = np.random.default_rng(0)
+    noise = random.random(SHAPE) < 0.002
+    volume[noise & (volume < -500)] = 100
+
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(SHAPE[2], SHAPE[1], SHAPE[0])
+    imageData.SetSpacing(0.9, 0.9, 1.5)
+    imageData.GetPointData().SetScalars(numpy_to_vtk(volume.ravel(), deep=True, array_type=vtk.VTK_SHORT))
+    return imageData
+
+def getVolume(imageData: vtk.vtkImageData) -> np.ndarray:
+    return vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(SHAPE)
+
+def getMask(maskImage: vtk.vtkImageData) -> np.ndarray:
+    return vtk_to_numpy(maskImage.GetPointData().GetScalars()).reshape(SHAPE).astype(bool)
+
+def main() -> None:
+    imageData = createPhantom()
+    failures = 0
+    for minimumSize, maxNumberOfSegments, split in ((1000, 1, True), (10, 3, True), (10, 0, False)):
+        start = time.perf_counter()
+        reference = getMask(bed.splitSegments(imageData, minimumSize, maxNumberOfSegments, split))
+        referenceTime = time.perf_counter() - start
+        for factor in (2, 3, 4):
+            start = time.perf_counter()
+            mask = getMask(bed.splitSegmentsCoarseToFine(imageData, minimumSize, maxNumberOfSegments, split, factor))
+            elapsed = time.perf_counter() - start
+            mismatch = int((mask != reference).sum())
+            failures += mismatch > 0
+            print(f"{'OK  ' if mismatch == 0 else 'FAIL'} coarse-to-fine minimumSize={minimumSize:4} segments={maxNumberOfSegments} split={split!s:5} "
+                  f"factor={factor} voxels={int(reference.sum()):7} mismatch={mismatch:5} "
+                  f"time={elapsed:.3f}s (full resolution {referenceTime:.3f}s)")
+
+            volume = createPhantom()
+            start = time.perf_counter()
+            packedMask = bed.removeBed(volume, minimumSize, maxNumberOfSegments, split, factor)
+            elapsed = time.perf_counter() - start
+            mask = np.unpackbits(packedMask, axis=-1, count=SHAPE[2]).astype(bool)
+            filled = getVolume(volume) == -1000
+            mismatch = int((mask != reference).sum()) + int((~mask & ~filled).sum())
+            failures += mismatch > 0
+            print(f"{'OK  ' if mismatch == 0 else 'FAIL'} removeBed      minimumSize={minimumSize:4} segments={maxNumberOfSegments} split={split!s:5} "
+                  f"factor={factor} voxels={int(reference.sum()):7} mismatch={mismatch:5} time={elapsed:.3f}s")
+
+    print("All cases match" if failures == 0 else f"{failures} case(s) failed")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import sys
+import os
+import struct
+import tempfile
+import zlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cut"))
+
+import bed
+
+'''
+Description: Check bed.readSeriesUID on DICOM files written for each transfer syntax. Before the top level
+    SeriesInstanceUID the data sets hold decoys: a referenced series sequence (0008,1115) whose items contain a
+    (0020,000E), with defined and undefined lengths, and a text value which contains the bytes of the tag.
+'''
+SERIES_UID = "1.2.826.0.1.3680043.2.1125.1"
+DECOY_UID = "9.9.9.9"
+TRANSFER_SYNTAXES = {
+    "implicit little endian": bed.IMPLICIT_VR_LITTLE_ENDIAN,
+    "explicit little endian": "1.2.840.10008.1.2.1",
+    "explicit big endian": bed.EXPLICIT_VR_BIG_ENDIAN,
+    "deflated": bed.DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN,
+}
+
+def pad(value: bytes) -> bytes:
+    return value + b"\x00" if len(value) % 2 else value
+
+def encodeElement(group: int, element: int, vr: bytes, value: bytes, endian="<", explicitVR=True, undefinedLength=False) -> bytes:
+    length = 0xFFFFFFFF if undefinedLength else len(value)
+    header = struct.pack(endian + "HH", group, element)
+    if not explicitVR:
+        return header + struct.pack(endian + "I", length) + value
+    if vr in bed.LONG_VRS:
+        return header + vr + b"\x00\x00" + struct.pack(endian + "I", length) + value
+    return header + vr + struct.pack(endian + "H", length) + value
+
+def encodeItem(dataSet: bytes, endian: str, undefinedLength: bool) -> bytes:
+    if undefinedLength:
+        return struct.pack(endian + "HHI", 0xFFFE, 0xE000, 0xFFFFFFFF) + dataSet + struct.pack(endian + "HHI", 0xFFFE, 0xE00D, 0)
+    return struct.pack(endian + "HHI", 0xFFFE, 0xE000, len(dataSet)) + dataSet
+
+def createDataSet(endian: str, explicitVR: bool) -> bytes:
+    def element(group, element, vr, value, undefinedLength=False):
+        return encodeElement(group, element, vr, value, endian, explicitVR, undefinedLength)
+
+    decoy = element(0x0020, 0x000E, b"UI", pad(DECOY_UID.encode()))
+    nestedSequence = element(0x0008, 0x1140, b"SQ", encodeItem(decoy, endian, True) + struct.pack(endian + "HHI", 0xFFFE, 0xE0DD, 0), True)
+    items = encodeItem(decoy + nestedSequence, endian, True) + encodeItem(decoy, endian, False)
+    return b"".join([
+        element(0x0008, 0x0060, b"CS", b"CT"),
+        element(0x0008, 0x1030, b"LO", pad(b"\x20\x00\x0e\x00UI\x08\x00" + DECOY_UID.encode())),
+        element(0x0008, 0x1115, b"SQ", items + struct.pack(endian + "HHI", 0xFFFE, 0xE0DD, 0), True),
+        element(0x0008, 0x1111, b"SQ", encodeItem(decoy, endian, False)),
+        element(0x0020, 0x000D, b"UI", pad(b"1.2.3")),
+        element(0x0020, 0x000E, b"UI", pad(SERIES_UID.encode())),
+        element(0x7FE0, 0x0010, b"OW", b"\x00" * 32),
+    ])
+
+def createFile(fileName: str, transferSyntax: str) -> None:
+    endian = ">" if transferSyntax == bed.EXPLICIT_VR_BIG_ENDIAN else "<"
+    dataSet = createDataSet(endian, transferSyntax != bed.IMPLICIT_VR_LITTLE_ENDIAN)
+    if transferSyntax == bed.DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        dataSet = compressor.compress(dataSet) + compressor.flush()
+    meta = encodeElement(0x0002, 0x0010, b"UI", pad(transferSyntax.encode()))
+    meta = encodeElement(0x0002, 0x0000, b"UL", struct.pack("<I", len(meta))) + meta
+    with open(fileName, "wb") as file:
+        file.write(b"\x00" * 128 + b"DICM" + meta + dataSet)
+
+def main() -> None:
+    failures = 0
+    with tempfile.TemporaryDirectory() as directoryName:
+        for name, transferSyntax in TRANSFER_SYNTAXES.items():
+            seriesDirectory = os.path.join(directoryName, name.replace(" ", "_"))
+            os.mkdir(seriesDirectory)
+            with open(os.path.join(seriesDirectory, "0000_notes.txt"), "w") as file:
+                file.write("not a DICOM file")
+            createFile(os.path.join(seriesDirectory, "slice0001.dcm"), transferSyntax)
+            seriesUID = bed.readSeriesUID(seriesDirectory)
+            ok = seriesUID == SERIES_UID
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {name:23} {seriesUID}")
+
+    print("All cases match" if failures == 0 else f"{failures} case(s) failed")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
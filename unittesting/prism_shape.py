@@ -0,0 +1,131 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cut"))
+
+import vtk
+import numpy as np
+
+import engine
+import freehandv2
+
+'''
+Description: Compare the axis aligned prism (2D polygon broadcast along an IJK axis) with the polydata to
+    stencil path on the brush models built by freehandv2, for INSIDE and OUTSIDE cuts.
+    The cameras look down each volume axis with a parallel projection (fast path) and one camera is
+    oblique (general PrismShape). The two masks may only differ on voxels at the border of the cut.
+'''
+CONTOUR = [(60, 50), (190, 70), (200, 190), (120, 120), (70, 200)] # concave, display coordinates
+
+def createImageData() -> vtk.vtkImageData:
+    imageData = vtk.vtkImageData()
+    imageData.SetExtent(0, 63, 0, 47, 0, 39)
+    imageData.SetSpacing(0.8, 0.8, 1.25)
+    imageData.SetOrigin(-20, 15, 40)
+    imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    imageData.GetPointData().GetScalars().Fill(0)
+    return imageData
+
+'''
+Description: Draw CONTOUR with the freehand style and return the queued shape and the brush model (IJK).
+'''
+def drawCut(renderWindow: vtk.vtkRenderWindow, imageData: vtk.vtkImageData, operation: freehandv2.Operation) -> tuple:
+    modifierLabelmap = vtk.vtkImageData()
+    modifierLabelmap.DeepCopy(imageData)
+    mapper = vtk.vtkFixedPointVolumeRayCastMapper()
+    mapper.SetInputData(imageData)
+    cutEngine = engine.CutEngine(imageData, modifierLabelmap, mapper)
+    interactor = renderWindow.GetInteractor()
+    # Keep the cut queued: the renderer of the engine is never rendered and the interactor loop doesn't run
+    cutEngine.attach(vtk.vtkRenderer(), interactor)
+
+    contour2Dpipeline = freehandv2.Contour2DPipeline()
+    style = freehandv2.CropFreehandInteractorStyle(contour2Dpipeline, imageData, modifierLabelmap, operation, cutEngine)
+    interactor.SetInteractorStyle(style)
+    interactor.SetEventPosition(*CONTOUR[0])
+    style.InvokeEvent(vtk.vtkCommand.LeftButtonPressEvent)
+    for position in CONTOUR[1:]:
+        interactor.SetEventPosition(*position)
+        style.InvokeEvent(vtk.vtkCommand.MouseMoveEvent)
+    interactor.SetEventPosition(*CONTOUR[0])
+    style.InvokeEvent(vtk.vtkCommand.LeftButtonReleaseEvent)
+
+    _, shape = cutEngine.pendingOperations[-1]
+    brushModelIjk = vtk.vtkPolyData()
+    brushModelIjk.DeepCopy(style.worldToModifierLabelmapIjkTransformer.GetOutput())
+    return shape, brushModelIjk
+
+'''
+Description: Voxels which have a neighbor (6-connectivity) with another value, in either mask.
+'''
+def getBorder(mask: np.ndarray) -> np.ndarray:
+    border = np.zeros_like(mask)
+    for axis in range(3):
+        different = np.diff(mask, axis=axis)
+        before = [slice(None)] * 3
+        after = [slice(None)] * 3
+        before[axis] = slice(None, -1)
+        after[axis] = slice(1, None)
+        border[tuple(before)] |= different
+        border[tuple(after)] |= different
+    return border
+
+def main() -> None:
+    imageData = createImageData()
+    wholeExtent = list(imageData.GetExtent())
+    center = np.array(imageData.GetCenter())
+
+    renderer = vtk.vtkRenderer()
+    renderWindow = vtk.vtkRenderWindow()
+    renderWindow.SetOffScreenRendering(1)
+    renderWindow.SetSize(256, 256)
+    renderWindow.AddRenderer(renderer)
+    interactor = vtk.vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(renderWindow)
+    outline = vtk.vtkOutlineFilter()
+    outline.SetInputData(imageData)
+    outlineMapper = vtk.vtkPolyDataMapper()
+    outlineMapper.SetInputConnection(outline.GetOutputPort())
+    outlineActor = vtk.vtkActor()
+    outlineActor.SetMapper(outlineMapper)
+    renderer.AddActor(outlineActor)
+
+    # Direction of projection, view up, expected fast path
+    cameras = [
+        ([0, 0, -1], [0, 1, 0], True),
+        ([0, 0, 1], [0, 1, 0], True),
+        ([0, 1, 0], [0, 0, 1], True),
+        ([-1, 0, 0], [0, 0, 1], True),
+        ([1, 1, -1], [0, 0, 1], False)
+    ]
+    failures = 0
+    for directionOfProjection, viewUp, isAxisAligned in cameras:
+        camera = renderer.GetActiveCamera()
+        camera.ParallelProjectionOn()
+        camera.SetFocalPoint(center)
+        camera.SetPosition(center - 200 * np.array(directionOfProjection, dtype=float))
+        camera.SetViewUp(viewUp)
+        renderer.ResetCamera()
+        renderWindow.Render()
+
+        for operation in (freehandv2.Operation.INSIDE, freehandv2.Operation.OUTSIDE):
+            inverted = operation == freehandv2.Operation.OUTSIDE
+            shape, brushModelIjk = drawCut(renderWindow, imageData, operation)
+            reference = engine.PrismShape(brushModelIjk, inverted)
+            mask = shape.rasterize(wholeExtent)
+            referenceMask = reference.rasterize(wholeExtent)
+
+            mismatch = mask != referenceMask
+            outsideBorder = mismatch & ~(getBorder(mask) | getBorder(referenceMask))
+            detected = isinstance(shape, engine.AxisAlignedPrismShape)
+            ok = detected == isAxisAligned and not outsideBorder.any() and mismatch.sum() <= 0.02 * referenceMask.sum()
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} dop={directionOfProjection} {operation.name:7} "
+                  f"{type(shape).__name__:21} voxels={int(referenceMask.sum()):6} mismatch={int(mismatch.sum()):4} "
+                  f"off border={int(outsideBorder.sum())}")
+
+    print("All cases match" if failures == 0 else f"{failures} case(s) failed")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()